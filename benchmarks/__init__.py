@@ -0,0 +1,2 @@
+# Воспроизводимые замеры производительности отчетов, загрузки и записи курсов.
+# Запуск: python -m benchmarks.run --scale 10k --output results.json
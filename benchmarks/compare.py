@@ -0,0 +1,30 @@
+import sys
+import json
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare(before, after):
+    """Строки сравнения медиан двух запусков: сценарий, было, стало, отношение"""
+    lines = []
+    for name in sorted(set(before) | set(after)):
+        old = before.get(name, {}).get('median_ms')
+        new = after.get(name, {}).get('median_ms')
+        if old is None or new is None:
+            lines.append(f"{name:50} {old if old is not None else '-':>12} {new if new is not None else '-':>12}")
+            continue
+        ratio = new / old if old else float('inf')
+        lines.append(f"{name:50} {old:>12.3f} {new:>12.3f} {ratio:>8.2f}x")
+    return lines
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Использование: python -m benchmarks.compare before.json after.json")
+        sys.exit(2)
+    print(f"{'сценарий':50} {'было, мс':>12} {'стало, мс':>12} {'стало/было':>9}")
+    for line in compare(load(sys.argv[1]), load(sys.argv[2])):
+        print(line)
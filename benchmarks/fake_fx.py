@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from fx_client import FxClient
+
+RESPONSES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fx_responses')
+CURRENCIES = ['USD', 'EUR', 'RUB', 'UAH', 'INR', 'TRY']
+
+
+class FakeFx:
+    """
+    Локальная замена API курсов: отдает записанные ответы /latest/<base>
+    из fx_responses и собирает из них ответы /pair/<from>/<to>.
+    Может добавлять задержку и отвечать 503 на каждый fail_every-й запрос.
+    """
+
+    def __init__(self, responses_dir=RESPONSES_DIR, latency=0.0, fail_every=0):
+        self.responses_dir = responses_dir
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+
+    def latest(self, base):
+        path = os.path.join(self.responses_dir, f"latest_{base}.json")
+        if not os.path.exists(path):
+            return 404, {'result': 'error', 'error-type': 'unsupported-code'}
+        with open(path, encoding='utf-8') as f:
+            return 200, json.load(f)
+
+    def pair(self, from_currency, to_currency):
+        status, data = self.latest(from_currency)
+        if status != 200 or to_currency not in data['conversion_rates']:
+            return 404, {'result': 'error', 'error-type': 'unsupported-code'}
+        return 200, {
+            'result': 'success',
+            'base_code': from_currency,
+            'target_code': to_currency,
+            'conversion_rate': data['conversion_rates'][to_currency],
+        }
+
+    def respond(self, path):
+        # /<ключ>/latest/<base> или /<ключ>/pair/<from>/<to>
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[1] == 'latest':
+            return self.latest(parts[2].upper())
+        if len(parts) == 4 and parts[1] == 'pair':
+            return self.pair(parts[2].upper(), parts[3].upper())
+        return 404, {'result': 'error', 'error-type': 'unknown-endpoint'}
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self.fail_every and self.requests % self.fail_every == 0:
+                    status, data = 503, {'result': 'error', 'error-type': 'unavailable'}
+                else:
+                    status, data = self.respond(request_line.split()[1].decode())
+                payload = json.dumps(data).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def fetch_pairs_one_by_one(api_url, pairs):
+    """Прежний способ: отдельный запрос /pair на каждую пару, по очереди и без повторов"""
+    rates = {}
+    for from_currency, to_currency in pairs:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(f"{api_url}/benchmark/pair/{from_currency}/{to_currency}")
+        if response.status_code == 200:
+            rates[(from_currency, to_currency)] = response.json()['conversion_rate']
+    return rates
+
+
+async def run(args):
+    fake = FakeFx(latency=args.latency / 1000, fail_every=args.fail_every)
+    server = await asyncio.start_server(fake.serve, '127.0.0.1', args.port)
+    api_url = f"http://127.0.0.1:{args.port}"
+    pairs = [(f, t) for f in CURRENCIES for t in CURRENCIES if f != t]
+    results = {}
+    try:
+        for name in ('one_by_one', 'batched'):
+            fake.requests = 0
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                if name == 'one_by_one':
+                    rates = await fetch_pairs_one_by_one(api_url, pairs)
+                else:
+                    # Новый клиент на каждый проход, чтобы не мерить кэш ответов
+                    async with FxClient(api_url, 'benchmark') as client:
+                        rates = await client.rates(pairs)
+            elapsed = time.perf_counter() - started
+            results[name] = {
+                'pairs': len(rates),
+                'requests_per_round': fake.requests / args.rounds,
+                'seconds_per_round': round(elapsed / args.rounds, 4),
+            }
+    finally:
+        server.close()
+        await server.wait_closed()
+    return results
+
+
+async def record(responses_dir, currencies):
+    """Записывает настоящие ответы API (нужен EXCHANGE_RATE_API_KEY)"""
+    client = FxClient()
+    try:
+        for base in currencies:
+            response = await client._http().get(f"/latest/{base}")
+            response.raise_for_status()
+            path = os.path.join(responses_dir, f"latest_{base}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(response.json(), indent=2) + '\n')
+            print(f"Записан {path}", file=sys.stderr)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный сервер курсов валют с записанными ответами")
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=50, help="задержка ответа, мс")
+    parser.add_argument('--fail-every', type=int, default=0, help="отвечать 503 на каждый N-й запрос")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--serve', action='store_true', help="только запустить сервер (FX_API_URL=http://127.0.0.1:<порт>)")
+    parser.add_argument('--record', action='store_true', help="обновить записанные ответы из настоящего API")
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(RESPONSES_DIR, CURRENCIES))
+    elif args.serve:
+        async def serve():
+            fake = FakeFx(latency=args.latency / 1000, fail_every=args.fail_every)
+            server = await asyncio.start_server(fake.serve, '127.0.0.1', args.port)
+            print(f"FX_API_URL=http://127.0.0.1:{args.port}", file=sys.stderr)
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import parse_qs
+
+import httpx
+
+from benchmarks.fixture import benchmark_database_url, prepare_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = '123456:benchmark'
+SECRET_TOKEN = 'benchmark-secret'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+
+
+class FakeTelegram:
+    """
+    Локальная замена Bot API: отвечает на вызовы бота, отдает обновления
+    через getUpdates (polling) и считает ответы бота на них.
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.new_updates = asyncio.Condition()
+        self.ready = asyncio.Event()
+        self.replies = 0
+        self.all_replied = asyncio.Event()
+        self.expected = None
+        self.last_reply = None
+        self.message_id = 0
+
+    def add_updates(self, updates):
+        self.updates.extend(updates)
+
+    async def notify(self):
+        async with self.new_updates:
+            self.new_updates.notify_all()
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = min(float(params.get('timeout') or 0), 10)
+        self.ready.set()
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            async with self.new_updates:
+                try:
+                    await asyncio.wait_for(self.new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self.updates[:int(params.get('limit') or 100)]
+
+    def reply(self, params):
+        self.replies += 1
+        self.last_reply = time.perf_counter()
+        if self.expected is not None and self.replies >= self.expected:
+            self.all_replied.set()
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def call(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'setWebhook':
+            self.ready.set()
+            return True
+        if method == 'sendMessage':
+            return self.reply(params)
+        return True
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = request_line.split()[1].decode().rstrip('/').rsplit('/', 1)[-1]
+                result = await self.call(method, self._parameters(headers, body))
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parameters(headers, body):
+        """Параметры вызова: JSON или форма, в которой значения закодированы в JSON"""
+        if not body:
+            return {}
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body)
+        params = {}
+        for name, values in parse_qs(body.decode()).items():
+            try:
+                params[name] = json.loads(values[0])
+            except ValueError:
+                params[name] = values[0]
+        return params
+
+
+def start_updates(count, chats, first_id=1):
+    """Обновления с командой /start от chats разных чатов"""
+    updates = []
+    for i in range(count):
+        chat_id = 1000 + i % chats
+        updates.append({
+            'update_id': first_id + i,
+            'message': {
+                'message_id': i + 1,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            },
+        })
+    return updates
+
+
+async def post_updates(updates, url, connections):
+    """Отправляет обновления на вебхук бота, как это делает Telegram"""
+    limits = httpx.Limits(max_connections=connections)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET_TOKEN}
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        semaphore = asyncio.Semaphore(connections)
+
+        async def post(update):
+            async with semaphore:
+                response = await client.post(url, json=update, headers=headers)
+                response.raise_for_status()
+        await asyncio.gather(*(post(update) for update in updates))
+
+
+async def wait_for_webhook(url, timeout=30):
+    """Ждет, пока встроенный сервер бота начнет принимать соединения"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=5) as client:
+        while True:
+            try:
+                # Без секретного токена сервер отвечает 403 - значит, он уже работает
+                await client.post(url, json={})
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def run(args):
+    fake = FakeTelegram()
+    server = await asyncio.start_server(fake.serve, '127.0.0.1', args.api_port)
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}/telegram"
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_BASE_URL=f"http://127.0.0.1:{args.api_port}",
+        BOT_MODE=args.mode,
+        WEBHOOK_LISTEN='127.0.0.1',
+        WEBHOOK_PORT=str(args.webhook_port),
+        WEBHOOK_URL_PATH='telegram',
+        WEBHOOK_URL=webhook_url,
+        WEBHOOK_SECRET_TOKEN=SECRET_TOKEN,
+        WEBHOOK_MAX_CONNECTIONS=str(args.connections),
+    )
+    bot = await asyncio.create_subprocess_exec(sys.executable, 'main.py', cwd=ROOT, env=env)
+    try:
+        await asyncio.wait_for(fake.ready.wait(), args.startup_timeout)
+        updates = start_updates(args.updates, args.chats)
+        fake.expected = len(updates)
+        started = time.perf_counter()
+        if args.mode == 'webhook':
+            await wait_for_webhook(webhook_url)
+            started = time.perf_counter()
+            await post_updates(updates, webhook_url, args.connections)
+        else:
+            fake.add_updates(updates)
+            await fake.notify()
+        await asyncio.wait_for(fake.all_replied.wait(), args.timeout)
+        elapsed = fake.last_reply - started
+        return {
+            'mode': args.mode,
+            'updates': len(updates),
+            'chats': args.chats,
+            'connections': args.connections,
+            'seconds': round(elapsed, 3),
+            'updates_per_second': round(len(updates) / elapsed, 1),
+        }
+    finally:
+        bot.terminate()
+        await bot.wait()
+        server.close()
+        await server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность бота с локальной заменой Telegram")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='webhook')
+    parser.add_argument('--updates', type=int, default=1000, help="сколько обновлений отправить")
+    parser.add_argument('--chats', type=int, default=50, help="из скольких разных чатов")
+    parser.add_argument('--connections', type=int, default=40, help="одновременных соединений с вебхуком")
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-port', type=int, default=8443)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    # Боту нужна база при запуске; обработка /start к ней не обращается
+    os.environ['DATABASE_URL'] = benchmark_database_url()
+    prepare_database(1000, 30, 42)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+
+from sqlalchemy import create_engine
+
+# Готовые SQLite-базы хранятся здесь и переиспользуются между запусками
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+# Рабочая копия базы, с которой идут замеры
+WORKING_DB = os.path.join(DATA_DIR, 'run.sqlite')
+
+
+def sqlite_url(path):
+    return f"sqlite:///{path}"
+
+
+def benchmark_database_url(database_url=None):
+    """
+    URL базы для замеров. Его нужно записать в DATABASE_URL до импорта
+    модулей бота: database.py создает подключения при импорте.
+    """
+    return database_url or sqlite_url(WORKING_DB)
+
+
+def prepare_database(rows, days, seed, database_url=None):
+    """
+    Готовит базу для замеров и возвращает ее URL.
+    Без database_url создается локальная SQLite-база: набор данных генерируется
+    один раз на (rows, days, seed), а каждый запуск работает с копией,
+    поэтому записи в ходе замеров не влияют на следующий запуск.
+    С database_url (например, пустая база PostgreSQL) схема создается заново.
+    """
+    # Модели и генератор импортируются здесь: database.py читает DATABASE_URL при импорте
+    from models import Base
+    from benchmarks.generate import generate
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if database_url:
+        engine = create_engine(database_url)
+        Base.metadata.drop_all(engine)
+        _create_schema(engine)
+        generate(engine, rows, days, seed)
+        _build_ledger(engine)
+        engine.dispose()
+        return database_url
+
+    template = os.path.join(DATA_DIR, f"ledger-{rows}-{days}-{seed}.sqlite")
+    if not os.path.exists(template):
+        partial = template + '.tmp'
+        if os.path.exists(partial):
+            os.remove(partial)
+        engine = create_engine(sqlite_url(partial))
+        _create_schema(engine)
+        generate(engine, rows, days, seed)
+        _build_ledger(engine)
+        engine.dispose()
+        os.replace(partial, template)
+
+    shutil.copyfile(template, WORKING_DB)
+    # Шаблоны, созданные до появления ledger_builds, доводятся до текущей схемы
+    engine = create_engine(sqlite_url(WORKING_DB))
+    _create_schema(engine)
+    engine.dispose()
+    return sqlite_url(WORKING_DB)
+
+
+def _create_schema(engine):
+    from migrate_db import run_migrations
+    run_migrations(engine)
+
+
+def _build_ledger(engine):
+    # Данные вставлены в обход бота: итоги казны строятся заново
+    from ledger_totals import build
+    build(engine, force=True)
@@ -0,0 +1,121 @@
+import random
+from itertools import islice
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from models import Investor, Purchase, Transfer, ServicePurchase, ExchangeRate, Currency, PeriodUnit
+
+# Размеры синтетического набора данных: общее число записей переводов и покупок
+SCALES = {
+    '1k': 1_000,
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# Примерные курсы к рублю, вокруг которых генерируются дневные курсы
+BASE_RATES = {
+    'USD': 90.0,
+    'EUR': 98.0,
+    'UAH': 2.4,
+    'INR': 1.1,
+    'TRY': 2.8,
+}
+
+SERVICES = ['ChatGPT Plus', 'Midjourney', 'Coursera', 'Notion', 'GitHub Copilot', 'Figma', 'Udemy']
+
+START_DATE = date(2023, 1, 1)
+BATCH_SIZE = 10_000
+
+
+def _insert(connection, model, records):
+    """Вставляет записи из итератора пакетами; возвращает их число"""
+    records = iter(records)
+    count = 0
+    while batch := list(islice(records, BATCH_SIZE)):
+        connection.execute(insert(model), batch)
+        count += len(batch)
+    return count
+
+
+def rate_records(days, seed=42):
+    """Дневные курсы всех валют к RUB и USD (в обе стороны) за days дней"""
+    rnd = random.Random(seed)
+    records = []
+    for offset in range(days):
+        day = START_DATE + timedelta(days=offset)
+        to_rub = {currency: base * rnd.uniform(0.95, 1.05) for currency, base in BASE_RATES.items()}
+        for currency, rate in to_rub.items():
+            pairs = [(currency, 'RUB', rate)]
+            if currency != 'USD':
+                pairs.append((currency, 'USD', rate / to_rub['USD']))
+            for from_currency, to_currency, value in pairs:
+                records.append({'from_currency': from_currency, 'to_currency': to_currency, 'rate': value, 'date': day})
+                records.append({'from_currency': to_currency, 'to_currency': from_currency, 'rate': 1 / value, 'date': day})
+    return records
+
+
+def ledger_records(rows, days, seed=42):
+    """
+    Инвесторы, переводы, покупки инвесторов и покупки сервисов общим числом rows.
+    Возвращает словарь {модель: итератор записей}; id инвесторов начинаются с 1.
+    Итераторы нужно потреблять по порядку, тогда результат не зависит от размера пакета.
+    """
+    rnd = random.Random(seed)
+    currencies = list(Currency)
+    units = list(PeriodUnit)
+    investors = max(10, rows // 100)
+
+    def day():
+        return START_DATE + timedelta(days=rnd.randrange(days))
+
+    def currency():
+        # Рубли и доллары встречаются чаще остальных валют
+        return rnd.choices(currencies, weights=[30, 15, 40, 5, 5, 5])[0]
+
+    return {
+        Investor: ({'full_name': f"Инвестор {i:06d}"} for i in range(1, investors + 1)),
+        Transfer: (
+            {
+                'investor_id': rnd.randint(1, investors),
+                'amount': round(rnd.uniform(100, 100_000), 2),
+                'currency': currency(),
+                'transfer_date': day(),
+            }
+            for _ in range(rows * 6 // 10)
+        ),
+        Purchase: (
+            {
+                'investor_id': rnd.randint(1, investors),
+                'service_name': rnd.choice(SERVICES),
+                'amount': round(rnd.uniform(10, 5_000), 2),
+                'currency': currency(),
+                'purchase_date': day(),
+                'period': rnd.choice([1, 3, 12]),
+                'period_unit': rnd.choice(units),
+            }
+            for _ in range(rows // 10)
+        ),
+        ServicePurchase: (
+            {
+                'service_name': rnd.choice(SERVICES),
+                'amount': round(rnd.uniform(10, 5_000), 2),
+                'currency': currency(),
+                'purchase_date': day(),
+                'period': rnd.choice([1, 3, 12]),
+                'period_unit': rnd.choice(units),
+            }
+            for _ in range(rows - rows * 6 // 10 - rows // 10)
+        ),
+    }
+
+
+def generate(engine, rows, days=730, seed=42):
+    """Заполняет пустую базу синтетическими данными; возвращает число записей по таблицам"""
+    counts = {}
+    with engine.begin() as connection:
+        for model, records in ledger_records(rows, days, seed).items():
+            counts[model.__tablename__] = _insert(connection, model, records)
+        counts[ExchangeRate.__tablename__] = _insert(connection, ExchangeRate, rate_records(days, seed))
+    return counts
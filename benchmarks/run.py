@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import asyncio
+import platform
+import argparse
+
+from benchmarks.fixture import benchmark_database_url, prepare_database
+from benchmarks.generate import SCALES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Замеры производительности отчетов и загрузки данных")
+    parser.add_argument('--scale', choices=SCALES, default='10k', help="размер набора данных")
+    parser.add_argument('--days', type=int, default=730, help="за сколько дней генерируются данные и курсы")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5, help="сколько раз выполняется каждый сценарий")
+    parser.add_argument('--import-rows', type=int, default=5000, help="строк в Excel-файле для сценария загрузки")
+    parser.add_argument('--database-url', help="пустая база вместо локальной SQLite (данные будут удалены)")
+    parser.add_argument('--only', nargs='*', help="выполнять только сценарии, содержащие эти подстроки")
+    parser.add_argument('--output', help="файл для результатов в JSON (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rows = SCALES[args.scale]
+    # До импорта модулей бота: они подключаются к DATABASE_URL при импорте
+    os.environ['DATABASE_URL'] = benchmark_database_url(args.database_url)
+
+    print(f"Подготовка базы ({args.scale})...", file=sys.stderr)
+    database_url = prepare_database(rows, args.days, args.seed, args.database_url)
+
+    import sqlalchemy
+    from sqlalchemy.engine import make_url
+    from benchmarks.scenarios import run_scenarios
+
+    results = asyncio.run(run_scenarios(args.repeat, args.import_rows, args.only))
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'rows': rows,
+            'days': args.days,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'database': make_url(database_url).get_backend_name(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'conversion_mode': os.getenv('CONVERSION_MODE', 'sql'),
+            'rate_lookup_mode': os.getenv('RATE_LOOKUP_MODE', 'exact'),
+        },
+        'results': results,
+    }
+    # Сортированные ключи и отступы: результаты двух запусков удобно сравнивать diff'ом
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
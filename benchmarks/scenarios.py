@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import random
+import statistics
+from datetime import timedelta
+from types import SimpleNamespace
+
+from openpyxl import Workbook
+
+import main
+import load_data
+from database import AsyncSession
+from report_cache import report_cache
+from excel_stream import TRANSFER_COLUMNS
+from benchmarks.generate import START_DATE
+from benchmarks.fixture import DATA_DIR
+
+MODES = ['sql', 'grouped', 'rows']
+TARGET_CURRENCY = 'RUB'
+
+
+async def measure(func, repeat):
+    """
+    Выполняет func repeat раз; перед каждым запуском сбрасывается кэш отчетов,
+    чтобы замерялся расчет, а не чтение готового результата.
+    """
+    timings = []
+    for _ in range(repeat):
+        report_cache.bump()
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'runs': repeat,
+        'first_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def _with_session(calculate, *args, **kwargs):
+    async def run():
+        session = AsyncSession()
+        try:
+            await calculate(session, *args, **kwargs)
+        finally:
+            await session.close()
+    return run
+
+
+async def _investor_pages(investor_id, all_pages):
+    """Строит первую страницу отчета инвестора или проходит по всем страницам"""
+    async with AsyncSession() as session:
+        after, start = None, 1
+        while True:
+            _, _, next_page = await main.get_investor_transfers_page(
+                session, investor_id, TARGET_CURRENCY, main.TELEGRAM_MESSAGE_LIMIT, after, start
+            )
+            if not all_pages or next_page is None:
+                return
+            after, start = next_page
+
+
+def write_transfers_workbook(path, rows, seed=42):
+    """Excel-файл переводов в формате investor_transfers.xlsx: половина строк - новые инвесторы"""
+    rnd = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(TRANSFER_COLUMNS)
+    for i in range(rows):
+        name = f"Инвестор {rnd.randint(1, 100):06d}" if i % 2 else f"Новый инвестор {i % 500:04d}"
+        day = START_DATE + timedelta(days=rnd.randrange(730))
+        sheet.append([name, f"{rnd.uniform(100, 100_000):.2f}".replace('.', ','), rnd.choice(['RUB', 'USD', 'EUR']), day])
+    workbook.save(path)
+
+
+class FakeMessage:
+    """Минимальное сообщение Telegram для вызова обработчика без сети"""
+
+    def __init__(self, text):
+        self.text = text
+
+    async def reply_text(self, *args, **kwargs):
+        return self
+
+
+def rate_write(counter):
+    """Запись нового курса через process_rate_value; каждый вызов - новая дата"""
+    async def run():
+        counter[0] += 1
+        update = SimpleNamespace(message=FakeMessage('91,25'))
+        context = SimpleNamespace(user_data={
+            'from_currency': 'USD',
+            'to_currency': 'RUB',
+            'rate_date': START_DATE - timedelta(days=counter[0]),
+        })
+        await main.process_rate_value(update, context)
+    return run
+
+
+async def run_scenarios(repeat, import_rows, selected=None):
+    """Выполняет замеры и возвращает {сценарий: результат}"""
+    scenarios = {}
+    for mode in MODES:
+        scenarios[f'calculate_total_purchases[{mode}]'] = _with_session(
+            main.calculate_total_purchases, TARGET_CURRENCY, mode)
+        scenarios[f'calculate_total_investments[{mode}]'] = _with_session(
+            main.calculate_total_investments, TARGET_CURRENCY, mode)
+        scenarios[f'calculate_investor_investments[{mode}]'] = _with_session(
+            main.calculate_investor_investments, 1, TARGET_CURRENCY, mode)
+    scenarios['calculate_treasury'] = _with_session(main.calculate_treasury, TARGET_CURRENCY)
+    scenarios['investor_transfers[first_page]'] = lambda: _investor_pages(1, all_pages=False)
+    scenarios['investor_transfers[all_pages]'] = lambda: _investor_pages(1, all_pages=True)
+    scenarios['process_rate_value'] = rate_write([0])
+
+    workbook = os.path.join(DATA_DIR, f'transfers-{import_rows}.xlsx')
+    if not os.path.exists(workbook):
+        write_transfers_workbook(workbook, import_rows)
+
+    async def load():
+        # Первый запуск добавляет строки, повторные проверяют отсев дубликатов
+        load_data.load_investor_transfers(workbook)
+    scenarios[f'load_investor_transfers[{import_rows}]'] = load
+
+    results = {}
+    for name, func in scenarios.items():
+        if selected and not any(part in name for part in selected):
+            continue
+        print(f"{name}...", file=sys.stderr, flush=True)
+        results[name] = await measure(func, repeat)
+    return results
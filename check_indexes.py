@@ -0,0 +1,72 @@
+import sys
+from datetime import date
+from sqlalchemy import text
+from database import engine
+
+# Запросы, которые должны выполняться по индексам, и ожидаемый индекс
+CHECKS = [
+    (
+        "Переводы инвестора по датам",
+        "SELECT * FROM transfers WHERE investor_id = :investor_id ORDER BY transfer_date",
+        "ix_transfers_investor_date",
+    ),
+    (
+        "Переводы за период",
+        "SELECT * FROM transfers WHERE transfer_date BETWEEN :date_from AND :date_to",
+        "ix_transfers_transfer_date",
+    ),
+    (
+        "Покупки за период",
+        "SELECT * FROM purchases WHERE purchase_date BETWEEN :date_from AND :date_to",
+        "ix_purchases_purchase_date",
+    ),
+    (
+        "Покупки сервисов за период",
+        "SELECT * FROM service_purchases WHERE purchase_date BETWEEN :date_from AND :date_to",
+        "ix_service_purchases_purchase_date",
+    ),
+    (
+        "Курс валют на дату",
+        "SELECT rate FROM exchange_rates WHERE from_currency = :from_currency "
+        "AND to_currency = :to_currency AND date = :date_from",
+        "ux_exchange_rates_pair_date",
+    ),
+]
+
+PARAMS = {
+    'investor_id': 1,
+    'date_from': date(2024, 1, 1),
+    'date_to': date(2024, 12, 31),
+    'from_currency': 'USD',
+    'to_currency': 'RUB',
+}
+
+def explain(connection, sql):
+    """Возвращает план выполнения запроса в виде текста"""
+    if connection.dialect.name == 'sqlite':
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), PARAMS).all()
+        return "\n".join(str(row[-1]) for row in rows)
+    rows = connection.execute(text(f"EXPLAIN {sql}"), PARAMS).all()
+    return "\n".join(row[0] for row in rows)
+
+def check_indexes():
+    """Проверка того, что запросы по инвестору и по датам используют индексы"""
+    failed = 0
+    with engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # На маленьких таблицах планировщик предпочитает полный просмотр,
+            # поэтому проверяем, что индекс вообще может быть использован
+            connection.execute(text("SET enable_seqscan = off"))
+        for title, sql, index_name in CHECKS:
+            plan = explain(connection, sql)
+            if index_name in plan:
+                print(f"OK    {title}: {index_name}")
+            else:
+                failed += 1
+                print(f"ОШИБКА {title}: индекс {index_name} не используется")
+                print(plan)
+    return failed
+
+if __name__ == "__main__":
+    print("Проверка использования индексов:")
+    sys.exit(1 if check_indexes() else 0)
@@ -1,5 +1,4 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from database import ReadSession
 from models import Transfer, Investor
 import os
 from dotenv import load_dotenv
@@ -8,14 +7,9 @@ from datetime import datetime
 # Загрузка переменных окружения
 load_dotenv()
 
-# Подключение к базе данных
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
-
 def check_transfers():
     """Проверка переводов в базе данных"""
+    session = ReadSession()
     try:
         # Получаем всех инвесторов
         investors = session.query(Investor).all()
@@ -73,6 +67,8 @@ def check_transfers():
             
     except Exception as e:
         print(f"ОШИБКА при выполнении скрипта: {str(e)}")
+    finally:
+        session.close()
 
 if __name__ == "__main__":
     print("Проверка данных в базе:")
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Transfer
+from sqlalchemy import select, delete, func
+from database import engine, Session
+from models import Transfer, Purchase, ServicePurchase
+from ledger_totals import remove_entries
+from report_cache import bump_data_version
 import os
+import sys
 from dotenv import load_dotenv
 import logging
 
@@ -12,47 +15,66 @@ logger = logging.getLogger(__name__)
 # Загрузка переменных окружения
 load_dotenv()
 
-# Подключение к базе данных
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
+# Сколько строк удаляется одной транзакцией
+DEDUPE_CHUNK_SIZE = int(os.getenv('DEDUPE_CHUNK_SIZE', '5000'))
 
-def clean_duplicate_transfers():
+# Поля, совпадение которых означает дубликат записи
+DEDUPE_KEYS = {
+    Transfer: [Transfer.investor_id, Transfer.amount, Transfer.currency, Transfer.transfer_date],
+    Purchase: [Purchase.investor_id, Purchase.service_name, Purchase.amount, Purchase.currency,
+               Purchase.purchase_date, Purchase.period, Purchase.period_unit],
+    ServicePurchase: [ServicePurchase.service_name, ServicePurchase.amount, ServicePurchase.currency,
+                      ServicePurchase.purchase_date, ServicePurchase.period, ServicePurchase.period_unit],
+}
+
+def surplus_ids(connection, model):
+    """
+    id лишних записей таблицы model: в каждой группе одинаковых записей
+    остается запись с наименьшим id, остальные возвращаются
+    """
+    numbered = select(
+        model.id,
+        func.row_number().over(partition_by=DEDUPE_KEYS[model], order_by=model.id).label('row_number')
+    ).subquery()
+    result = connection.execute(select(numbered.c.id).where(numbered.c.row_number > 1).order_by(numbered.c.id))
+    return result.scalars().all()
+
+def clean_duplicates(model, dry_run=False, chunk_size=DEDUPE_CHUNK_SIZE):
+    """Удаляет дубликаты из таблицы model на месте; возвращает число лишних записей"""
+    table = model.__tablename__
+    with engine.connect() as connection:
+        ids = surplus_ids(connection, model)
+        total = connection.execute(select(func.count(model.id))).scalar()
+    logger.info(f"{table}: записей {total}, дубликатов {len(ids)}")
+    if dry_run or not ids:
+        return len(ids)
+
+    deleted = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        # Каждая порция - отдельная короткая транзакция, вместе с поправкой итогов казны
+        with Session() as session:
+            remove_entries(session, model, chunk)
+            deleted += session.execute(delete(model).where(model.id.in_(chunk))).rowcount
+            bump_data_version(session)
+            session.commit()
+        logger.info(f"{table}: удалено {deleted} из {len(ids)}")
+    return deleted
+
+def clean_duplicate_transfers(dry_run=False):
     """Удаление дубликатов переводов из базы данных"""
-    try:
-        # Получаем все уникальные комбинации полей
-        unique_transfers = session.query(
-            Transfer.investor_id,
-            Transfer.amount,
-            Transfer.currency,
-            Transfer.transfer_date
-        ).distinct().all()
-        
-        logger.info(f"Найдено {len(unique_transfers)} уникальных переводов")
-        
-        # Удаляем все записи
-        deleted_count = session.query(Transfer).delete()
-        logger.info(f"Удалено {deleted_count} записей")
-        
-        # Добавляем только уникальные записи обратно
-        for transfer_data in unique_transfers:
-            transfer = Transfer(
-                investor_id=transfer_data[0],
-                amount=transfer_data[1],
-                currency=transfer_data[2],
-                transfer_date=transfer_data[3]
-            )
-            session.add(transfer)
-        
-        session.commit()
-        logger.info(f"Добавлено {len(unique_transfers)} уникальных записей обратно")
-        
-    except Exception as e:
-        logger.error(f"Ошибка при очистке дубликатов: {e}")
-        session.rollback()
+    return clean_duplicates(Transfer, dry_run)
 
 if __name__ == "__main__":
-    print("Начало очистки дубликатов...")
-    clean_duplicate_transfers()
-    print("Очистка дубликатов завершена") 
\ No newline at end of file
+    dry_run = '--dry-run' in sys.argv[1:]
+    print("Поиск дубликатов (без удаления)..." if dry_run else "Начало очистки дубликатов...")
+    found = 0
+    for model in DEDUPE_KEYS:
+        try:
+            found += clean_duplicates(model, dry_run)
+        except Exception as e:
+            logger.error(f"Ошибка при очистке дубликатов {model.__tablename__}: {e}")
+    if dry_run:
+        print(f"Найдено дубликатов: {found}")
+    else:
+        print("Очистка дубликатов завершена")
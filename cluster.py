@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import zlib
+import signal
+import asyncio
+import logging
+from datetime import date
+
+from telegram import Bot, Update
+
+from rates import rate_cache, rate_history
+from rate_matrix import rate_matrix
+from report_cache import report_cache
+from webhook import (
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_URL_PATH, WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS, TELEGRAM_API_BASE_URL, require_webhook_url
+)
+
+logger = logging.getLogger(__name__)
+
+# Число процессов-обработчиков; обновления чата всегда попадают в один и тот же процесс
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', '1'))
+# Номер этого процесса-обработчика (0..CLUSTER_WORKERS-1)
+CLUSTER_WORKER_ID = int(os.getenv('CLUSTER_WORKER_ID', '0'))
+# Каталог Unix-сокетов: worker-<номер>.sock для обновлений и bus.sock для сброса кэшей
+CLUSTER_SOCKET_DIR = os.getenv('CLUSTER_SOCKET_DIR', '/tmp/finance-bot')
+# Как front получает обновления: webhook или polling
+CLUSTER_FRONT_MODE = os.getenv('CLUSTER_FRONT_MODE', 'polling')
+
+# Если процесс-обработчик недоступен, front повторяет отправку с такой паузой (с)
+RECONNECT_DELAY = 1.0
+
+
+def worker_socket(worker_id):
+    return os.path.join(CLUSTER_SOCKET_DIR, f"worker-{worker_id}.sock")
+
+
+def bus_socket():
+    return os.path.join(CLUSTER_SOCKET_DIR, 'bus.sock')
+
+
+def chat_key(update):
+    """Чат (или пользователь), по которому выбирается процесс-обработчик"""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+def worker_for(update, workers=CLUSTER_WORKERS):
+    key = chat_key(update)
+    if key is None:
+        return 0
+    return zlib.crc32(str(key).encode()) % workers
+
+
+async def _send_line(writer, message):
+    writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+async def _unix_server(path, handle):
+    """Unix-сокет с обработчиком соединений; старый файл сокета удаляется"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    return await asyncio.start_unix_server(handle, path)
+
+
+# --- Шина сброса кэшей ---
+
+class InvalidationBus:
+    """
+    Рассылка изменений данных между процессами-обработчиками через front.
+    Каждый процесс сбрасывает свои кэши курсов и отчетов по сообщениям других.
+    """
+
+    def __init__(self):
+        self._writer = None
+
+    async def connect(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(bus_socket())
+                break
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+        report_cache.on_bump.append(self._publish_data_changed)
+        asyncio.create_task(self._listen(reader))
+        logger.info("Процесс подключен к шине сброса кэшей")
+
+    def publish(self, message):
+        if self._writer is not None and not self._writer.is_closing():
+            asyncio.create_task(_send_line(self._writer, message))
+
+    def _publish_data_changed(self):
+        self.publish({'type': 'data_changed'})
+
+    async def _listen(self, reader):
+        while line := await reader.readline():
+            apply_message(json.loads(line))
+        logger.error("Соединение с шиной сброса кэшей потеряно")
+        self._writer = None
+        report_cache.on_bump.remove(self._publish_data_changed)
+        # Пока процесс был отключен, он мог пропустить изменения
+        reset_rate_caches()
+        report_cache.bump(local=True)
+        await self.connect()
+
+
+invalidation_bus = InvalidationBus()
+
+
+def reset_rate_caches():
+    """Сбрасывает все кэши курсов этого процесса"""
+    rate_cache.clear()
+    rate_history.clear()
+    rate_matrix.clear()
+
+
+def apply_rate_change(from_currency, to_currency, rate_date, rate):
+    """Обновляет кэши курсов этого процесса после записи курса"""
+    rate_cache.invalidate(from_currency, to_currency, rate_date)
+    rate_history.update_pair(from_currency, to_currency, rate_date, rate)
+    rate_matrix.invalidate(rate_date)
+
+
+def rate_changed(from_currency, to_currency, rate_date, rate):
+    """Курс записан в этом процессе: обновляет свои кэши и оповещает остальные процессы"""
+    apply_rate_change(from_currency, to_currency, rate_date, rate)
+    invalidation_bus.publish({
+        'type': 'rate', 'from': from_currency, 'to': to_currency,
+        'date': rate_date.isoformat(), 'rate': rate,
+    })
+
+
+def apply_message(message):
+    """Применяет изменение, сделанное другим процессом"""
+    if message['type'] == 'rate':
+        apply_rate_change(message['from'], message['to'], date.fromisoformat(message['date']), message['rate'])
+    elif message['type'] == 'data_changed':
+        report_cache.bump(local=True)
+
+
+# --- Процесс-обработчик ---
+
+def update_handler(application):
+    """
+    Обработчик соединения от front: каждое обновление передается приложению,
+    а после обработки front получает подтверждение с его update_id
+    """
+    tasks = set()
+
+    async def process(data, writer):
+        update = Update.de_json(data, application.bot)
+        await application.update_processor.process_update(update, application.process_update(update))
+        # Без drain(): подтверждения короткие, а drain() нельзя вызывать из нескольких задач сразу
+        if not writer.is_closing():
+            writer.write(json.dumps({'ack': data['update_id']}).encode('utf-8') + b'\n')
+
+    async def handle(reader, writer):
+        # Задачи создаются в порядке получения, поэтому порядок обновлений чата сохраняется
+        while line := await reader.readline():
+            task = asyncio.create_task(process(json.loads(line), writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        writer.close()
+
+    return handle
+
+
+async def serve_worker(application):
+    """Принимает обновления от front через Unix-сокет и передает их приложению"""
+    handle = update_handler(application)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await invalidation_bus.connect()
+        server = await _unix_server(worker_socket(CLUSTER_WORKER_ID), handle)
+        logger.info(f"Обработчик {CLUSTER_WORKER_ID} из {CLUSTER_WORKERS} запущен")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+def run_worker(application):
+    asyncio.run(serve_worker(application))
+
+
+# --- Front ---
+
+class Front:
+    """Получает обновления от Telegram и раскладывает их по процессам-обработчикам"""
+
+    def __init__(self, bot, workers=CLUSTER_WORKERS):
+        self.bot = bot
+        self.queues = [asyncio.Queue() for _ in range(workers)]
+        self.bus_clients = set()
+
+    def route(self, data):
+        update = Update.de_json(data, self.bot)
+        self.queues[worker_for(update, len(self.queues))].put_nowait(data)
+
+    async def forward(self, worker_id):
+        """
+        Отправляет обновления одному процессу по порядку. Обновление хранится,
+        пока процесс не подтвердит его обработку; после переподключения
+        неподтвержденные обновления отправляются снова.
+        """
+        queue = self.queues[worker_id]
+        unacked = {}
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(worker_socket(worker_id))
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            tasks = [
+                asyncio.create_task(self._send_updates(writer, queue, unacked)),
+                asyncio.create_task(self._read_acks(reader, unacked)),
+            ]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None \
+                            and not isinstance(task.exception(), OSError):
+                        raise task.exception()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                writer.close()
+            logger.warning(f"Обработчик {worker_id} недоступен, повторное подключение; "
+                           f"неподтвержденных обновлений: {len(unacked)}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    @staticmethod
+    async def _send_updates(writer, queue, unacked):
+        for data in list(unacked.values()):
+            await _send_line(writer, data)
+        while True:
+            data = await queue.get()
+            unacked[data['update_id']] = data
+            await _send_line(writer, data)
+
+    @staticmethod
+    async def _read_acks(reader, unacked):
+        while line := await reader.readline():
+            unacked.pop(json.loads(line)['ack'], None)
+
+    async def serve_bus(self, reader, writer):
+        """Пересылает сообщение каждого процесса всем остальным"""
+        self.bus_clients.add(writer)
+        try:
+            while line := await reader.readline():
+                for client in list(self.bus_clients):
+                    if client is not writer and not client.is_closing():
+                        client.write(line)
+        finally:
+            self.bus_clients.discard(writer)
+            writer.close()
+
+    async def poll(self):
+        await self.bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            for update in updates:
+                self.queues[worker_for(update, len(self.queues))].put_nowait(update.to_dict())
+                offset = update.update_id + 1
+
+    async def serve_webhook(self, reader, writer):
+        """Минимальный HTTP-сервер вебхука: проверка секретного токена и раскладка обновления"""
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            path = request_line.split()[1].decode() if len(request_line.split()) > 1 else ''
+            if path.strip('/') != WEBHOOK_URL_PATH.strip('/'):
+                status = '404 Not Found'
+            elif WEBHOOK_SECRET_TOKEN and headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET_TOKEN:
+                status = '403 Forbidden'
+            else:
+                self.route(json.loads(body))
+                status = '200 OK'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('ascii'))
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Некорректный запрос вебхука: {e}")
+        finally:
+            writer.close()
+
+    async def run(self):
+        webhook_url = require_webhook_url() if CLUSTER_FRONT_MODE == 'webhook' else None
+        bus = await _unix_server(bus_socket(), self.serve_bus)
+        forwarders = [asyncio.create_task(self.forward(i)) for i in range(len(self.queues))]
+        async with self.bot:
+            if CLUSTER_FRONT_MODE == 'webhook':
+                server = await asyncio.start_server(self.serve_webhook, WEBHOOK_LISTEN, WEBHOOK_PORT)
+                await self.bot.set_webhook(
+                    webhook_url,
+                    secret_token=WEBHOOK_SECRET_TOKEN,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logger.info(f"Front принимает вебхук на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}, обработчиков: {len(self.queues)}")
+                async with server:
+                    await server.serve_forever()
+            else:
+                logger.info(f"Front получает обновления через polling, обработчиков: {len(self.queues)}")
+                await self.poll()
+        for task in forwarders:
+            task.cancel()
+        bus.close()
+
+
+def run_front():
+    from logging_setup import setup_logging
+    from dotenv import load_dotenv
+    from migrate_db import run_migrations
+
+    load_dotenv()
+    setup_logging()
+    # Миграции выполняются до открытия шины: обработчики начинают принимать
+    # обновления только после подключения к ней
+    run_migrations()
+    kwargs = {}
+    if TELEGRAM_API_BASE_URL:
+        base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+        kwargs = {'base_url': f"{base_url}/bot", 'base_file_url': f"{base_url}/file/bot"}
+    bot = Bot(os.getenv('TELEGRAM_TOKEN'), **kwargs)
+    try:
+        asyncio.run(Front(bot).run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in ([], ['front']):
+        print("Использование: python cluster.py [front]")
+        sys.exit(2)
+    run_front()
@@ -0,0 +1,201 @@
+import os
+import time
+import inspect
+import logging
+import functools
+from contextvars import ContextVar
+
+from sqlalchemy import select, func, case, cast, and_, literal_column, String
+from sqlalchemy.orm import aliased, outerjoin
+
+from models import ExchangeRate
+from rates import rate_cache, RATE_LOOKUP_MODE, RATE_MAX_STALENESS_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Способ конвертации в отчетах:
+#   rows    - построчно в Python через get_exchange_rate
+#   sql     - суммирование с конвертацией на стороне базы данных
+#   grouped - GROUP BY (валюта, дата) в базе и один курс на группу
+CONVERSION_MODE = os.getenv('CONVERSION_MODE', 'sql')
+
+# Отчет, который считается в текущей задаче
+_current_report = ContextVar('current_report', default=None)
+
+
+class ReportStats:
+    """
+    Счетчики одного отчета. Вместо записи в лог на каждую строку
+    по завершении отчета пишется одна итоговая строка. Вложенные отчеты
+    (например, остаток казны из вложений и закупок) учитываются во внешнем.
+    """
+
+    def __init__(self, report, target_currency=None):
+        self.report = report
+        self.target_currency = target_currency
+        self.rows = 0
+        self.groups = 0
+        self.total = None
+        self._token = None
+
+    def __enter__(self):
+        if _current_report.get() is None:
+            self._started = time.perf_counter()
+            self._hits, self._misses = rate_cache.hits, rate_cache.misses
+            self._token = _current_report.set(self)
+        return _current_report.get()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is None:
+            return False
+        _current_report.reset(self._token)
+        logger.info(
+            "Отчет %s (%s): строк %d, групп %d, кэш курсов %d/%d, итог %s, %.1f мс%s",
+            self.report, self.target_currency, self.rows, self.groups,
+            rate_cache.hits - self._hits, rate_cache.misses - self._misses,
+            self.total, (time.perf_counter() - self._started) * 1000,
+            ", с ошибкой" if exc_type else ""
+        )
+        return False
+
+
+def count_rows(rows, groups=0):
+    """Добавляет обработанные строки и группы к текущему отчету"""
+    stats = _current_report.get()
+    if stats is not None:
+        stats.rows += rows
+        stats.groups += groups
+
+
+def reported(report):
+    """Декоратор асинхронной функции отчета: одна итоговая строка лога на вызов"""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            target_currency = signature.bind(*args, **kwargs).arguments.get('target_currency')
+            with ReportStats(report, getattr(target_currency, 'value', target_currency)) as stats:
+                result = await func(*args, **kwargs)
+                if stats.report == report:
+                    stats.total = result if isinstance(result, (int, float)) else stats.total
+                return result
+        return wrapper
+    return decorator
+
+
+def _days_before(session, date_column, days):
+    """SQL-выражение: дата из date_column минус days дней"""
+    if session.bind.dialect.name == 'sqlite':
+        return func.date(date_column, f'-{int(days)} days')
+    return date_column - literal_column(str(int(days)))
+
+
+def rate_join(session, model, date_column, target_currency):
+    """
+    Строит источник строк таблицы model вместе с курсом в целевую валюту.
+    Возвращает (FROM-выражение, выражение курса); курс равен NULL, если его нет.
+    """
+    currency = cast(model.currency, String)
+    if RATE_LOOKUP_MODE == 'asof':
+        # Последний курс не позже даты записи: диапазонный просмотр уникального индекса
+        rate = select(ExchangeRate.rate).where(
+            ExchangeRate.from_currency == currency,
+            ExchangeRate.to_currency == target_currency,
+            ExchangeRate.date <= date_column,
+            ExchangeRate.date >= _days_before(session, date_column, RATE_MAX_STALENESS_DAYS)
+        ).order_by(ExchangeRate.date.desc()).limit(1).scalar_subquery()
+        source = model
+    else:
+        rates = aliased(ExchangeRate)
+        rate = rates.rate
+        # Соединение по уникальному индексу (from_currency, to_currency, date)
+        source = outerjoin(model, rates, and_(
+            rates.from_currency == currency,
+            rates.to_currency == target_currency,
+            rates.date == date_column
+        ))
+    return source, case((currency == target_currency, 1.0), else_=rate)
+
+
+async def convert_ledger(session, model, date_column, target_currency, label, get_rate, *criteria):
+    """
+    Суммирует записи таблицы model в целевой валюте одним запросом,
+    соединяя их с exchange_rates по (валюта, дата).
+    Записи без прямого курса выбираются отдельным запросом и конвертируются
+    через get_rate (кросс-курсы); оставшиеся возвращаются в виде списка ошибок
+    в том же формате, что и при построчной конвертации.
+    """
+    source, rate = rate_join(session, model, date_column, target_currency)
+
+    result = await session.execute(
+        select(func.coalesce(func.sum(model.amount * rate), 0.0), func.count(model.id))
+        .select_from(source)
+        .where(*criteria)
+    )
+    total, rows = result.one()
+    count_rows(rows)
+
+    result = await session.execute(
+        select(model.id, model.amount, model.currency, date_column)
+        .select_from(source)
+        .where(rate.is_(None), *criteria)
+        .order_by(date_column, model.id)
+    )
+    missing = result.all()
+
+    errors = []
+    for _, amount, row_currency, date in missing:
+        try:
+            total += amount * await get_rate(row_currency.value, target_currency, date)
+        except ValueError as e:
+            errors.append(f"Ошибка конвертации для {label} {amount} {row_currency.value}: {str(e)}")
+    return total, errors
+
+
+def summarize_by_currency(session, model, date_column, target_currency, *criteria):
+    """
+    Итоги таблицы model по исходным валютам одним запросом:
+    список (валюта, сумма, сумма в целевой валюте, число записей без курса).
+    session - синхронная сессия (итоги казны пересчитываются и из служебных скриптов).
+    """
+    source, rate = rate_join(session, model, date_column, target_currency)
+    result = session.execute(
+        select(
+            model.currency,
+            func.coalesce(func.sum(model.amount), 0.0),
+            func.coalesce(func.sum(model.amount * rate), 0.0),
+            func.count(model.id) - func.count(rate)
+        )
+        .select_from(source)
+        .where(*criteria)
+        .group_by(model.currency)
+    )
+    return result.all()
+
+
+async def convert_grouped(session, model, date_column, target_currency, label, get_rate, *criteria):
+    """
+    Группирует записи таблицы model по (валюта, дата) на стороне базы данных
+    и применяет один курс к каждой группе; get_rate - асинхронная функция
+    получения курса (from_currency, to_currency, date).
+    """
+    result = await session.execute(
+        select(model.currency, date_column, func.sum(model.amount), func.count(model.id))
+        .where(*criteria)
+        .group_by(model.currency, date_column)
+        .order_by(date_column)
+    )
+    groups = result.all()
+
+    total = 0.0
+    errors = []
+    for currency, date, amount, count in groups:
+        try:
+            rate = await get_rate(currency.value, target_currency, date)
+            total += amount * rate
+        except ValueError as e:
+            rows_note = f" ({count} записей)" if count > 1 else ""
+            errors.append(f"Ошибка конвертации для {label} {amount} {currency.value}{rows_note}: {str(e)}")
+    count_rows(sum(count for *_, count in groups), len(groups))
+    return total, errors
@@ -1,14 +1,50 @@
+// По умолчанию бот работает одним процессом (main.py получает обновления сам).
+// Если задан CLUSTER_WORKERS, запускаются front и CLUSTER_WORKERS процессов-обработчиков;
+// обновления одного чата всегда идут в один процесс
+const CLUSTER_WORKERS = parseInt(process.env.CLUSTER_WORKERS || '0', 10);
+
+const botApps = CLUSTER_WORKERS > 0 ? [
+  {
+    name: 'finance-bot-front',
+    script: 'cluster.py',
+    interpreter: 'python3',
+    watch: false,
+    env: {
+      // Принимает обновления от Telegram (CLUSTER_FRONT_MODE=polling или webhook)
+      // и раскладывает их по обработчикам
+      CLUSTER_WORKERS: String(CLUSTER_WORKERS)
+    }
+  },
+  ...Array.from({ length: CLUSTER_WORKERS }, (_, i) => ({
+    name: `finance-bot-worker-${i}`,
+    script: 'main.py',
+    interpreter: 'python3',
+    watch: false,
+    env: {
+      BOT_MODE: 'worker',
+      CLUSTER_WORKERS: String(CLUSTER_WORKERS),
+      CLUSTER_WORKER_ID: String(i),
+      // Незавершенные диалоги каждый обработчик хранит в своем файле
+      BOT_PERSISTENCE_PATH: `bot_state-${i}.sqlite`,
+      // Каждому обработчику свой порт метрик, если они включены
+      ...(process.env.METRICS_PORT ? { METRICS_PORT: String(parseInt(process.env.METRICS_PORT, 10) + i) } : {})
+    }
+  }))
+] : [
+  {
+    name: 'finance-bot',
+    script: 'main.py',
+    interpreter: 'python3',
+    watch: false,
+    env: {
+      // Можно добавить переменные окружения, если нужно
+    }
+  }
+];
+
 module.exports = {
   apps: [
-    {
-      name: 'finance-bot',
-      script: 'main.py',
-      interpreter: 'python3',
-      watch: false,
-      env: {
-        // Можно добавить переменные окружения, если нужно
-      }
-    },
+    ...botApps,
     {
       name: 'import_data_to_bot',
       script: 'import_data_to_bot.py',
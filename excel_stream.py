@@ -0,0 +1,53 @@
+import os
+import logging
+from itertools import islice
+
+import pandas as pd
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк листа читается и обрабатывается за один раз
+EXCEL_CHUNK_SIZE = int(os.getenv('EXCEL_CHUNK_SIZE', '5000'))
+
+# Обязательные колонки файлов выгрузки
+TRANSFER_COLUMNS = ['Инвестор', 'Сумма', 'Валюта', 'Дата перевода']
+SERVICE_PAYMENT_COLUMNS = ['Название сервиса', 'Сумма', 'Валюта', 'Дата оплаты', 'Период оплаты', 'Единица периода']
+
+
+def _header(row):
+    """Названия колонок из первой строки листа, как их называет pandas"""
+    return [str(value).strip() if value is not None else f"Unnamed: {i}" for i, value in enumerate(row)]
+
+
+def iter_excel_chunks(path, columns=None, chunk_size=EXCEL_CHUNK_SIZE):
+    """
+    Читает первый лист файла в режиме read-only и отдает его порциями
+    по chunk_size строк в виде DataFrame. В памяти одновременно находится
+    только одна порция, поэтому размер файла не ограничен памятью.
+    Полностью пустые строки пропускаются; columns - обязательные колонки.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = _header(next(rows, ()))
+        missing = [column for column in columns or [] if column not in header]
+        if missing:
+            raise ValueError(f"В файле {path} нет колонок: {', '.join(missing)}")
+
+        width = len(header)
+        # Строки read-only листа бывают разной длины: выравниваем по заголовку
+        rows = (
+            tuple(row[:width]) + (None,) * (width - len(row))
+            for row in rows if any(value is not None for value in row)
+        )
+        read = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            read += len(chunk)
+            yield pd.DataFrame.from_records(chunk, columns=header)
+        logger.info(f"Прочитано {read} строк из {path}")
+    finally:
+        workbook.close()
@@ -0,0 +1,177 @@
+import os
+import time
+import atexit
+import asyncio
+import logging
+from collections import defaultdict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Адрес API курсов (exchangerate-api.com v6); для тестов - локальный сервер benchmarks.fake_fx
+FX_API_URL = os.getenv('FX_API_URL', 'https://v6.exchangerate-api.com/v6')
+# Ограничение времени запроса к API (с): на соединение и на весь ответ
+FX_CONNECT_TIMEOUT = float(os.getenv('FX_CONNECT_TIMEOUT', '5'))
+FX_TIMEOUT = float(os.getenv('FX_TIMEOUT', '10'))
+# Повторы при сетевых ошибках, 429 и 5xx; пауза растет вдвое: 0.5, 1, 2 ... с
+FX_RETRIES = int(os.getenv('FX_RETRIES', '3'))
+FX_BACKOFF = float(os.getenv('FX_BACKOFF', '0.5'))
+FX_MAX_CONNECTIONS = int(os.getenv('FX_MAX_CONNECTIONS', '10'))
+# Сколько секунд ответ по базовой валюте используется повторно
+FX_CACHE_SECONDS = float(os.getenv('FX_CACHE_SECONDS', '60'))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FxError(ValueError):
+    """Курс не удалось получить от API"""
+
+
+class FxClient:
+    """
+    Асинхронный клиент API курсов с общим пулом соединений.
+    Один запрос /latest/<base> возвращает курсы базовой валюты ко всем остальным,
+    поэтому пары группируются по исходной валюте, а разные базы запрашиваются параллельно.
+    Одновременные запросы одной базы объединяются в один.
+    """
+
+    def __init__(self, api_url=FX_API_URL, api_key=None):
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key or os.getenv('EXCHANGE_RATE_API_KEY')
+        self._client = None
+        # base -> (время получения, {валюта: курс})
+        self._latest = {}
+        # base -> задача, которая сейчас запрашивает эту базу
+        self._inflight = {}
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.api_url}/{self.api_key}",
+                timeout=httpx.Timeout(FX_TIMEOUT, connect=FX_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=FX_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _get(self, path):
+        """GET с повторами; возвращает разобранный JSON"""
+        for attempt in range(FX_RETRIES + 1):
+            try:
+                response = await self._http().get(path)
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                problem = f"статус код {response.status_code}"
+            except httpx.TransportError as e:
+                problem = f"{type(e).__name__}: {e}"
+            if attempt == FX_RETRIES:
+                raise FxError(f"Ошибка API: {problem}")
+            delay = FX_BACKOFF * 2 ** attempt
+            logger.warning(f"Запрос {path} не удался ({problem}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+        data = response.json() if response.content else {}
+        if response.status_code != 200 or data.get('result') != 'success':
+            error = data.get('error-type') or data.get('error') or f"статус код {response.status_code}"
+            raise FxError(f"Ошибка получения курса валют: {error}")
+        return data
+
+    async def _fetch_latest(self, base):
+        data = await self._get(f"/latest/{base}")
+        rates = data.get('conversion_rates') or {}
+        self._latest[base] = (time.monotonic(), rates)
+        logger.info(f"Получены курсы {base} к {len(rates)} валютам")
+        return rates
+
+    async def latest(self, base):
+        """Курсы base ко всем валютам: {валюта: курс}"""
+        cached = self._latest.get(base)
+        if cached and time.monotonic() - cached[0] < FX_CACHE_SECONDS:
+            return cached[1]
+        task = self._inflight.get(base)
+        if task is None:
+            task = self._inflight[base] = asyncio.ensure_future(self._fetch_latest(base))
+            task.add_done_callback(lambda _: self._inflight.pop(base, None))
+        return await asyncio.shield(task)
+
+    async def rates(self, pairs):
+        """Курсы пар [(из, в), ...]: {(из, в): курс}; по запросу на каждую исходную валюту"""
+        targets = defaultdict(set)
+        for from_currency, to_currency in pairs:
+            targets[from_currency].add(to_currency)
+        bases = list(targets)
+        responses = await asyncio.gather(*(self.latest(base) for base in bases))
+        result = {}
+        for base, rates in zip(bases, responses):
+            for to_currency in targets[base]:
+                if base == to_currency:
+                    result[(base, to_currency)] = 1.0
+                elif to_currency in rates:
+                    result[(base, to_currency)] = float(rates[to_currency])
+                else:
+                    raise FxError(f"API не вернул курс {base} → {to_currency}")
+        return result
+
+    async def rate(self, from_currency, to_currency):
+        return (await self.rates([(from_currency, to_currency)]))[(from_currency, to_currency)]
+
+
+# Общий клиент процесса и цикл событий, в котором открыт его пул соединений
+_client = None
+_client_loop = None
+
+
+def get_fx_client():
+    """
+    Общий клиент процесса: пул соединений, кэш ответов и объединение
+    одновременных запросов работают между вызовами. Пул httpx привязан к циклу
+    событий, поэтому в новом цикле (скрипты вызывают asyncio.run() на каждый
+    запрос) создается новый клиент; кэш ответов переходит к нему.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        latest = _client._latest if _client is not None else {}
+        _client = FxClient()
+        _client._latest = latest
+        _client_loop = loop
+    return _client
+
+
+async def close_fx_client(application=None):
+    """Закрывает общий клиент; подходит для post_shutdown приложения бота"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close()
+
+
+@atexit.register
+def _close_at_exit():
+    # Если цикл событий уже закрыт, соединения закрываются вместе с процессом
+    if _client is not None and not _client_loop.is_closed() and not _client_loop.is_running():
+        _client_loop.run_until_complete(close_fx_client())
+
+
+async def fetch_rates(pairs):
+    """Курсы пар одним обращением к API через общий клиент процесса"""
+    return await get_fx_client().rates(pairs)
+
+
+if __name__ == "__main__":
+    import sys
+
+    pairs = [tuple(arg.upper().split('/')) for arg in sys.argv[1:]] or [('USD', 'RUB'), ('EUR', 'RUB'), ('UAH', 'RUB')]
+    for (from_currency, to_currency), rate in asyncio.run(fetch_rates(pairs)).items():
+        print(f"1 {from_currency} = {rate} {to_currency}")
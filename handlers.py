@@ -2,7 +2,10 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from datetime import datetime
 from models import Investor, Purchase, Transfer, ServicePurchase, Currency, PeriodUnit
-from database import Session
+from database import AsyncSession
+from ledger_totals import record_entry, INVESTMENTS, PURCHASES
+from report_cache import report_cache
+from investor_keyboard import investor_keyboard
 
 # Состояния для ConversationHandler
 PURCHASE_INVESTOR, PURCHASE_SERVICE, PURCHASE_AMOUNT, PURCHASE_CURRENCY, PURCHASE_DATE, PURCHASE_PERIOD, PURCHASE_PERIOD_UNIT = range(7)
@@ -11,13 +14,9 @@ SERVICE_NAME, SERVICE_AMOUNT, SERVICE_CURRENCY, SERVICE_DATE, SERVICE_PERIOD, SE
 
 # Обработчики для покупок инвесторов
 async def start_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = Session()
-    investors = session.query(Investor).all()
-    keyboard = [[InlineKeyboardButton(investor.full_name, callback_data=f'investor_{investor.id}')] for investor in investors]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    async with AsyncSession() as session:
+        reply_markup, _ = await investor_keyboard(session, 'investor_')
     await update.callback_query.message.reply_text('Выберите инвестора:', reply_markup=reply_markup)
-    session.close()
     return PURCHASE_INVESTOR
 
 async def process_purchase_investor(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -87,7 +86,7 @@ async def process_purchase_period_unit(update: Update, context: ContextTypes.DEF
         await query.message.reply_text('Операция отменена')
         return ConversationHandler.END
     
-    session = Session()
+    session = AsyncSession()
     try:
         purchase = Purchase(
             investor_id=context.user_data['purchase_investor_id'],
@@ -99,24 +98,22 @@ async def process_purchase_period_unit(update: Update, context: ContextTypes.DEF
             period_unit=query.data.split('_')[1]
         )
         session.add(purchase)
-        session.commit()
+        await record_entry(session, PURCHASES, purchase.currency, purchase.amount, purchase.purchase_date)
+        await session.commit()
+        report_cache.bump()
         await query.message.reply_text('Покупка успешно добавлена!')
     except Exception as e:
         await query.message.reply_text(f'Произошла ошибка: {str(e)}')
     finally:
-        session.close()
+        await session.close()
         context.user_data.clear()
     return ConversationHandler.END
 
 # Обработчики для переводов
 async def start_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = Session()
-    investors = session.query(Investor).all()
-    keyboard = [[InlineKeyboardButton(investor.full_name, callback_data=f'investor_{investor.id}')] for investor in investors]
-    keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    async with AsyncSession() as session:
+        reply_markup, _ = await investor_keyboard(session, 'investor_')
     await update.callback_query.message.reply_text('Выберите инвестора:', reply_markup=reply_markup)
-    session.close()
     return TRANSFER_INVESTOR
 
 async def process_transfer_investor(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -155,7 +152,7 @@ async def process_transfer_currency(update: Update, context: ContextTypes.DEFAUL
 async def process_transfer_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         date = datetime.strptime(update.message.text, '%Y-%m-%d').date()
-        session = Session()
+        session = AsyncSession()
         try:
             transfer = Transfer(
                 investor_id=context.user_data['transfer_investor_id'],
@@ -164,12 +161,14 @@ async def process_transfer_date(update: Update, context: ContextTypes.DEFAULT_TY
                 transfer_date=date
             )
             session.add(transfer)
-            session.commit()
+            await record_entry(session, INVESTMENTS, transfer.currency, transfer.amount, transfer.transfer_date)
+            await session.commit()
+            report_cache.bump()
             await update.message.reply_text('Перевод успешно добавлен!')
         except Exception as e:
             await update.message.reply_text(f'Произошла ошибка: {str(e)}')
         finally:
-            session.close()
+            await session.close()
             context.user_data.clear()
         return ConversationHandler.END
     except ValueError:
@@ -238,7 +237,7 @@ async def process_service_period_unit(update: Update, context: ContextTypes.DEFA
         await query.message.reply_text('Операция отменена')
         return ConversationHandler.END
     
-    session = Session()
+    session = AsyncSession()
     try:
         period_unit_value = query.data.split('_')[1]
         period_unit = PeriodUnit(period_unit_value)  # Преобразуем строку в enum
@@ -252,12 +251,14 @@ async def process_service_period_unit(update: Update, context: ContextTypes.DEFA
             period_unit=period_unit
         )
         session.add(service_purchase)
-        session.commit()
+        await record_entry(session, PURCHASES, service_purchase.currency, service_purchase.amount, service_purchase.purchase_date)
+        await session.commit()
+        report_cache.bump()
         await query.message.reply_text('Покупка сервиса успешно добавлена!')
     except Exception as e:
         await query.message.reply_text(f'Произошла ошибка: {str(e)}')
     finally:
-        session.close()
+        await session.close()
         context.user_data.clear()
     return ConversationHandler.END
 
@@ -0,0 +1,82 @@
+import os
+
+from sqlalchemy import select, tuple_
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from models import Investor
+from database import AsyncSession
+
+# Сколько инвесторов показывается на одной странице клавиатуры
+INVESTORS_PAGE_SIZE = int(os.getenv('INVESTORS_PAGE_SIZE', '10'))
+
+# Кнопки листания: invpage:<префикс кнопок инвесторов>:<prev|next>:<id крайнего инвестора>
+PAGE_CALLBACK = 'invpage'
+PAGE_PATTERN = f'^{PAGE_CALLBACK}:'
+
+
+async def fetch_investor_page(session, direction=None, investor_id=None, page_size=INVESTORS_PAGE_SIZE):
+    """
+    Страница инвесторов в порядке (full_name, id) после (next) или перед (prev)
+    инвестором investor_id. Возвращает (инвесторы, есть ли предыдущая, есть ли следующая).
+    """
+    key = tuple_(Investor.full_name, Investor.id)
+    cursor = None
+    if investor_id is not None:
+        result = await session.execute(select(Investor.full_name, Investor.id).where(Investor.id == investor_id))
+        cursor = result.first()
+
+    query = select(Investor).limit(page_size + 1)
+    if cursor is not None and direction == 'prev':
+        query = query.where(key < tuple_(*cursor)).order_by(Investor.full_name.desc(), Investor.id.desc())
+    elif cursor is not None:
+        query = query.where(key > tuple_(*cursor)).order_by(Investor.full_name, Investor.id)
+    else:
+        # Первая страница; сюда же попадаем, если крайний инвестор уже удален
+        query = query.order_by(Investor.full_name, Investor.id)
+    result = await session.execute(query)
+    investors = list(result.scalars().all())
+    more = len(investors) > page_size
+    investors = investors[:page_size]
+
+    if cursor is not None and direction == 'prev':
+        if not more:
+            # До начала списка меньше страницы: показываем полную первую страницу
+            return await fetch_investor_page(session, page_size=page_size)
+        investors.reverse()
+        return investors, True, True
+    if cursor is not None and not investors:
+        # Инвесторы после курсора удалены: показываем первую страницу
+        return await fetch_investor_page(session, page_size=page_size)
+    return investors, cursor is not None, more
+
+
+async def investor_keyboard(session, prefix, direction=None, investor_id=None):
+    """
+    Клавиатура выбора инвестора: кнопки с callback_data '<prefix><id>',
+    листание страниц и отмена. Возвращает (клавиатура, инвесторы страницы).
+    """
+    investors, has_prev, has_next = await fetch_investor_page(session, direction, investor_id)
+    keyboard = [
+        [InlineKeyboardButton(investor.full_name, callback_data=f'{prefix}{investor.id}')]
+        for investor in investors
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'{PAGE_CALLBACK}:{prefix}:prev:{investors[0].id}'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперед ▶️", callback_data=f'{PAGE_CALLBACK}:{prefix}:next:{investors[-1].id}'))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel')])
+    return InlineKeyboardMarkup(keyboard), investors
+
+
+async def investor_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание клавиатуры выбора инвестора; состояние диалога не меняется"""
+    query = update.callback_query
+    await query.answer()
+    _, prefix, direction, investor_id = query.data.split(':')
+    async with AsyncSession() as session:
+        reply_markup, _ = await investor_keyboard(session, prefix, direction, int(investor_id))
+    await query.edit_message_reply_markup(reply_markup=reply_markup)
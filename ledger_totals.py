@@ -0,0 +1,247 @@
+import os
+import sys
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, delete, func, case, exists
+
+from models import LedgerTotal, LedgerBuild, Transfer, Purchase, ServicePurchase, Currency
+from database import engine, Session
+from conversion import summarize_by_currency
+from rates import insert_for, lookup_rate
+from report_cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Валюты, в которых поддерживаются накопленные итоги казны
+LEDGER_TARGET_CURRENCIES = [
+    currency.strip() for currency in os.getenv('LEDGER_TARGET_CURRENCIES', 'RUB').split(',') if currency.strip()
+]
+
+INVESTMENTS = 'investments'
+PURCHASES = 'purchases'
+
+# Таблицы, из которых складываются итоги
+LEDGER_SOURCES = {
+    INVESTMENTS: [(Transfer, Transfer.transfer_date)],
+    PURCHASES: [(Purchase, Purchase.purchase_date), (ServicePurchase, ServicePurchase.purchase_date)],
+}
+
+KEY_COLUMNS = [LedgerTotal.kind, LedgerTotal.currency, LedgerTotal.target_currency]
+
+# Итоги считаются синхронной сессией: так их пересчитывают и служебные скрипты
+# (load_data.py, clean_duplicates.py); бот вызывает их через AsyncSession.run_sync.
+
+
+def _currency_value(currency):
+    return currency.value if isinstance(currency, Currency) else currency
+
+
+def _upsert(session, kind, currency, target_currency, amount, converted, missing, increment):
+    """Прибавляет значения к итогу (increment=True) или заменяет их"""
+    stmt = insert_for(session, LedgerTotal).values(
+        kind=kind, currency=currency, target_currency=target_currency,
+        amount=amount, converted=converted, missing=missing, updated_at=datetime.now()
+    )
+    if increment:
+        values = {
+            'amount': LedgerTotal.amount + stmt.excluded.amount,
+            'converted': LedgerTotal.converted + stmt.excluded.converted,
+            'missing': LedgerTotal.missing + stmt.excluded.missing,
+        }
+    else:
+        values = {
+            'amount': stmt.excluded.amount,
+            'converted': stmt.excluded.converted,
+            'missing': stmt.excluded.missing,
+        }
+    values['updated_at'] = stmt.excluded.updated_at
+    session.execute(stmt.on_conflict_do_update(index_elements=KEY_COLUMNS, set_=values))
+
+
+def built_targets(session):
+    """Целевые валюты, итоги в которых построены и ведутся"""
+    built = session.scalars(select(LedgerBuild.target_currency)).all()
+    return [currency for currency in LEDGER_TARGET_CURRENCIES if currency in built]
+
+
+def _record_entry(session, kind, currency, amount, date):
+    currency = _currency_value(currency)
+    # Пока итоги не построены, строки не создаются: иначе быстрый путь
+    # посчитал бы только новые записи
+    for target_currency in built_targets(session):
+        if currency == target_currency:
+            rate = 1.0
+        else:
+            rate = lookup_rate(session, currency, target_currency, date)
+        if rate is None:
+            converted, missing = 0.0, 1
+        else:
+            converted, missing = amount * rate, 0
+        _upsert(session, kind, currency, target_currency, amount, converted, missing, increment=True)
+
+
+async def record_entry(session, kind, currency, amount, date):
+    """
+    Учитывает новую запись (перевод или покупку) в итогах.
+    Вызывается в той же транзакции, что и добавление записи.
+    """
+    await session.run_sync(_record_entry, kind, currency, amount, date)
+
+
+def remove_entries(session, model, ids):
+    """
+    Вычитает из итогов записи model с указанными id: один агрегирующий запрос
+    и одно обновление на (валюта, целевая валюта). Вызывается в той же транзакции до их удаления.
+    """
+    kind, date_column = next(
+        (kind, date_column) for kind, sources in LEDGER_SOURCES.items()
+        for source, date_column in sources if source is model
+    )
+    for target_currency in built_targets(session):
+        rows = summarize_by_currency(session, model, date_column, target_currency, model.id.in_(ids))
+        for currency, amount, converted, missing in rows:
+            _upsert(session, kind, _currency_value(currency), target_currency,
+                    -amount, -converted, -missing, increment=True)
+
+
+def _compute(session, target_currency, currency=None):
+    """Считает итоги заново по таблицам: {(kind, currency): [amount, converted, missing]}"""
+    currencies = [currency] if currency else [c.value for c in Currency]
+    totals = {(kind, c): [0.0, 0.0, 0] for kind in LEDGER_SOURCES for c in currencies}
+    for kind, sources in LEDGER_SOURCES.items():
+        for model, date_column in sources:
+            criteria = [model.currency == currency] if currency else []
+            rows = summarize_by_currency(session, model, date_column, target_currency, *criteria)
+            for row_currency, amount, converted, missing in rows:
+                total = totals[(kind, row_currency.value)]
+                total[0] += amount
+                total[1] += converted
+                total[2] += missing
+    return totals
+
+
+def _refresh_for_rate(session, from_currency, to_currency):
+    targets = built_targets(session)
+    for currency, target_currency in ((from_currency, to_currency), (to_currency, from_currency)):
+        if target_currency not in targets:
+            continue
+        totals = _compute(session, target_currency, currency)
+        for (kind, row_currency), (amount, converted, missing) in totals.items():
+            _upsert(session, kind, row_currency, target_currency, amount, converted, missing, increment=False)
+
+
+async def refresh_for_rate(session, from_currency, to_currency):
+    """
+    Пересчитывает итоги, на которые влияет курс from_currency -> to_currency
+    или обратный к нему. Вызывается в той же транзакции, что и запись курса.
+    """
+    await session.run_sync(_refresh_for_rate, from_currency, to_currency)
+
+
+def rebuild(session, target_currency):
+    """Полностью пересчитывает итоги в указанной валюте и отмечает их построенными"""
+    totals = _compute(session, target_currency)
+    session.execute(delete(LedgerTotal).where(LedgerTotal.target_currency == target_currency))
+    for (kind, currency), (amount, converted, missing) in totals.items():
+        _upsert(session, kind, currency, target_currency, amount, converted, missing, increment=False)
+    stmt = insert_for(session, LedgerBuild).values(target_currency=target_currency, built_at=datetime.now())
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[LedgerBuild.target_currency], set_={'built_at': stmt.excluded.built_at}
+    ))
+    logger.info(f"Итоги казны в {target_currency} пересчитаны")
+
+
+def rebuild_all(session):
+    """Пересчитывает итоги во всех LEDGER_TARGET_CURRENCIES (после массовых изменений записей)"""
+    for target_currency in LEDGER_TARGET_CURRENCIES:
+        rebuild(session, target_currency)
+
+
+def build(bind=engine, force=False):
+    """
+    Строит итоги в тех LEDGER_TARGET_CURRENCIES, где они еще не построены
+    (force=True - пересчитывает все). Итоги валют, убранных из настройки,
+    удаляются: они больше не ведутся и при возврате валюты устарели бы.
+    """
+    with Session(bind=bind) as session:
+        stale = select(LedgerBuild.target_currency).where(LedgerBuild.target_currency.not_in(LEDGER_TARGET_CURRENCIES))
+        for target_currency in session.scalars(stale).all():
+            session.execute(delete(LedgerTotal).where(LedgerTotal.target_currency == target_currency))
+            session.execute(delete(LedgerBuild).where(LedgerBuild.target_currency == target_currency))
+        built = [] if force else built_targets(session)
+        for target_currency in LEDGER_TARGET_CURRENCIES:
+            if target_currency not in built:
+                rebuild(session, target_currency)
+        session.commit()
+
+
+def verify(session, target_currency):
+    """Сравнивает сохраненные итоги с пересчитанными; возвращает список расхождений"""
+    expected = _compute(session, target_currency)
+    result = session.execute(
+        select(LedgerTotal.kind, LedgerTotal.currency, LedgerTotal.amount, LedgerTotal.converted, LedgerTotal.missing)
+        .where(LedgerTotal.target_currency == target_currency)
+    )
+    stored = {(kind, currency): [amount, converted, missing] for kind, currency, amount, converted, missing in result.all()}
+    differences = []
+    for key, values in expected.items():
+        saved = stored.get(key, [0.0, 0.0, 0])
+        if any(abs(a - b) > 1e-6 * max(1.0, abs(a)) for a, b in zip(values, saved)):
+            differences.append((key, saved, values))
+    return differences
+
+
+async def get_balance(session, target_currency):
+    """
+    Остаток казны одним запросом к ledger_totals; только чтение, подходит сессия реплики.
+    Возвращает None, если итоги в этой валюте не ведутся или еще не построены,
+    либо есть записи без курса - тогда остаток нужно считать полностью,
+    чтобы показать ошибки конвертации.
+    """
+    if target_currency not in LEDGER_TARGET_CURRENCIES:
+        return None
+    result = await session.execute(
+        select(
+            func.count(LedgerTotal.id),
+            func.coalesce(func.sum(case(
+                (LedgerTotal.kind == INVESTMENTS, LedgerTotal.converted),
+                else_=-LedgerTotal.converted
+            )), 0.0),
+            func.coalesce(func.sum(LedgerTotal.missing), 0)
+        ).where(
+            LedgerTotal.target_currency == target_currency,
+            exists().where(LedgerBuild.target_currency == target_currency)
+        )
+    )
+    rows, balance, missing = result.one()
+    if rows == 0 or missing:
+        return None
+    return balance
+
+
+def _run(command):
+    with Session() as session:
+        for target_currency in LEDGER_TARGET_CURRENCIES:
+            if command == '--rebuild':
+                rebuild(session, target_currency)
+                bump_data_version(session)
+                session.commit()
+                print(f"Итоги в {target_currency} пересчитаны")
+            else:
+                differences = verify(session, target_currency)
+                if not differences:
+                    print(f"Итоги в {target_currency} совпадают с данными")
+                for (kind, currency), saved, expected in differences:
+                    print(f"Расхождение {kind} {currency} -> {target_currency}: сохранено {saved}, должно быть {expected}")
+                if differences:
+                    return 1
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else '--verify'
+    if command not in ('--rebuild', '--verify'):
+        print("Использование: python ledger_totals.py [--rebuild | --verify]")
+        sys.exit(2)
+    sys.exit(_run(command))
@@ -1,8 +1,12 @@
+import time
 import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, insert
 from datetime import datetime
+from database import Session
+from ledger_totals import rebuild_all
+from report_cache import bump_data_version
 from models import Base, Investor, Purchase, Transfer, ServicePurchase, Currency, PeriodUnit
+from excel_stream import iter_excel_chunks, TRANSFER_COLUMNS, SERVICE_PAYMENT_COLUMNS
 import os
 from dotenv import load_dotenv
 import logging
@@ -10,123 +14,186 @@ import logging
 # Загрузка переменных окружения
 load_dotenv()
 
-# Подключение к базе данных
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
-
 logger = logging.getLogger(__name__)
 
-def convert_amount(amount_str):
-    """Конвертирует строку с суммой в число"""
-    if isinstance(amount_str, (int, float)):
-        return float(amount_str)
-    # Удаляем пробелы и заменяем запятую на точку
-    amount_str = str(amount_str).replace(' ', '').replace(',', '.')
-    return float(amount_str)
-
-def convert_period(period_str):
-    """Конвертирует строку с периодом в число"""
-    if isinstance(period_str, (int, float)):
-        return int(period_str)
-    if str(period_str).lower() == 'бессрочно':
-        return 999999  # Используем большое число для обозначения бессрочного периода
-    return int(period_str)
-
-def load_investor_transfers():
-    """Загрузка данных о переводах инвесторов"""
+# Сколько строк вставляется одним INSERT ... VALUES
+LOAD_BATCH_SIZE = int(os.getenv('LOAD_BATCH_SIZE', '1000'))
+
+# Бессрочный период оплаты
+PERPETUAL_PERIOD = 999999
+
+TRANSFER_KEY = ['investor_id', 'amount', 'currency', 'transfer_date']
+SERVICE_PURCHASE_KEY = ['service_name', 'amount', 'currency', 'purchase_date', 'period', 'period_unit']
+
+def convert_amounts(column):
+    """Конвертирует столбец строк с суммами в числа: пробелы удаляются, запятая заменяется точкой"""
+    text = column.astype(str).str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(text).astype(float)
+
+def convert_periods(column):
+    """Конвертирует столбец периодов в числа; "бессрочно" - PERPETUAL_PERIOD"""
+    perpetual = column.astype(str).str.lower() == 'бессрочно'
+    return pd.to_numeric(column.mask(perpetual, PERPETUAL_PERIOD)).astype(int)
+
+def convert_enum(column, enum):
+    """Переводит столбец названий в значения перечисления"""
+    values = column.map(dict(enum.__members__))
+    unknown = column[values.isna()].unique()
+    if len(unknown):
+        raise ValueError(f"Неизвестные значения {enum.__name__}: {', '.join(map(str, unknown))}")
+    return values
+
+def convert_dates(column):
+    """Переводит столбец дат в datetime.date"""
+    return pd.to_datetime(column).dt.date
+
+def drop_incomplete(df, columns):
+    """Убирает строки с пустыми значениями в обязательных полях"""
+    incomplete = df[columns].isna().any(axis=1)
+    if incomplete.any():
+        logger.warning(f"Пропущено {incomplete.sum()} строк с пустыми значениями: {df[incomplete].to_dict('records')}")
+    return df[~incomplete]
+
+def resolve_investors(session, names):
+    """
+    Возвращает словарь {ФИО: id} для всех имен одним запросом;
+    отсутствующие инвесторы добавляются одной пакетной вставкой.
+    """
+    names = set(names)
+    investors = {}
+    if names:
+        result = session.execute(select(Investor.full_name, Investor.id).where(Investor.full_name.in_(names)))
+        investors = {full_name: investor_id for full_name, investor_id in result.all()}
+    new_names = sorted(names - investors.keys())
+    if new_names:
+        session.execute(insert(Investor), [{'full_name': name} for name in new_names])
+        result = session.execute(select(Investor.full_name, Investor.id).where(Investor.full_name.in_(new_names)))
+        investors.update(result.all())
+        logger.info(f"Добавлено новых инвесторов: {len(new_names)}")
+    return investors
+
+def drop_existing(session, model, frame, key, date_column):
+    """
+    Убирает из frame строки, которые уже есть в таблице model.
+    Существующие записи за период файла выбираются одним запросом
+    и отсекаются анти-соединением по ключу key.
+    """
+    if frame.empty:
+        return frame
+    dates = frame[date_column.key]
+    result = session.execute(
+        select(*(getattr(model, column) for column in key))
+        .where(date_column.between(dates.min(), dates.max()))
+    )
+    existing = pd.DataFrame(result.all(), columns=key).drop_duplicates()
+    if existing.empty:
+        return frame
+    merged = frame.merge(existing, on=key, how='left', indicator=True)
+    return merged[merged['_merge'] == 'left_only'].drop(columns='_merge')
+
+def bulk_insert(session, model, records, batch_size=LOAD_BATCH_SIZE):
+    """Вставляет записи пакетами INSERT ... VALUES (...), (...)"""
+    for start in range(0, len(records), batch_size):
+        session.execute(insert(model).values(records[start:start + batch_size]))
+
+def prepare_transfers(df):
+    """Приводит таблицу переводов к типам модели Transfer (колонка investor - ФИО)"""
+    df = drop_incomplete(df, TRANSFER_COLUMNS)
+    return pd.DataFrame({
+        'investor': df['Инвестор'],
+        'amount': convert_amounts(df['Сумма']),
+        'currency': convert_enum(df['Валюта'], Currency),
+        'transfer_date': convert_dates(df['Дата перевода']),
+    })
+
+def prepare_service_purchases(df):
+    """Приводит таблицу покупок услуг к типам модели ServicePurchase"""
+    df = drop_incomplete(df, SERVICE_PAYMENT_COLUMNS[:-1])
+    # Для бессрочных покупок устанавливаем YEAR как единицу периода
+    period_unit = df['Единица периода'].mask(
+        df['Единица периода'].isna() & (df['Период оплаты'].astype(str).str.lower() == 'бессрочно'), 'YEAR'
+    )
+    if period_unit.isna().any():
+        logger.warning(f"Пропущено {period_unit.isna().sum()} строк с пустым значением единицы периода: "
+                       f"{df[period_unit.isna()].to_dict('records')}")
+    df, period_unit = df[period_unit.notna()], period_unit[period_unit.notna()]
+    return pd.DataFrame({
+        'service_name': df['Название сервиса'],
+        'amount': convert_amounts(df['Сумма']),
+        'currency': convert_enum(df['Валюта'], Currency),
+        'purchase_date': convert_dates(df['Дата оплаты']),
+        'period': convert_periods(df['Период оплаты']),
+        'period_unit': convert_enum(period_unit, PeriodUnit),
+    })
+
+def insert_transfers(session, frame):
+    """Добавляет подготовленные переводы, пропуская дубликаты; возвращает число добавленных"""
+    investors = resolve_investors(session, frame['investor'].unique())
+    frame = frame.assign(investor_id=frame['investor'].map(investors)).drop(columns='investor')
+    # Дубликаты внутри файла и уже загруженные переводы
+    frame = drop_existing(session, Transfer, frame.drop_duplicates(TRANSFER_KEY), TRANSFER_KEY, Transfer.transfer_date)
+    bulk_insert(session, Transfer, frame[TRANSFER_KEY].to_dict('records'))
+    return len(frame)
+
+def insert_service_purchases(session, frame):
+    """Добавляет подготовленные покупки услуг, пропуская дубликаты; возвращает число добавленных"""
+    # Дубликаты внутри файла и уже загруженные покупки
+    frame = drop_existing(
+        session, ServicePurchase, frame.drop_duplicates(SERVICE_PURCHASE_KEY),
+        SERVICE_PURCHASE_KEY, ServicePurchase.purchase_date
+    )
+    bulk_insert(session, ServicePurchase, frame[SERVICE_PURCHASE_KEY].to_dict('records'))
+    return len(frame)
+
+def log_speed(title, rows, added, started):
+    """Пишет в лог итог загрузки и скорость в строках в секунду"""
+    elapsed = time.perf_counter() - started
+    speed = rows / elapsed if elapsed > 0 else 0
+    logger.info(f"{title}: обработано {rows} строк, добавлено {added}, {elapsed:.2f} с ({speed:.0f} строк/с)")
+
+def load_investor_transfers(path='investor_transfers.xlsx'):
+    """Загрузка данных о переводах инвесторов порциями, без чтения всего файла в память"""
+    session = Session()
     try:
-        df = pd.read_excel('investor_transfers.xlsx')
-        # Удаляем строки, где все значения NaN
-        df = df.dropna(how='all')
-        logger.info(f"Загружено {len(df)} записей о переводах")
-        
-        for _, row in df.iterrows():
-            # Пропускаем строки с пустыми значениями в обязательных полях
-            if pd.isna(row['Инвестор']) or pd.isna(row['Сумма']) or \
-               pd.isna(row['Валюта']) or pd.isna(row['Дата перевода']):
-                logger.warning(f"Пропущена строка с пустыми значениями: {row.to_dict()}")
-                continue
-                
-            # Проверяем существование инвестора
-            investor = session.query(Investor).filter_by(full_name=row['Инвестор']).first()
-            if not investor:
-                investor = Investor(full_name=row['Инвестор'])
-                session.add(investor)
-                session.commit()
-                logger.info(f"Добавлен новый инвестор: {investor.full_name}")
-            
-            # Проверяем существование перевода
-            existing_transfer = session.query(Transfer).filter_by(
-                investor_id=investor.id,
-                amount=convert_amount(row['Сумма']),
-                currency=Currency[row['Валюта']],
-                transfer_date=row['Дата перевода']
-            ).first()
-            
-            if not existing_transfer:
-                # Создаем запись о переводе только если она не существует
-                transfer = Transfer(
-                    investor_id=investor.id,
-                    amount=convert_amount(row['Сумма']),
-                    currency=Currency[row['Валюта']],
-                    transfer_date=row['Дата перевода']
-                )
-                session.add(transfer)
-                logger.info(f"Добавлен перевод: {transfer.amount} {transfer.currency} на {transfer.transfer_date}")
-            else:
-                logger.info(f"Пропущен дубликат перевода: {row['Сумма']} {row['Валюта']} на {row['Дата перевода']}")
-        
+        started = time.perf_counter()
+        rows = added = 0
+        for df in iter_excel_chunks(path, TRANSFER_COLUMNS):
+            rows += len(df)
+            added += insert_transfers(session, prepare_transfers(df))
+        # Итоги казны пересчитываются в той же транзакции, что и загрузка;
+        # новая версия данных сообщает работающему боту, что кэш отчетов устарел
+        rebuild_all(session)
+        bump_data_version(session)
         session.commit()
-        logger.info("Данные о переводах успешно загружены")
+        log_speed("Данные о переводах успешно загружены", rows, added, started)
     except Exception as e:
         logger.error(f"Ошибка при загрузке переводов: {e}")
         session.rollback()
+    finally:
+        session.close()
 
-def load_service_purchases():
-    """Загрузка данных о покупках услуг"""
+def load_service_purchases(path='service_payments.xlsx'):
+    """Загрузка данных о покупках услуг порциями, без чтения всего файла в память"""
+    session = Session()
     try:
-        df = pd.read_excel('service_payments.xlsx')
-        # Удаляем строки, где все значения NaN
-        df = df.dropna(how='all')
-        logger.info(f"Загружено {len(df)} записей о покупках услуг")
-        
-        for _, row in df.iterrows():
-            # Пропускаем строки с пустыми значениями в обязательных полях
-            if pd.isna(row['Название сервиса']) or pd.isna(row['Сумма']) or \
-               pd.isna(row['Валюта']) or pd.isna(row['Дата оплаты']) or \
-               pd.isna(row['Период оплаты']):
-                logger.warning(f"Пропущена строка с пустыми значениями: {row.to_dict()}")
-                continue
-            
-            # Для бессрочных покупок устанавливаем YEAR как единицу периода
-            period_unit = row['Единица периода']
-            if pd.isna(period_unit) and str(row['Период оплаты']).lower() == 'бессрочно':
-                period_unit = 'YEAR'
-            elif pd.isna(period_unit):
-                logger.warning(f"Пропущена строка с пустым значением единицы периода: {row.to_dict()}")
-                continue
-                
-            purchase = ServicePurchase(
-                service_name=row['Название сервиса'],
-                amount=convert_amount(row['Сумма']),
-                currency=Currency[row['Валюта']],
-                purchase_date=row['Дата оплаты'],
-                period=convert_period(row['Период оплаты']),
-                period_unit=PeriodUnit[period_unit]
-            )
-            session.add(purchase)
-            logger.info(f"Добавлена покупка: {purchase.service_name} на сумму {purchase.amount} {purchase.currency}")
-        
+        started = time.perf_counter()
+        rows = added = 0
+        for df in iter_excel_chunks(path, SERVICE_PAYMENT_COLUMNS):
+            rows += len(df)
+            added += insert_service_purchases(session, prepare_service_purchases(df))
+        rebuild_all(session)
+        bump_data_version(session)
         session.commit()
-        logger.info("Данные о покупках услуг успешно загружены")
+        log_speed("Данные о покупках услуг успешно загружены", rows, added, started)
     except Exception as e:
         logger.error(f"Ошибка при загрузке покупок: {e}")
         session.rollback()
+    finally:
+        session.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     print("Начало загрузки данных...")
     load_investor_transfers()
     load_service_purchases()
-    print("Загрузка данных завершена") 
\ No newline at end of file
+    print("Загрузка данных завершена")
\ No newline at end of file
@@ -0,0 +1,149 @@
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Логгер курсов валют: его записи дополнительно пишутся в currency_api_logs.log
+CURRENCY_LOGGER = 'finance_bot.currency'
+# Логгер построчных подробностей расчета отчетов
+ROW_LOGGER = 'finance_bot.rows'
+
+# Построчные подробности отчетов (по записи на каждую строку) выключены по умолчанию
+LOG_ROW_DETAILS = os.getenv('LOG_ROW_DETAILS', '').lower() in ('1', 'true', 'yes')
+
+# Размер очереди записей между потоком бота и потоком записи логов
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Что делать при переполненной очереди: drop - отбросить запись, block - ждать места
+LOG_QUEUE_POLICY = os.getenv('LOG_QUEUE_POLICY', 'drop')
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class CurrencyFilter(logging.Filter):
+    """Пропускает только записи логгера курсов валют и его потомков"""
+
+    def __init__(self):
+        super().__init__(CURRENCY_LOGGER)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет записи в ограниченную очередь и сразу возвращает управление.
+    Форматирование, фильтры обработчиков и запись на диск выполняются
+    в фоновом потоке QueueListener.
+    """
+
+    def __init__(self, log_queue, policy=LOG_QUEUE_POLICY):
+        super().__init__(log_queue)
+        self.block = policy == 'block'
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь в памяти процесса: запись передается как есть,
+        # без форматирования сообщения в потоке бота
+        return record
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener, который при остановке дожидается места для маркера конца"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_queue_handler = None
+_listener = None
+
+
+def setup_logging():
+    """
+    Настройка логирования бота: консоль, основной файл и файл курсов валют.
+    Обработчики работают в фоновом потоке, логгеры только ставят записи в очередь.
+    """
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+    log_formatter = logging.Formatter(LOG_FORMAT)
+
+    # Основной файл логов
+    file_handler = logging.handlers.RotatingFileHandler(
+        'bot_logs.log',
+        maxBytes=10485760,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(log_formatter)
+
+    # Отдельный файл для логов курсов валют
+    currency_handler = logging.handlers.RotatingFileHandler(
+        'currency_api_logs.log',
+        maxBytes=10485760,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    currency_handler.setLevel(logging.INFO)
+    currency_handler.setFormatter(log_formatter)
+    currency_handler.addFilter(CurrencyFilter())
+
+    # Консольный обработчик
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(log_formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = BoundedQueueHandler(log_queue)
+    _listener = DrainingQueueListener(
+        log_queue, console_handler, file_handler, currency_handler,
+        respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+
+    # Настройка корневого логгера; force заменяет обработчики, которые
+    # успел поставить импортированный модуль (например, basicConfig в скрипте)
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[_queue_handler],
+        format=LOG_FORMAT,
+        force=True
+    )
+
+    # Построчные записи отбрасываются до форматирования, если подробности выключены
+    logging.getLogger(ROW_LOGGER).setLevel(logging.INFO if LOG_ROW_DETAILS else logging.WARNING)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток логирования"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    if _queue_handler.dropped:
+        # Поток уже остановлен, поэтому пишем напрямую в обработчики
+        record = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            "Очередь логов переполнялась, отброшено записей: %d", (_queue_handler.dropped,), None
+        )
+        for handler in listener.handlers:
+            handler.handle(record)
+    for handler in listener.handlers:
+        handler.flush()
+
+
+def queue_stats():
+    """Состояние очереди логов: (записей в очереди, отброшено записей)"""
+    if _queue_handler is None:
+        return 0, 0
+    return _queue_handler.queue.qsize(), _queue_handler.dropped
@@ -5,11 +5,25 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
 import requests
 import logging
-import logging.handlers
-import pandas as pd
-
+from sqlalchemy import select, tuple_
+
+from investor_keyboard import investor_keyboard, investor_page_handler, PAGE_PATTERN
+from metrics import instrument, start_metrics_server, stop_metrics_server
+from webhook import configure_builder, run_application, BOT_MODE
+from persistence import configure_persistence
+from cluster import rate_changed, reset_rate_caches
+from report_cache import report_cache, cached_report
+from logging_setup import setup_logging, stop_logging, CURRENCY_LOGGER, ROW_LOGGER
 from models import Base, Investor, Purchase, Transfer, ServicePurchase, Currency, ExchangeRate
-from database import engine, Session
+from database import engine, AsyncSession, AsyncReadSession, DATABASE_READ_URL, DB_REPLICA_LAG_SECONDS
+from rates import (
+    rate_cache, rate_history, MISSING, RATE_LOOKUP_MODE, missing_rate_message, upsert_rate_pair
+)
+from rate_matrix import rate_matrix
+from conversion import CONVERSION_MODE, convert_ledger, convert_grouped, reported, count_rows
+from migrate_db import run_migrations
+from ledger_totals import get_balance, refresh_for_rate
+from update_processor import ChatSerializingUpdateProcessor, BOT_CONCURRENT_UPDATES
 from handlers import (
     start_transfer, process_transfer_investor, process_transfer_amount,
     process_transfer_currency, process_transfer_date,
@@ -22,67 +36,44 @@ from handlers import (
 )
 
 # Настройка логирования
-log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# Основной файл логов
-file_handler = logging.handlers.RotatingFileHandler(
-    'bot_logs.log', 
-    maxBytes=10485760,  # 10MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(log_formatter)
-
-# Отдельный файл для логов API курсов валют
-currency_handler = logging.handlers.RotatingFileHandler(
-    'currency_api_logs.log', 
-    maxBytes=10485760,  # 10MB
-    backupCount=5,
-    encoding='utf-8'
-)
-currency_handler.setLevel(logging.INFO)
-currency_handler.setFormatter(log_formatter)
-
-# Фильтр для выделения логов API курсов валют
-class CurrencyFilter(logging.Filter):
-    def filter(self, record):
-        return 'курс' in record.getMessage().lower() or 'валют' in record.getMessage().lower()
-
-currency_handler.addFilter(CurrencyFilter())
-
-# Консольный обработчик
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(log_formatter)
-
-# Настройка корневого логгера
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[console_handler, file_handler],
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-# Добавление обработчика для логов валют
+setup_logging()
 logger = logging.getLogger(__name__)
-logger.addHandler(currency_handler)
+currency_logger = logging.getLogger(CURRENCY_LOGGER)
+row_logger = logging.getLogger(ROW_LOGGER)
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Создание таблиц
-Base.metadata.create_all(engine)
+# Скрипты могут менять и курсы: при смене версии данных сбрасываются и кэши курсов
+report_cache.on_external_change.append(reset_rate_caches)
 
 # Добавляем новое состояние в начало файла, после других состояний
 ADD_INVESTOR_NAME = 'add_investor_name'
 REMOVE_INVESTOR_SELECT = 'remove_investor_select'
 INVESTOR_INVESTMENTS_SELECT = 'investor_investments_select'  # Новое состояние
+
+# Максимальная длина сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Кнопки листания отчета о вложениях: invrep:<id инвестора>:<номер страницы>
+REPORT_PAGE_CALLBACK = 'invrep'
+# Сколько переводов читается из базы за одно обращение при построении страницы
+REPORT_PAGE_FETCH = 50
 ADD_RATE_DATE = 'add_rate_date'
 ADD_RATE_FROM_CURRENCY = 'add_rate_from_currency'
 ADD_RATE_TO_CURRENCY = 'add_rate_to_currency'
 ADD_RATE_VALUE = 'add_rate_value'
 
-def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date = None) -> float:
+def report_session():
+    """
+    Сессия для отчетов: реплика, а в первые DB_REPLICA_LAG_SECONDS после изменения
+    данных - основная база, чтобы отставшая реплика не попала в кэш отчетов
+    под новой версией данных
+    """
+    if DATABASE_READ_URL and report_cache.changed_within(DB_REPLICA_LAG_SECONDS):
+        return AsyncSession()
+    return AsyncReadSession()
+
+async def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date = None) -> float:
     """
     Получает курс обмена валют на указанную дату из базы данных.
     """
@@ -92,123 +83,113 @@ def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date
     
     # Проверяем, что дата указана
     if not date:
-        logger.warning("Дата не указана для получения курса валют, используется текущая дата")
+        currency_logger.warning("Дата не указана для получения курса валют, используется текущая дата")
         date = datetime.now().date()
     
-    session = Session()
-    try:
-        # Ищем курс в базе данных
-        rate = session.query(ExchangeRate).filter(
-            ExchangeRate.from_currency == from_currency,
-            ExchangeRate.to_currency == to_currency,
-            ExchangeRate.date == date
-        ).first()
-        
-        if rate:
-            logger.info(f"Найден курс на {date}: 1 {from_currency} = {rate.rate} {to_currency}")
-            return rate.rate
-        else:
-            error_msg = f"Не найден курс для конвертации {from_currency} в {to_currency} на дату {date.strftime('%d.%m.%Y')}. Пожалуйста, добавьте курс вручную через меню 'Добавить курс'"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
+    if RATE_LOOKUP_MODE == 'asof':
+        # Последний курс не позже даты из отсортированной истории курсов
+        await rate_history.load()
+        rate = rate_history.lookup(from_currency, to_currency, date)
+        if rate is None:
+            rate = MISSING
+    else:
+        # Сначала смотрим в кэш курсов
+        rate = rate_cache.get(from_currency, to_currency, date)
+    if rate is None:
+        generation = rate_cache.generation
+        async with AsyncSession() as session:
+            # Ищем курс в базе данных
+            result = await session.execute(
+                select(ExchangeRate.rate).where(
+                    ExchangeRate.from_currency == from_currency,
+                    ExchangeRate.to_currency == to_currency,
+                    ExchangeRate.date == date
+                )
+            )
+            saved_rate = result.scalars().first()
+        rate = saved_rate if saved_rate is not None else MISSING
+        rate_cache.put(from_currency, to_currency, date, rate, generation)
     
-    finally:
-        session.close()
-
-def calculate_total_purchases():
-    """Расчет общей суммы закупок"""
-    try:
-        session = Session()
-        purchases = session.query(ServicePurchase).all()
-        if not purchases:
-            return 0.0, "RUB"
-        
-        total_rub = 0.0
-        for purchase in purchases:
-            amount = float(purchase.amount)
-            if purchase.currency != 'RUB':
-                try:
-                    rate = get_exchange_rate(purchase.currency, 'RUB', purchase.date)
-                    amount *= rate
-                except ValueError as e:
-                    logger.error(f"Ошибка при конвертации валюты для закупки {purchase.id}: {e}")
-                    # Пропускаем эту закупку, если не можем получить курс
-                    continue
-            
-            total_rub += amount
-            
-        return round(total_rub, 2), "RUB"
-    except Exception as e:
-        logger.error(f"Ошибка при расчете общей суммы закупок: {e}")
-        return 0.0, "RUB"
-    finally:
-        session.close()
-
-def calculate_total_investments():
-    try:
-        df = read_investor_transfers()
-        if df.empty:
-            logger.error("Не удалось прочитать данные о переводах")
-            return 0.0, "RUB"
-        
-        total_rub = 0.0
-        for _, row in df.iterrows():
-            amount = float(row['Сумма'])
-            currency = row['Валюта']
-            date = row['Дата перевода'].strftime('%Y-%m-%d')
-            
-            if currency != 'RUB':
-                rate = get_exchange_rate(currency, 'RUB', date)
-                amount *= rate
-            
-            total_rub += amount
-            
-        return round(total_rub, 2), "RUB"
-    except Exception as e:
-        logger.error(f"Ошибка при расчете общей суммы инвестиций: {e}")
-        return 0.0, "RUB"
-
-async def calculate_total_purchases(session, target_currency):
+    if rate is MISSING:
+        # Прямого курса нет - пробуем кросс-курс по матрице курсов этого дня
+        cross_rate = await rate_matrix.lookup(from_currency, to_currency, date)
+        if cross_rate is not None:
+            row_logger.info("Найден кросс-курс на %s: 1 %s = %s %s", date, from_currency, cross_rate, to_currency)
+            return cross_rate
+    
+    if rate is not MISSING:
+        row_logger.info("Найден курс на %s: 1 %s = %s %s", date, from_currency, rate, to_currency)
+        return rate
+    else:
+        error_msg = missing_rate_message(from_currency, to_currency, date)
+        currency_logger.error(error_msg)
+        raise ValueError(error_msg)
+
+@cached_report('total_purchases')
+@reported('total_purchases')
+async def calculate_total_purchases(session, target_currency, mode=None):
     """
     Рассчитывает общую сумму закупок в указанной валюте
     """
-    logger.info(f"Начало расчета общей суммы закупок в валюте {target_currency}")
     if isinstance(target_currency, Currency):
         target_currency = target_currency.value
+    if mode is None:
+        mode = CONVERSION_MODE
         
     total = 0
     errors = []
     
     try:
-        # Получаем все покупки инвесторов
-        purchases = session.query(Purchase).all()
-        logger.info(f"Найдено {len(purchases)} покупок инвесторов")
+        if mode == 'sql':
+            total, errors = await convert_ledger(
+                session, Purchase, Purchase.purchase_date, target_currency, 'покупки', get_exchange_rate
+            )
+            service_total, service_errors = await convert_ledger(
+                session, ServicePurchase, ServicePurchase.purchase_date, target_currency, 'сервисной покупки',
+                get_exchange_rate
+            )
+            total += service_total
+            errors += service_errors
+        elif mode == 'grouped':
+            await rate_cache.preload(target_currency)
+            total, errors = await convert_grouped(
+                session, Purchase, Purchase.purchase_date, target_currency, 'покупки', get_exchange_rate
+            )
+            service_total, service_errors = await convert_grouped(
+                session, ServicePurchase, ServicePurchase.purchase_date, target_currency, 'сервисной покупки',
+                get_exchange_rate
+            )
+            total += service_total
+            errors += service_errors
+        else:
+            await rate_cache.preload(target_currency)
+            # Получаем все покупки инвесторов
+            result = await session.execute(select(Purchase))
+            purchases = result.scalars().all()
+            count_rows(len(purchases))
         
-        for purchase in purchases:
-            logger.info(f"Обработка покупки: {purchase.amount} {purchase.currency.value}")
-            try:
-                rate = get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
-                subtotal = purchase.amount * rate
-                logger.info(f"Конвертация: {purchase.amount} {purchase.currency.value} = {subtotal} {target_currency}")
-                total += subtotal
-            except ValueError as e:
-                errors.append(f"Ошибка конвертации для покупки {purchase.amount} {purchase.currency.value}: {str(e)}")
+            for purchase in purchases:
+                try:
+                    rate = await get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
+                    subtotal = purchase.amount * rate
+                    row_logger.info("Конвертация: %s %s = %s %s", purchase.amount, purchase.currency.value, subtotal, target_currency)
+                    total += subtotal
+                except ValueError as e:
+                    errors.append(f"Ошибка конвертации для покупки {purchase.amount} {purchase.currency.value}: {str(e)}")
         
-        # Получаем все покупки сервисов
-        service_purchases = session.query(ServicePurchase).all()
-        logger.info(f"Найдено {len(service_purchases)} покупок сервисов")
+            # Получаем все покупки сервисов
+            result = await session.execute(select(ServicePurchase))
+            service_purchases = result.scalars().all()
+            count_rows(len(service_purchases))
         
-        for purchase in service_purchases:
-            logger.info(f"Обработка покупки сервиса: {purchase.amount} {purchase.currency.value}")
-            try:
-                rate = get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
-                subtotal = purchase.amount * rate
-                logger.info(f"Конвертация: {purchase.amount} {purchase.currency.value} = {subtotal} {target_currency}")
-                total += subtotal
-            except ValueError as e:
-                errors.append(f"Ошибка конвертации для сервисной покупки {purchase.amount} {purchase.currency.value}: {str(e)}")
-            
-        logger.info(f"Итоговая сумма закупок: {total} {target_currency}")
+            for purchase in service_purchases:
+                try:
+                    rate = await get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
+                    subtotal = purchase.amount * rate
+                    row_logger.info("Конвертация: %s %s = %s %s", purchase.amount, purchase.currency.value, subtotal, target_currency)
+                    total += subtotal
+                except ValueError as e:
+                    errors.append(f"Ошибка конвертации для сервисной покупки {purchase.amount} {purchase.currency.value}: {str(e)}")
         
         if errors:
             raise ValueError("\n".join(errors))
@@ -217,35 +198,48 @@ async def calculate_total_purchases(session, target_currency):
         logger.error(f"Ошибка при расчете общей суммы закупок: {e}")
         raise
     finally:
-        session.close()
+        await session.close()
 
     return total
 
-async def calculate_total_investments(session, target_currency):
+@cached_report('total_investments')
+@reported('total_investments')
+async def calculate_total_investments(session, target_currency, mode=None):
     """
     Рассчитывает общую сумму вложений в указанной валюте
     """
     if isinstance(target_currency, Currency):
         target_currency = target_currency.value
+    if mode is None:
+        mode = CONVERSION_MODE
         
     total = 0
     errors = []
     
     try:
-        transfers = session.query(Transfer).all()
-        logger.info(f"Найдено {len(transfers)} переводов")
-        
-        for transfer in transfers:
-            logger.info(f"Обработка перевода: {transfer.amount} {transfer.currency.value}")
-            try:
-                rate = get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
-                subtotal = transfer.amount * rate
-                logger.info(f"Конвертация: {transfer.amount} {transfer.currency.value} = {subtotal} {target_currency}")
-                total += subtotal
-            except ValueError as e:
-                errors.append(f"Ошибка конвертации для перевода {transfer.amount} {transfer.currency.value}: {str(e)}")
+        if mode == 'sql':
+            total, errors = await convert_ledger(
+                session, Transfer, Transfer.transfer_date, target_currency, 'перевода', get_exchange_rate
+            )
+        elif mode == 'grouped':
+            await rate_cache.preload(target_currency)
+            total, errors = await convert_grouped(
+                session, Transfer, Transfer.transfer_date, target_currency, 'перевода', get_exchange_rate
+            )
+        else:
+            await rate_cache.preload(target_currency)
+            result = await session.execute(select(Transfer))
+            transfers = result.scalars().all()
+            count_rows(len(transfers))
         
-        logger.info(f"Итоговая сумма вложений: {total} {target_currency}")
+            for transfer in transfers:
+                try:
+                    rate = await get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
+                    subtotal = transfer.amount * rate
+                    row_logger.info("Конвертация: %s %s = %s %s", transfer.amount, transfer.currency.value, subtotal, target_currency)
+                    total += subtotal
+                except ValueError as e:
+                    errors.append(f"Ошибка конвертации для перевода {transfer.amount} {transfer.currency.value}: {str(e)}")
         
         if errors:
             raise ValueError("\n".join(errors))
@@ -254,35 +248,50 @@ async def calculate_total_investments(session, target_currency):
         logger.error(f"Ошибка при расчете общей суммы вложений: {e}")
         raise
     finally:
-        session.close()
+        await session.close()
 
     return total
 
-async def calculate_investor_investments(session, investor_id, target_currency):
+@cached_report('investor_investments')
+@reported('investor_investments')
+async def calculate_investor_investments(session, investor_id, target_currency, mode=None):
     """
     Рассчитывает сумму вложений конкретного инвестора в указанной валюте
     """
     if isinstance(target_currency, Currency):
         target_currency = target_currency.value
+    if mode is None:
+        mode = CONVERSION_MODE
         
     total = 0
     errors = []
     
     try:
-        transfers = session.query(Transfer).filter(Transfer.investor_id == investor_id).all()
-        logger.info(f"Найдено {len(transfers)} переводов для инвестора {investor_id}")
-        
-        for transfer in transfers:
-            logger.info(f"Обработка перевода: {transfer.amount} {transfer.currency.value}")
-            try:
-                rate = get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
-                subtotal = transfer.amount * rate
-                logger.info(f"Конвертация: {transfer.amount} {transfer.currency.value} = {subtotal} {target_currency}")
-                total += subtotal
-            except ValueError as e:
-                errors.append(f"Ошибка конвертации для перевода {transfer.amount} {transfer.currency.value}: {str(e)}")
+        if mode == 'sql':
+            total, errors = await convert_ledger(
+                session, Transfer, Transfer.transfer_date, target_currency, 'перевода', get_exchange_rate,
+                Transfer.investor_id == investor_id
+            )
+        elif mode == 'grouped':
+            await rate_cache.preload(target_currency)
+            total, errors = await convert_grouped(
+                session, Transfer, Transfer.transfer_date, target_currency, 'перевода', get_exchange_rate,
+                Transfer.investor_id == investor_id
+            )
+        else:
+            await rate_cache.preload(target_currency)
+            result = await session.execute(select(Transfer).where(Transfer.investor_id == investor_id))
+            transfers = result.scalars().all()
+            count_rows(len(transfers))
         
-        logger.info(f"Итоговая сумма вложений инвестора: {total} {target_currency}")
+            for transfer in transfers:
+                try:
+                    rate = await get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
+                    subtotal = transfer.amount * rate
+                    row_logger.info("Конвертация: %s %s = %s %s", transfer.amount, transfer.currency.value, subtotal, target_currency)
+                    total += subtotal
+                except ValueError as e:
+                    errors.append(f"Ошибка конвертации для перевода {transfer.amount} {transfer.currency.value}: {str(e)}")
         
         if errors:
             raise ValueError("\n".join(errors))
@@ -291,11 +300,13 @@ async def calculate_investor_investments(session, investor_id, target_currency):
         logger.error(f"Ошибка при расчете суммы вложений инвестора: {e}")
         raise
     finally:
-        session.close()
+        await session.close()
 
     return total
 
-async def calculate_treasury(session, target_currency):
+@cached_report('treasury')
+@reported('treasury')
+async def calculate_treasury(session, target_currency, mode=None):
     """
     Рассчитывает остаток казны в указанной валюте
     """
@@ -303,8 +314,13 @@ async def calculate_treasury(session, target_currency):
         target_currency = target_currency.value
         
     try:
-        total_investments = await calculate_total_investments(session, target_currency)
-        total_purchases = await calculate_total_purchases(session, target_currency)
+        # Быстрый путь: накопленные итоги в ledger_totals
+        balance = await get_balance(session, target_currency)
+        if balance is not None:
+            return balance
+        
+        total_investments = await calculate_total_investments(session, target_currency, mode)
+        total_purchases = await calculate_total_purchases(session, target_currency, mode)
         return total_investments - total_purchases
     except Exception as e:
         logger.error(f"Ошибка при расчете остатка казны: {e}")
@@ -338,17 +354,19 @@ async def start_add_investor(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def process_add_investor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода имени нового инвестора"""
     investor_name = update.message.text.strip()
-    session = Session()
+    session = AsyncSession()
     try:
         # Проверяем, существует ли уже такой инвестор
-        existing_investor = session.query(Investor).filter(Investor.full_name == investor_name).first()
+        result = await session.execute(select(Investor).where(Investor.full_name == investor_name))
+        existing_investor = result.scalars().first()
         if existing_investor:
             await update.message.reply_text(f'Инвестор с именем "{investor_name}" уже существует.')
         else:
             # Создаем нового инвестора
             new_investor = Investor(full_name=investor_name)
             session.add(new_investor)
-            session.commit()
+            await session.commit()
+            report_cache.bump()
             await update.message.reply_text(f'Инвестор "{investor_name}" успешно добавлен!')
         
         # Возвращаемся в главное меню
@@ -361,25 +379,20 @@ async def process_add_investor(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(f'Произошла ошибка при добавлении инвестора: {str(e)}')
         return ConversationHandler.END
     finally:
-        session.close()
+        await session.close()
 
 async def start_remove_investor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало процесса удаления инвестора"""
     query = update.callback_query
     await query.answer()
     
-    session = Session()
+    session = AsyncSession()
     try:
-        investors = session.query(Investor).all()
+        reply_markup, investors = await investor_keyboard(session, 'remove_')
         if not investors:
             await query.message.reply_text('Нет доступных инвесторов для удаления.')
             return ConversationHandler.END
         
-        keyboard = []
-        for investor in investors:
-            keyboard.append([InlineKeyboardButton(investor.full_name, callback_data=f'remove_{investor.id}')])
-        keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await query.message.reply_text('Выберите инвестора для удаления:', reply_markup=reply_markup)
         return REMOVE_INVESTOR_SELECT
     except Exception as e:
@@ -387,7 +400,7 @@ async def start_remove_investor(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.reply_text(f'Произошла ошибка: {str(e)}')
         return ConversationHandler.END
     finally:
-        session.close()
+        await session.close()
 
 async def process_remove_investor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора инвестора для удаления"""
@@ -399,13 +412,14 @@ async def process_remove_investor(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     
     investor_id = int(query.data.split('_')[1])
-    session = Session()
+    session = AsyncSession()
     try:
-        investor = session.query(Investor).filter(Investor.id == investor_id).first()
+        investor = await session.get(Investor, investor_id)
         if investor:
             investor_name = investor.full_name
-            session.delete(investor)
-            session.commit()
+            await session.delete(investor)
+            await session.commit()
+            report_cache.bump()
             await query.message.reply_text(f'Инвестор "{investor_name}" успешно удален!')
         else:
             await query.message.reply_text('Инвестор не найден.')
@@ -420,44 +434,138 @@ async def process_remove_investor(update: Update, context: ContextTypes.DEFAULT_
         await query.message.reply_text(f'Произошла ошибка при удалении инвестора: {str(e)}')
         return ConversationHandler.END
     finally:
-        session.close()
+        await session.close()
+
+def format_transfer(number, transfer, target_currency):
+    """Текст одной строки отчета о вложениях инвестора"""
+    return (
+        f"{number}. Дата: {transfer['date']}\n"
+        f"   Сумма: {transfer['amount']:.2f} {transfer['currency']}\n"
+        f"   Курс: 1 {transfer['currency']} = {transfer['rate']:.4f} {target_currency}\n"
+        f"   В {target_currency}: {transfer['amount_in_target']:.2f}\n\n"
+    )
 
-async def get_investor_transfers_details(session, investor_id, target_currency):
+@reported('investor_transfers_page')
+async def get_investor_transfers_page(session, investor_id, target_currency, max_chars, after=None, start=1):
     """
-    Получает детальную информацию о переводах инвестора
+    Получает одну страницу детальной информации о переводах инвестора.
+    Переводы читаются потоком в порядке (дата, id) начиная после курсора after,
+    пока текст страницы укладывается в max_chars символов; start - номер первой строки.
+    Возвращает (имя инвестора, текст строк или сообщение об ошибке, следующая страница),
+    где следующая страница - (курсор, номер первой строки) или None.
     """
     if isinstance(target_currency, Currency):
         target_currency = target_currency.value
     
     try:
-        investor = session.query(Investor).filter(Investor.id == investor_id).first()
+        await rate_cache.preload(target_currency)
+        investor = await session.get(Investor, investor_id)
         if not investor:
-            return None, "Инвестор не найден", 0
-        
-        transfers = session.query(Transfer).filter(Transfer.investor_id == investor_id).order_by(Transfer.transfer_date).all()
-        if not transfers:
-            return investor.full_name, [], 0  # Возвращаем три значения, включая total = 0
+            return None, "Инвестор не найден", None
+        
+        query = select(Transfer).where(Transfer.investor_id == investor_id)
+        if after is not None:
+            query = query.where(tuple_(Transfer.transfer_date, Transfer.id) > tuple_(*after))
+        query = query.order_by(Transfer.transfer_date, Transfer.id).execution_options(yield_per=REPORT_PAGE_FETCH)
+        
+        text = ""
+        number = start
+        next_page = None
+        rows = 0
+        result = await session.stream(query)
+        try:
+            async for transfer in result.scalars():
+                rate = await get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
+                line = format_transfer(number, {
+                    "date": transfer.transfer_date.strftime("%d.%m.%Y"),
+                    "amount": transfer.amount,
+                    "currency": transfer.currency.value,
+                    "amount_in_target": transfer.amount * rate,
+                    "rate": rate
+                }, target_currency)
+                if text and len(text) + len(line) > max_chars:
+                    # Страница заполнена: следующая начнется с этого перевода
+                    next_page = (last_key, number)
+                    break
+                text += line
+                last_key = (transfer.transfer_date, transfer.id)
+                number += 1
+                rows += 1
+        finally:
+            await result.close()
+        count_rows(rows)
+        return investor.full_name, text, next_page
+    except Exception as e:
+        logger.error(f"Ошибка при получении деталей вложений инвестора: {e}")
+        return None, f"Ошибка: {str(e)}", None
+
+async def send_investor_report_page(query, context, investor_id, page_number, edit=False):
+    """
+    Отправляет (или, при edit=True, показывает вместо текущей) страницу отчета
+    о вложениях инвестора. Курсоры уже показанных страниц хранятся в chat_data,
+    поэтому считается только запрошенная страница.
+    """
+    report = context.chat_data.get('investor_report')
+    if not report or report['investor_id'] != investor_id or page_number >= len(report['pages']):
+        # Бот перезапускался или отчет открыт заново: начинаем с первой страницы
+        report = context.chat_data['investor_report'] = {'investor_id': investor_id, 'pages': [(None, 1)]}
+        page_number = 0
+    after, start = report['pages'][page_number]
+    target_currency = Currency.RUB.value
+    session = report_session()
+    try:
+        total = await calculate_investor_investments(session, investor_id, target_currency)
+        investor = await session.get(Investor, investor_id)
+        if not investor:
+            await query.message.reply_text("Инвестор не найден")
+            return
         
-        details = []
-        total = 0
+        header = f"📊 *Вложения инвестора {investor.full_name}*\n\n"
+        footer = f"*Общая сумма вложений: {total:.2f} {target_currency}*\nСтраница {page_number + 1}"
+        investor_name, text, next_page = await get_investor_transfers_page(
+            session, investor_id, target_currency, TELEGRAM_MESSAGE_LIMIT - len(header) - len(footer), after, start
+        )
+        if investor_name is None:
+            await query.message.reply_text(text)  # Это сообщение об ошибке
+            return
+        if not text and page_number == 0:
+            await query.message.reply_text(f'Инвестор {investor_name} не делал вложений.')
+            return
+        
+        del report['pages'][page_number + 1:]
+        if next_page is not None:
+            report['pages'].append(next_page)
+        
+        navigation = []
+        if page_number > 0:
+            navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f'{REPORT_PAGE_CALLBACK}:{investor_id}:{page_number - 1}'))
+        if next_page is not None:
+            navigation.append(InlineKeyboardButton("Вперед ▶️", callback_data=f'{REPORT_PAGE_CALLBACK}:{investor_id}:{page_number + 1}'))
+        keyboard = [navigation] if navigation else []
+        keyboard.append([InlineKeyboardButton("Вернуться в главное меню", callback_data='start')])
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
-        for transfer in transfers:
-            rate = get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
-            amount_in_target = transfer.amount * rate
-            total += amount_in_target
-            
-            details.append({
-                "date": transfer.transfer_date.strftime("%d.%m.%Y"),
-                "amount": transfer.amount,
-                "currency": transfer.currency.value,
-                "amount_in_target": amount_in_target,
-                "rate": rate
-            })
-            
-        return investor.full_name, details, total
+        if edit:
+            await query.edit_message_text(header + text + footer, parse_mode='Markdown', reply_markup=reply_markup)
+        else:
+            await query.message.reply_text(header + text + footer, parse_mode='Markdown', reply_markup=reply_markup)
     except Exception as e:
-        logger.error(f"Ошибка при получении деталей вложений инвестора: {e}")
-        return None, f"Ошибка: {str(e)}", 0
+        logger.error(f"Ошибка при подсчете вложений инвестора: {e}")
+        await query.message.reply_text(f'Произошла ошибка при подсчете вложений: {str(e)}')
+    finally:
+        await session.close()
+
+async def investor_report_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание отчета о вложениях инвестора"""
+    query = update.callback_query
+    await query.answer()
+    _, investor_id, page_number = query.data.split(':')
+    await send_investor_report_page(query, context, int(investor_id), int(page_number), edit=True)
+
+def currency_keyboard():
+    """Клавиатура со всеми валютами, по три кнопки в ряд"""
+    buttons = [InlineKeyboardButton(currency.value, callback_data=currency.value) for currency in Currency]
+    return [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
 
 async def add_rate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало процесса добавления курса валют"""
@@ -477,12 +585,7 @@ async def process_rate_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['rate_date'] = date
         
         # Создаем клавиатуру с доступными валютами
-        keyboard = [
-            [InlineKeyboardButton("UAH", callback_data="UAH"),
-             InlineKeyboardButton("RUB", callback_data="RUB"),
-             InlineKeyboardButton("USD", callback_data="USD")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup(currency_keyboard())
         
         await update.message.reply_text(
             "Выберите исходную валюту:",
@@ -503,12 +606,7 @@ async def process_rate_from_currency(update: Update, context: ContextTypes.DEFAU
     context.user_data['from_currency'] = query.data
     
     # Создаем клавиатуру с оставшимися валютами
-    keyboard = [
-        [InlineKeyboardButton("UAH", callback_data="UAH"),
-         InlineKeyboardButton("RUB", callback_data="RUB"),
-         InlineKeyboardButton("USD", callback_data="USD")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = InlineKeyboardMarkup(currency_keyboard())
     
     await query.edit_message_text(
         text=f"Выбрана исходная валюта: {query.data}\nВыберите целевую валюту:",
@@ -542,50 +640,31 @@ async def process_rate_value(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if rate <= 0:
             raise ValueError("Курс должен быть положительным числом")
         
-        session = Session()
+        session = AsyncSession()
         try:
-            # Проверяем, существует ли уже курс на эту дату
-            existing_rate = session.query(ExchangeRate).filter(
-                ExchangeRate.from_currency == context.user_data['from_currency'],
-                ExchangeRate.to_currency == context.user_data['to_currency'],
-                ExchangeRate.date == context.user_data['rate_date']
-            ).first()
-            
-            if existing_rate:
-                existing_rate.rate = rate
-                action = "обновлен"
-            else:
-                new_rate = ExchangeRate(
-                    from_currency=context.user_data['from_currency'],
-                    to_currency=context.user_data['to_currency'],
-                    rate=rate,
-                    date=context.user_data['rate_date']
-                )
-                session.add(new_rate)
-                action = "добавлен"
-            
-            session.commit()
-            
-            # Добавляем обратный курс
+            # Курс и обратный курс записываются одним запросом
+            inserted = await upsert_rate_pair(
+                session,
+                context.user_data['from_currency'],
+                context.user_data['to_currency'],
+                context.user_data['rate_date'],
+                rate
+            )
+            # Итоги казны пересчитываются в той же транзакции
+            await refresh_for_rate(
+                session, context.user_data['from_currency'], context.user_data['to_currency']
+            )
+            await session.commit()
+            report_cache.bump()
+            action = "добавлен" if inserted else "обновлен"
             inverse_rate = 1 / rate
-            existing_inverse = session.query(ExchangeRate).filter(
-                ExchangeRate.from_currency == context.user_data['to_currency'],
-                ExchangeRate.to_currency == context.user_data['from_currency'],
-                ExchangeRate.date == context.user_data['rate_date']
-            ).first()
-            
-            if existing_inverse:
-                existing_inverse.rate = inverse_rate
-            else:
-                inverse_rate_obj = ExchangeRate(
-                    from_currency=context.user_data['to_currency'],
-                    to_currency=context.user_data['from_currency'],
-                    rate=inverse_rate,
-                    date=context.user_data['rate_date']
-                )
-                session.add(inverse_rate_obj)
-            
-            session.commit()
+            # Кэши курсов этого и остальных процессов бота
+            rate_changed(
+                context.user_data['from_currency'],
+                context.user_data['to_currency'],
+                context.user_data['rate_date'],
+                rate
+            )
             
             await update.message.reply_text(
                 f"Курс успешно {action}!\n"
@@ -595,11 +674,11 @@ async def process_rate_value(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             
         finally:
-            session.close()
+            await session.close()
         
         return ConversationHandler.END
         
-    except ValueError as e:
+    except ValueError:
         await update.message.reply_text(
             "Неверный формат курса. Пожалуйста, введите положительное число:"
         )
@@ -613,7 +692,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data == 'add_rate':
         return await add_rate(update, context)
     elif query.data == 'total_purchases':
-        session = Session()
+        session = report_session()
         target_currency = Currency.RUB.value
         try:
             progress_message = await query.message.reply_text('🔄 Идет подсчет общей суммы закупок...')
@@ -625,7 +704,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await progress_message.delete()
                 await query.message.edit_text(f'❌ Ошибка при расчете общей суммы закупок:\n{str(e)}')
         finally:
-            session.close()
+            await session.close()
     elif query.data == 'add_transfer':
         return await start_transfer(update, context)
     elif query.data == 'add_service_purchase':
@@ -634,75 +713,35 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start(update, context)
         return ConversationHandler.END
     elif query.data == 'investor_investments':
-        session = Session()
+        session = AsyncSession()
         try:
-            investors = session.query(Investor).all()
+            reply_markup, investors = await investor_keyboard(session, 'inv_calc_')
             if not investors:
                 await query.message.reply_text('Нет доступных инвесторов.')
                 return ConversationHandler.END
             
-            keyboard = []
-            for investor in investors:
-                keyboard.append([InlineKeyboardButton(investor.full_name, callback_data=f'inv_calc_{investor.id}')])
-            keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
             await query.message.reply_text('Выберите инвестора для подсчета вложений:', reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Ошибка при получении списка инвесторов: {e}")
             await query.message.reply_text(f'Произошла ошибка: {str(e)}')
         finally:
-            session.close()
+            await session.close()
         return INVESTOR_INVESTMENTS_SELECT
     elif query.data.startswith('inv_calc_'):
         investor_id = int(query.data.split('_')[2])
-        session = Session()
-        target_currency = Currency.RUB.value
+        context.chat_data['investor_report'] = {'investor_id': investor_id, 'pages': [(None, 1)]}
+        progress_message = await query.message.reply_text('🔄 Идет подсчет вложений инвестора...')
         try:
-            progress_message = await query.message.reply_text('🔄 Идет подсчет вложений инвестора...')
-            
-            investor_name, transfers_details, total = await get_investor_transfers_details(session, investor_id, target_currency)
-            
-            if investor_name is None:
-                await progress_message.delete()
-                await query.message.reply_text(transfers_details)  # Это сообщение об ошибке
-                return ConversationHandler.END
-                
-            if not transfers_details:
-                await progress_message.delete()
-                await query.message.reply_text(f'Инвестор {investor_name} не делал вложений.')
-                return ConversationHandler.END
-                
-            # Формируем подробный ответ
-            response = f"📊 *Вложения инвестора {investor_name}*\n\n"
-            
-            for i, transfer in enumerate(transfers_details, 1):
-                response += f"{i}. Дата: {transfer['date']}\n"
-                response += f"   Сумма: {transfer['amount']:.2f} {transfer['currency']}\n"
-                response += f"   Курс: 1 {transfer['currency']} = {transfer['rate']:.4f} {target_currency}\n"
-                response += f"   В {target_currency}: {transfer['amount_in_target']:.2f}\n\n"
-                
-            response += f"*Общая сумма вложений: {total:.2f} {target_currency}*"
-            
-            await progress_message.delete()
-            await query.message.reply_text(response, parse_mode='Markdown')
-            
-            # Возвращаемся в главное меню
-            keyboard = [[InlineKeyboardButton("Вернуться в главное меню", callback_data='start')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text('Выберите действие:', reply_markup=reply_markup)
-            return ConversationHandler.END
-        except Exception as e:
-            logger.error(f"Ошибка при подсчете вложений инвестора: {e}")
-            await query.message.reply_text(f'Произошла ошибка при подсчете вложений: {str(e)}')
-            return ConversationHandler.END
+            await send_investor_report_page(query, context, investor_id, 0)
         finally:
-            session.close()
+            await progress_message.delete()
+        return ConversationHandler.END
     elif query.data == 'cancel':
         await query.message.reply_text('Операция отменена.')
         return ConversationHandler.END
     
     # Восстанавливаем обработку общих кнопок
-    session = Session()
+    session = report_session()
     target_currency = Currency.RUB.value
     logger.info(f"Обработка кнопки: {query.data}")
     
@@ -731,37 +770,28 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при обработке кнопки: {e}")
         await query.message.reply_text(f'❌ Произошла ошибка при обработке запроса: {str(e)}')
     finally:
-        session.close()
+        await session.close()
     return
 
-def read_investor_transfers():
-    try:
-        df = pd.read_excel('investor_transfers.xlsx')
-        df['Сумма'] = pd.to_numeric(df['Сумма'].str.replace(' ', ''), errors='coerce')
-        df['Дата перевода'] = pd.to_datetime(df['Дата перевода'], format='%Y-%m-%d')
-        return df
-    except Exception as e:
-        logger.error(f"Ошибка при чтении файла investor_transfers.xlsx: {e}")
-        return pd.DataFrame()
-
-def read_service_payments():
-    try:
-        df = pd.read_excel('service_payments.xlsx')
-        df['Сумма'] = pd.to_numeric(df['Сумма'].str.replace(' ', ''), errors='coerce')
-        df['Дата оплаты'] = pd.to_datetime(df['Дата оплаты'], format='%Y-%m-%d')
-        return df
-    except Exception as e:
-        logger.error(f"Ошибка при чтении файла service_payments.xlsx: {e}")
-        return pd.DataFrame()
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Логирует исключения обработчиков и сетевые ошибки вместо трассировок без контекста"""
+    logger.error(f"Ошибка при обработке обновления {getattr(update, 'update_id', None)}: {context.error}",
+                 exc_info=context.error)
 
 def main():
+    # Таблицы и индексы создаются один раз: в кластере это делает front (cluster.py)
+    if BOT_MODE != 'worker':
+        run_migrations(engine)
     try:
         application = (
-            Application.builder()
+            configure_persistence(configure_builder(Application.builder()))
             .token(os.getenv('TELEGRAM_TOKEN'))
             .connect_timeout(30.0)
             .read_timeout(30.0)
             .write_timeout(30.0)
+            .concurrent_updates(ChatSerializingUpdateProcessor(BOT_CONCURRENT_UPDATES))
+            .post_init(start_metrics_server)
+            .post_shutdown(stop_metrics_server)
             .build()
         )
         
@@ -770,12 +800,15 @@ def main():
             entry_points=[CallbackQueryHandler(button_handler, pattern='^investor_investments$')],
             states={
                 INVESTOR_INVESTMENTS_SELECT: [
+                    CallbackQueryHandler(investor_page_handler, pattern=PAGE_PATTERN),
                     CallbackQueryHandler(button_handler, pattern='^inv_calc_\d+$'),
                     CallbackQueryHandler(button_handler, pattern='^cancel$')
                 ]
             },
             fallbacks=[CommandHandler('cancel', cancel)],
-            per_message=False
+            per_message=False,
+            name='investor_investments',
+            persistent=True
         )
         
         # Обработчик для добавления инвестора
@@ -784,28 +817,40 @@ def main():
             states={
                 ADD_INVESTOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_investor)]
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name='add_investor',
+            persistent=True
         )
         
         # Обработчик для удаления инвестора
         remove_investor_handler = ConversationHandler(
             entry_points=[CallbackQueryHandler(start_remove_investor, pattern='^remove_investor$')],
             states={
-                REMOVE_INVESTOR_SELECT: [CallbackQueryHandler(process_remove_investor)]
+                REMOVE_INVESTOR_SELECT: [
+                    CallbackQueryHandler(investor_page_handler, pattern=PAGE_PATTERN),
+                    CallbackQueryHandler(process_remove_investor)
+                ]
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name='remove_investor',
+            persistent=True
         )
         
         # Обработчик для добавления перевода
         transfer_conv_handler = ConversationHandler(
             entry_points=[CallbackQueryHandler(start_transfer, pattern='^add_transfer$')],
             states={
-                TRANSFER_INVESTOR: [CallbackQueryHandler(process_transfer_investor)],
+                TRANSFER_INVESTOR: [
+                    CallbackQueryHandler(investor_page_handler, pattern=PAGE_PATTERN),
+                    CallbackQueryHandler(process_transfer_investor)
+                ],
                 TRANSFER_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_transfer_amount)],
                 TRANSFER_CURRENCY: [CallbackQueryHandler(process_transfer_currency)],
                 TRANSFER_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_transfer_date)]
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name='transfer',
+            persistent=True
         )
         
         # Обработчик для добавления покупки сервиса
@@ -819,7 +864,9 @@ def main():
                 SERVICE_PERIOD: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_service_period)],
                 SERVICE_PERIOD_UNIT: [CallbackQueryHandler(process_service_period_unit)]
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name='service_purchase',
+            persistent=True
         )
         
         # Обработчик для добавления курса валют
@@ -831,7 +878,9 @@ def main():
                 ADD_RATE_TO_CURRENCY: [CallbackQueryHandler(process_rate_to_currency)],
                 ADD_RATE_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_rate_value)]
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name='add_rate',
+            persistent=True
         )
         
         application.add_handler(CommandHandler("start", start))
@@ -841,14 +890,19 @@ def main():
         application.add_handler(transfer_conv_handler)
         application.add_handler(service_purchase_conv_handler)
         application.add_handler(rate_conv_handler)
+        application.add_handler(CallbackQueryHandler(investor_report_page_handler, pattern=f'^{REPORT_PAGE_CALLBACK}:'))
         application.add_handler(CallbackQueryHandler(button_handler))
+        application.add_error_handler(error_handler)
+        # Время работы и число SQL-запросов каждого обработчика
+        instrument(application)
         
-        logger.info("Бот запущен")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        run_application(application)
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
         raise
+    finally:
+        stop_logging()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -3,12 +3,18 @@ from datetime import datetime
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
-import requests
 import logging
 import logging.handlers
 
 from models import Base, Investor, Purchase, Transfer, ServicePurchase, Currency, ExchangeRate
-from database import engine, Session
+from sqlalchemy import select, tuple_
+
+from database import engine, Session, AsyncSession
+from fx_client import fetch_rates, FxError
+from rates import upsert_rates
+from ledger_totals import refresh_for_rate
+from report_cache import report_cache
+from cluster import rate_changed
 from handlers import (
     start_transfer, process_transfer_investor, process_transfer_amount,
     process_transfer_currency, process_transfer_date,
@@ -24,72 +30,80 @@ from handlers import (
 log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date = None) -> float:
+async def get_exchange_rates(keys):
+    """
+    Получает курсы обмена валют для набора ключей (from_currency, to_currency, date).
+    Сохраненные курсы читаются из базы одним запросом, недостающие - одним
+    обращением к API (текущий курс) и сохраняются. Возвращает {ключ: курс};
+    курсов, которые не удалось получить, в результате нет.
+    """
+    rates = {}
+    wanted = set()
+    for from_currency, to_currency, date in keys:
+        if from_currency == to_currency:
+            rates[(from_currency, to_currency, date)] = 1.0
+        else:
+            wanted.add((from_currency, to_currency, date))
+    if not wanted:
+        return rates
+
+    async with AsyncSession() as session:
+        # Проверяем, какие курсы уже сохранены
+        result = await session.execute(
+            select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date, ExchangeRate.rate)
+            .where(tuple_(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date).in_(list(wanted)))
+        )
+        for from_currency, to_currency, date, rate in result.all():
+            rates[(from_currency, to_currency, date)] = rate
+        missing = wanted - rates.keys()
+        if not missing:
+            return rates
+
+        # Недостающие курсы - текущие из API, по одному запросу на исходную валюту
+        logger.info(f"Запрос текущих курсов для сохранения: {len(missing)} курсов")
+        try:
+            current = await fetch_rates({(from_currency, to_currency) for from_currency, to_currency, _ in missing})
+        except FxError as e:
+            logger.error(f"Критическая ошибка при получении курсов валют: {e}")
+            return rates
+
+        new_rates = {
+            (from_currency, to_currency, date): current[(from_currency, to_currency)]
+            for from_currency, to_currency, date in missing
+        }
+        # Один INSERT ... ON CONFLICT на все курсы: курс, сохраненный другим запросом,
+        # обновляется, а не дублируется
+        await upsert_rates(session, new_rates)
+        # Итоги казны пересчитываются в той же транзакции, как при вводе курса в боте
+        for from_currency, to_currency in sorted({(f, t) for f, t, _ in new_rates}):
+            await refresh_for_rate(session, from_currency, to_currency)
+        await session.commit()
+
+    report_cache.bump()
+    for (from_currency, to_currency, date), rate in sorted(new_rates.items()):
+        # Кэши курсов этого и остальных процессов бота
+        rate_changed(from_currency, to_currency, date, rate)
+        logger.info(f"Сохранен новый курс на {date}: 1 {from_currency} = {rate} {to_currency}")
+    rates.update(new_rates)
+    return rates
+
+async def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date = None) -> float:
     """
     Получает курс обмена валют на указанную дату.
     Если курс уже сохранен в базе - возвращает его,
     иначе использует текущий курс из API и сохраняет его.
     """
-    if from_currency == to_currency:
-        return 1.0
-    
     if not date:
         date = datetime.now().date()
-    
-    session = Session()
-    try:
-        # Проверяем, есть ли сохраненный курс для этой даты
-        saved_rate = session.query(ExchangeRate).filter(
-            ExchangeRate.from_currency == from_currency,
-            ExchangeRate.to_currency == to_currency,
-            ExchangeRate.date == date
-        ).first()
-        
-        if saved_rate:
-            logger.info(f"Найден сохраненный курс на {date}: 1 {from_currency} = {saved_rate.rate} {to_currency}")
-            return saved_rate.rate
-            
-        # Если курса нет - получаем текущий и сохраняем его
-        api_key = os.getenv('EXCHANGE_RATE_API_KEY')
-        url = f"https://v6.exchangerate-api.com/v6/{api_key}/pair/{from_currency}/{to_currency}"
-        logger.info(f"Запрос текущего курса для сохранения на дату {date}")
-        
-        response = requests.get(url)
-        if response.status_code != 200:
-            error_msg = f"Ошибка API: статус код {response.status_code}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-            
-        data = response.json()
-        if 'result' not in data or data.get('result') == 'error':
-            error_msg = f"Ошибка получения курса валют: {data.get('error', 'Неизвестная ошибка')}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-            
-        rate = data.get('conversion_rate')
-        if not rate:
-            error_msg = "Не удалось получить курс валют из ответа API"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-            
-        # Сохраняем полученный курс
-        new_rate = ExchangeRate(
-            from_currency=from_currency,
-            to_currency=to_currency,
-            rate=rate,
-            date=date
-        )
-        session.add(new_rate)
-        session.commit()
-        
-        logger.info(f"Сохранен новый курс на {date}: 1 {from_currency} = {rate} {to_currency}")
-        return rate
-        
-    except Exception as e:
-        logger.error(f"Критическая ошибка при получении курса валют: {e}")
-        raise ValueError(f"Не удалось получить курс валют: {str(e)}")
-    finally:
-        session.close()
+    rates = await get_exchange_rates([(from_currency, to_currency, date)])
+    return rate_for(rates, from_currency, to_currency, date)
+
+def rate_for(rates, from_currency, to_currency, date):
+    """Курс из результата get_exchange_rates; ValueError, если его не удалось получить"""
+    rate = rates.get((from_currency, to_currency, date))
+    if rate is None:
+        raise ValueError(f"Не удалось получить курс валют {from_currency} → {to_currency} на {date}")
+    return rate
 
 async def calculate_total_purchases(session, target_currency):
     """
@@ -102,26 +116,31 @@ async def calculate_total_purchases(session, target_currency):
     total = 0
     errors = []
     try:
-        # Получаем все покупки инвесторов
-        purchases = session.query(Purchase).all()
+        # Получаем все покупки инвесторов и сервисов
+        purchases = (await session.execute(select(Purchase))).scalars().all()
         logger.info(f"Найдено {len(purchases)} покупок инвесторов")
+        service_purchases = (await session.execute(select(ServicePurchase))).scalars().all()
+        logger.info(f"Найдено {len(service_purchases)} покупок сервисов")
+        # Все нужные курсы получаются одним обращением
+        rates = await get_exchange_rates({
+            (purchase.currency.value, target_currency, purchase.purchase_date)
+            for purchase in purchases + service_purchases
+        })
+
         for purchase in purchases:
             logger.info(f"Обработка покупки: {purchase.amount} {purchase.currency.value}")
             try:
-                rate = get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
+                rate = rate_for(rates, purchase.currency.value, target_currency, purchase.purchase_date)
                 subtotal = purchase.amount * rate
                 logger.info(f"Конвертация: {purchase.amount} {purchase.currency.value} = {subtotal} {target_currency}")
                 total += subtotal
             except ValueError as e:
                 errors.append(f"Ошибка конвертации для покупки {purchase.amount} {purchase.currency.value}: {str(e)}")
         
-        # Получаем все покупки сервисов
-        service_purchases = session.query(ServicePurchase).all()
-        logger.info(f"Найдено {len(service_purchases)} покупок сервисов")
         for purchase in service_purchases:
             logger.info(f"Обработка покупки сервиса: {purchase.amount} {purchase.currency.value}")
             try:
-                rate = get_exchange_rate(purchase.currency.value, target_currency, purchase.purchase_date)
+                rate = rate_for(rates, purchase.currency.value, target_currency, purchase.purchase_date)
                 subtotal = purchase.amount * rate
                 logger.info(f"Конвертация: {purchase.amount} {purchase.currency.value} = {subtotal} {target_currency}")
                 total += subtotal
@@ -146,10 +165,13 @@ async def calculate_total_investments(session, target_currency):
     total = 0
     errors = []
     try:
-        transfers = session.query(Transfer).all()
+        transfers = (await session.execute(select(Transfer))).scalars().all()
+        rates = await get_exchange_rates({
+            (transfer.currency.value, target_currency, transfer.transfer_date) for transfer in transfers
+        })
         for transfer in transfers:
             try:
-                rate = get_exchange_rate(transfer.currency.value, target_currency, transfer.transfer_date)
+                rate = rate_for(rates, transfer.currency.value, target_currency, transfer.transfer_date)
                 subtotal = transfer.amount * rate
                 total += subtotal
             except ValueError as e:
@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from collections import Counter, deque
+
+from sqlalchemy import event
+from telegram.ext import ConversationHandler
+
+from database import engine, async_engine, async_read_engine, read_engine, pool_stats
+from rates import rate_cache
+from report_cache import report_cache
+from logging_setup import queue_stats
+
+logger = logging.getLogger(__name__)
+
+# Адрес HTTP-эндпоинта метрик в формате Prometheus; без порта эндпоинт не запускается
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Запросы дольше этого порога (мс) попадают в образцы медленных запросов
+METRICS_SLOW_QUERY_MS = float(os.getenv('METRICS_SLOW_QUERY_MS', '100'))
+METRICS_SLOW_SAMPLES = int(os.getenv('METRICS_SLOW_SAMPLES', '20'))
+# Если один и тот же запрос выполнен за обработку обновления столько раз или больше,
+# в лог пишется предупреждение о возможном N+1; 0 - не проверять
+METRICS_N_PLUS_ONE = int(os.getenv('METRICS_N_PLUS_ONE', '0'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+
+class Histogram:
+    """Гистограмма Prometheus с накопительными корзинами по набору меток"""
+
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self._series = {}
+
+    def observe(self, value, label_value=None):
+        series = self._series.setdefault(label_value, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total, count) in sorted(self._series.items(), key=lambda item: str(item[0])):
+            labels = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {count}')
+            suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class UpdateStats:
+    """Запросы к базе, выполненные при обработке одного обновления одним обработчиком"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queries = 0
+        self.statements = Counter()
+
+
+handler_latency = Histogram(
+    'finance_bot_handler_duration_seconds', "Время работы обработчика", LATENCY_BUCKETS, 'handler'
+)
+handler_queries = Histogram(
+    'finance_bot_handler_queries', "Число SQL-запросов за вызов обработчика", QUERY_COUNT_BUCKETS, 'handler'
+)
+query_latency = Histogram('finance_bot_db_query_duration_seconds', "Время выполнения SQL-запроса", LATENCY_BUCKETS)
+handler_errors = Counter()
+slow_queries = deque(maxlen=METRICS_SLOW_SAMPLES)
+
+# Обработка обновлений идет в отдельных задачах asyncio; события SQLAlchemy
+# вызываются внутри задачи, поэтому статистика ищется по текущей задаче
+_task_stats = {}
+
+
+def _current_stats():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return None
+    return _task_stats.get(task)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    query_latency.observe(elapsed)
+    stats = _current_stats()
+    if stats is not None:
+        stats.queries += 1
+        if METRICS_N_PLUS_ONE:
+            stats.statements[statement] += 1
+    if elapsed * 1000 >= METRICS_SLOW_QUERY_MS:
+        slow_queries.append((elapsed, stats.handler if stats else None, ' '.join(statement.split())[:500]))
+
+
+def install_query_events():
+    """Подписывается на события выполнения запросов синхронного и асинхронного движков"""
+    for target in {engine, read_engine, async_engine.sync_engine, async_read_engine.sync_engine}:
+        if not event.contains(target, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(target, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(target, 'after_cursor_execute', _after_cursor_execute)
+
+
+def timed(name, callback):
+    """Оборачивает обработчик: время работы, число запросов и проверка на N+1"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        task = asyncio.current_task()
+        outer = _task_stats.get(task)
+        stats = _task_stats[task] = UpdateStats(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors[name] += 1
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+            handler_queries.observe(stats.queries, name)
+            if outer is None:
+                del _task_stats[task]
+            else:
+                _task_stats[task] = outer
+            for statement, count in stats.statements.items():
+                if count >= METRICS_N_PLUS_ONE:
+                    logger.warning(
+                        "Возможный N+1 в %s: запрос выполнен %d раз: %s",
+                        name, count, ' '.join(statement.split())[:300]
+                    )
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler, prefix=''):
+    if isinstance(handler, ConversationHandler):
+        # Шаги диалога различаются по имени функции, диалог - по имени, если оно задано
+        steps = handler.entry_points + handler.fallbacks
+        for state_steps in handler.states.values():
+            steps += state_steps
+        for step in steps:
+            _instrument_handler(step, handler.name or prefix)
+        return
+    callback = handler.callback
+    if getattr(callback, 'instrumented', False):
+        return
+    name = f"{prefix}:{callback.__name__}" if prefix else callback.__name__
+    handler.callback = timed(name, callback)
+
+
+def instrument(application):
+    """Добавляет замеры ко всем зарегистрированным обработчикам, включая шаги диалогов"""
+    install_query_events()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for histogram in (handler_latency, handler_queries, query_latency):
+        lines.extend(histogram.render())
+    lines.append("# HELP finance_bot_handler_errors_total Необработанные исключения в обработчиках")
+    lines.append("# TYPE finance_bot_handler_errors_total counter")
+    for name, count in sorted(handler_errors.items()):
+        lines.append(f'finance_bot_handler_errors_total{{handler="{name}"}} {count}')
+
+    counters = {
+        'finance_bot_rate_cache_hits_total': rate_cache.hits,
+        'finance_bot_rate_cache_misses_total': rate_cache.misses,
+        'finance_bot_report_cache_hits_total': report_cache.hits,
+        'finance_bot_report_cache_misses_total': report_cache.misses,
+        'finance_bot_log_records_dropped_total': queue_stats()[1],
+    }
+    for name, value in counters.items():
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    lines.append("# TYPE finance_bot_log_queue_size gauge")
+    lines.append(f"finance_bot_log_queue_size {queue_stats()[0]}")
+    lines.append("# HELP finance_bot_db_pool_connections Соединения пула по состоянию")
+    lines.append("# TYPE finance_bot_db_pool_connections gauge")
+    for name, stats in sorted(pool_stats().items()):
+        for state, value in stats.items():
+            lines.append(f'finance_bot_db_pool_connections{{engine="{name}",state="{state}"}} {value}')
+
+    # Образцы медленных запросов - комментариями, их текст не является метрикой
+    for elapsed, handler, statement in slow_queries:
+        lines.append(f"# slow_query {elapsed * 1000:.1f}ms handler={handler}: {statement}")
+    return "\n".join(lines) + "\n"
+
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else '/'
+        if path.split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', render_metrics()
+        else:
+            status, body = '404 Not Found', 'not found\n'
+        payload = body.encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode('ascii') + payload
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(application):
+    """post_init приложения: запускает HTTP-эндпоинт метрик, если задан METRICS_PORT"""
+    if not METRICS_PORT:
+        return
+    server = await asyncio.start_server(_serve, METRICS_HOST, METRICS_PORT)
+    application.bot_data['metrics_server'] = server
+    logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_metrics_server(application):
+    """post_shutdown приложения: останавливает эндпоинт метрик"""
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
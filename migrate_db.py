@@ -0,0 +1,42 @@
+from sqlalchemy import text
+from models import Base
+from database import engine
+from ledger_totals import build as build_ledger_totals
+import logging
+
+logger = logging.getLogger(__name__)
+
+def collapse_duplicate_rates(connection):
+    """Оставляет по одному (последнему добавленному) курсу на пару валют и дату"""
+    result = connection.execute(text("""
+        DELETE FROM exchange_rates
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM exchange_rates
+            GROUP BY from_currency, to_currency, date
+        )
+    """))
+    if result.rowcount:
+        logger.info(f"Удалено {result.rowcount} дубликатов курсов валют")
+    return result.rowcount
+
+def create_indexes(connection):
+    """Создает объявленные в моделях индексы, которых еще нет в базе"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def run_migrations(bind=engine):
+    """Приводит схему базы данных к моделям; безопасно запускать повторно"""
+    Base.metadata.create_all(bind)
+    with bind.begin() as connection:
+        collapse_duplicate_rates(connection)
+        create_indexes(connection)
+    # Итоги казны строятся здесь, на основной базе: пока они не построены,
+    # бот считает остаток полностью и не ведет итоги инкрементально
+    build_ledger_totals(bind)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print("Начало миграции базы данных...")
+    run_migrations()
+    print("Миграция завершена")
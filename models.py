@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Enum, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Enum, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import enum
@@ -21,6 +21,10 @@ class PeriodUnit(enum.Enum):
 
 class Investor(Base):
     __tablename__ = 'investors'
+    __table_args__ = (
+        # Постраничный вывод клавиатуры инвесторов по (full_name, id)
+        Index('ix_investors_full_name_id', 'full_name', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     full_name = Column(String, nullable=False)
@@ -29,6 +33,9 @@ class Investor(Base):
 
 class Purchase(Base):
     __tablename__ = 'purchases'
+    __table_args__ = (
+        Index('ix_purchases_purchase_date', 'purchase_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     investor_id = Column(Integer, ForeignKey('investors.id'))
@@ -43,6 +50,11 @@ class Purchase(Base):
 
 class Transfer(Base):
     __tablename__ = 'transfers'
+    __table_args__ = (
+        # Переводы инвестора в порядке дат (calculate_investor_investments, детализация)
+        Index('ix_transfers_investor_date', 'investor_id', 'transfer_date'),
+        Index('ix_transfers_transfer_date', 'transfer_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     investor_id = Column(Integer, ForeignKey('investors.id'))
@@ -54,6 +66,9 @@ class Transfer(Base):
 
 class ServicePurchase(Base):
     __tablename__ = 'service_purchases'
+    __table_args__ = (
+        Index('ix_service_purchases_purchase_date', 'purchase_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     service_name = Column(String, nullable=False)
@@ -66,10 +81,45 @@ class ServicePurchase(Base):
 class ExchangeRate(Base):
     """Модель для хранения курсов валют"""
     __tablename__ = 'exchange_rates'
+    __table_args__ = (
+        # Один курс на пару валют и дату; используется и для поиска, и для upsert
+        Index('ux_exchange_rates_pair_date', 'from_currency', 'to_currency', 'date', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     from_currency = Column(String, nullable=False)
     to_currency = Column(String, nullable=False)
     rate = Column(Float, nullable=False)
     date = Column(Date, nullable=False)
-    created_at = Column(DateTime, default=datetime.now) 
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+class LedgerTotal(Base):
+    """Накопленные итоги вложений и закупок по валютам для быстрого расчета казны"""
+    __tablename__ = 'ledger_totals'
+    __table_args__ = (
+        Index('ux_ledger_totals_key', 'kind', 'currency', 'target_currency', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # investments или purchases
+    currency = Column(String, nullable=False)  # валюта записей
+    target_currency = Column(String, nullable=False)  # валюта пересчета
+    amount = Column(Float, nullable=False, default=0.0)  # сумма в валюте записей
+    converted = Column(Float, nullable=False, default=0.0)  # сумма в target_currency
+    missing = Column(Integer, nullable=False, default=0)  # записей без курса
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class LedgerBuild(Base):
+    """Целевые валюты, в которых итоги ledger_totals построены по всем записям"""
+    __tablename__ = 'ledger_builds'
+
+    target_currency = Column(String, primary_key=True)
+    built_at = Column(DateTime, default=datetime.now)
+
+class DataVersion(Base):
+    """Версия данных, которую меняют служебные скрипты; бот по ней сбрасывает свои кэши"""
+    __tablename__ = 'data_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
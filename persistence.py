@@ -0,0 +1,229 @@
+import os
+import json
+import pickle
+import sqlite3
+import asyncio
+import logging
+from collections import defaultdict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Файл SQLite с состоянием диалогов и user_data/chat_data; пустое значение - без сохранения
+BOT_PERSISTENCE_PATH = os.getenv('BOT_PERSISTENCE_PATH', 'bot_state.sqlite')
+# Как часто (с) приложение передает изменившиеся данные на запись
+BOT_PERSISTENCE_INTERVAL = float(os.getenv('BOT_PERSISTENCE_INTERVAL', '5'))
+# Изменения, переданные за это время (с), записываются одной транзакцией
+PERSISTENCE_FLUSH_DELAY = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bot_state (
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    key BLOB NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (kind, owner, key)
+)
+"""
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Хранит состояние ConversationHandler, user_data и chat_data в локальном файле SQLite.
+    Каждый ключ словаря - отдельная строка: записываются только ключи, значение
+    которых изменилось с прошлой записи, а изменения за PERSISTENCE_FLUSH_DELAY
+    объединяются в одну транзакцию.
+    bot_data не сохраняется: в нем лежат объекты процесса (например, сервер метрик).
+    """
+
+    def __init__(self, path=BOT_PERSISTENCE_PATH, update_interval=BOT_PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._connection = None
+        # (kind, owner) -> {pickle ключа: pickle значения}, как сейчас записано в файле
+        self._written = None
+        # (kind, owner, pickle ключа) -> pickle значения или None (удалить)
+        self._pending = {}
+        # Владельцы, все строки которых нужно удалить до записи _pending
+        self._dropped = set()
+        self._flush_handle = None
+        # Создается в цикле событий приложения
+        self._write_lock = None
+
+    # --- Чтение при запуске ---
+
+    def _load(self):
+        """Все сохраненные данные одним запросом"""
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(SCHEMA)
+        written = defaultdict(dict)
+        for kind, owner, key, value in self._connection.execute('SELECT kind, owner, key, value FROM bot_state'):
+            written[(kind, owner)][key] = value
+        return written
+
+    async def _loaded(self):
+        if self._written is None:
+            self._written = await asyncio.to_thread(self._load)
+            logger.info(f"Загружено сохраненное состояние бота: {len(self._written)} записей из {self.path}")
+        return self._written
+
+    async def _get_data(self, kind):
+        data = {}
+        for (row_kind, owner), values in (await self._loaded()).items():
+            if row_kind == kind:
+                data[int(owner)] = {pickle.loads(key): pickle.loads(value) for key, value in values.items()}
+        return data
+
+    async def get_user_data(self):
+        return await self._get_data('user')
+
+    async def get_chat_data(self):
+        return await self._get_data('chat')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for (kind, owner), values in (await self._loaded()).items():
+            if kind == f"conversation:{name}":
+                conversations[tuple(json.loads(owner))] = pickle.loads(values[b''])
+        return conversations
+
+    # --- Запись изменений ---
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                PERSISTENCE_FLUSH_DELAY, lambda: asyncio.ensure_future(self._write_pending())
+            )
+
+    def _set(self, kind, owner, key, value):
+        """Запоминает изменение ключа, если оно отличается от записанного"""
+        written = self._written.setdefault((kind, owner), {})
+        if written.get(key) == value:
+            return
+        if value is None:
+            del written[key]
+        else:
+            written[key] = value
+        self._pending[(kind, owner, key)] = value
+        self._schedule_flush()
+
+    async def _update_data(self, kind, owner_id, data):
+        await self._loaded()
+        owner = str(owner_id)
+        keys = {pickle.dumps(key): value for key, value in data.items()}
+        for key in set(self._written.get((kind, owner), {})) - set(keys):
+            self._set(kind, owner, key, None)
+        for key, value in keys.items():
+            self._set(kind, owner, key, pickle.dumps(value))
+
+    async def update_user_data(self, user_id, data):
+        await self._update_data('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._update_data('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        await self._loaded()
+        owner = json.dumps(list(key))
+        self._set(f"conversation:{name}", owner, b'', None if new_state is None else pickle.dumps(new_state))
+
+    async def _drop(self, kind, owner_id):
+        await self._loaded()
+        owner = str(owner_id)
+        self._written.pop((kind, owner), None)
+        self._pending = {k: v for k, v in self._pending.items() if k[:2] != (kind, owner)}
+        self._dropped.add((kind, owner))
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        await self._drop('user', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._drop('chat', chat_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _write(self, dropped, pending):
+        with self._connection:
+            self._connection.executemany('DELETE FROM bot_state WHERE kind = ? AND owner = ?', dropped)
+            self._connection.executemany(
+                'DELETE FROM bot_state WHERE kind = ? AND owner = ? AND key = ?',
+                [key for key, value in pending.items() if value is None]
+            )
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO bot_state (kind, owner, key, value) VALUES (?, ?, ?, ?)',
+                [key + (value,) for key, value in pending.items() if value is not None]
+            )
+
+    def _lock(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def _write_pending(self):
+        self._flush_handle = None
+        if not self._pending and not self._dropped:
+            return
+        dropped, self._dropped = list(self._dropped), set()
+        pending, self._pending = self._pending, {}
+        async with self._lock():
+            try:
+                await asyncio.to_thread(self._write, dropped, pending)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка при сохранении состояния бота: {e}")
+
+    async def flush(self):
+        """Вызывается при остановке приложения: дописывает оставшиеся изменения"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        await self._write_pending()
+        async with self._lock():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def configure_persistence(builder):
+    """Подключает сохранение состояния к ApplicationBuilder, если задан BOT_PERSISTENCE_PATH"""
+    if BOT_PERSISTENCE_PATH:
+        builder = builder.persistence(SqlitePersistence())
+    return builder
+
+
+if __name__ == "__main__":
+    # Сводка по сохраненному состоянию
+    if not os.path.exists(BOT_PERSISTENCE_PATH):
+        print(f"Файл {BOT_PERSISTENCE_PATH} не найден")
+    else:
+        connection = sqlite3.connect(BOT_PERSISTENCE_PATH)
+        for kind, owners, keys in connection.execute(
+            'SELECT kind, COUNT(DISTINCT owner), COUNT(*) FROM bot_state GROUP BY kind ORDER BY kind'
+        ):
+            print(f"{kind}: {owners} владельцев, {keys} ключей")
+        connection.close()
@@ -0,0 +1,127 @@
+import os
+import threading
+import logging
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from models import ExchangeRate, Currency
+from database import AsyncSession
+from logging_setup import CURRENCY_LOGGER
+from rates import rate_history, RATE_LOOKUP_MODE, RATE_MAX_STALENESS_DAYS
+
+logger = logging.getLogger(CURRENCY_LOGGER)
+
+# Валюта, через которую в первую очередь считаются кросс-курсы
+RATE_PIVOT_CURRENCY = os.getenv('RATE_PIVOT_CURRENCY', 'USD')
+# Сколько дневных матриц держать в памяти
+RATE_MATRIX_DAYS = int(os.getenv('RATE_MATRIX_DAYS', '1000'))
+
+CURRENCIES = [currency.value for currency in Currency]
+CURRENCY_INDEX = {currency: i for i, currency in enumerate(CURRENCIES)}
+
+
+def build_matrix(direct_rates):
+    """
+    Строит матрицу курсов "любая валюта в любую" по прямым курсам
+    {(from_currency, to_currency): rate}. Недостающие пары считаются
+    через опорную валюту, а если это невозможно - по кратчайшему пути.
+    """
+    size = len(CURRENCIES)
+    direct = [[None] * size for _ in range(size)]
+    for i in range(size):
+        direct[i][i] = 1.0
+    for (from_currency, to_currency), rate in direct_rates.items():
+        if from_currency in CURRENCY_INDEX and to_currency in CURRENCY_INDEX:
+            direct[CURRENCY_INDEX[from_currency]][CURRENCY_INDEX[to_currency]] = rate
+
+    matrix = [row[:] for row in direct]
+    pivot = CURRENCY_INDEX.get(RATE_PIVOT_CURRENCY)
+    for source in range(size):
+        # Кратчайшие пути от source по прямым курсам (поиск в ширину)
+        path_rates = [None] * size
+        path_rates[source] = 1.0
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for target in range(size):
+                if path_rates[target] is None and direct[node][target] is not None:
+                    path_rates[target] = path_rates[node] * direct[node][target]
+                    queue.append(target)
+
+        for target in range(size):
+            if matrix[source][target] is not None:
+                continue
+            if pivot is not None and direct[source][pivot] is not None and direct[pivot][target] is not None:
+                matrix[source][target] = direct[source][pivot] * direct[pivot][target]
+            else:
+                matrix[source][target] = path_rates[target]
+    return matrix
+
+
+class RateMatrix:
+    """Кэш дневных матриц кросс-курсов; матрица дня строится при первом обращении"""
+
+    def __init__(self, max_days=RATE_MATRIX_DAYS):
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        # Увеличивается при каждом сбросе: матрица, построенная по курсам до сброса, не сохраняется
+        self._generation = 0
+
+    async def _direct_rates(self, date):
+        """Прямые курсы, действующие на дату"""
+        if RATE_LOOKUP_MODE == 'asof':
+            await rate_history.load()
+            direct = {}
+            for from_currency in CURRENCIES:
+                for to_currency in CURRENCIES:
+                    rate = rate_history.lookup(from_currency, to_currency, date)
+                    if rate is not None:
+                        direct[(from_currency, to_currency)] = rate
+            return direct
+        async with AsyncSession() as session:
+            result = await session.execute(
+                select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.rate)
+                .where(ExchangeRate.date == date)
+            )
+            return {(from_currency, to_currency): rate for from_currency, to_currency, rate in result.all()}
+
+    async def get_matrix(self, date):
+        with self._lock:
+            if date in self._days:
+                self._days.move_to_end(date)
+                return self._days[date]
+            generation = self._generation
+        matrix = build_matrix(await self._direct_rates(date))
+        with self._lock:
+            if generation != self._generation:
+                return matrix
+            self._days[date] = matrix
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        return matrix
+
+    async def lookup(self, from_currency, to_currency, date):
+        """Кросс-курс на дату или None, если валюты не связаны курсами"""
+        if from_currency not in CURRENCY_INDEX or to_currency not in CURRENCY_INDEX:
+            return None
+        matrix = await self.get_matrix(date)
+        return matrix[CURRENCY_INDEX[from_currency]][CURRENCY_INDEX[to_currency]]
+
+    def invalidate(self, date):
+        """Сбрасывает матрицы дней, на которые влияет курс, добавленный на date"""
+        days = RATE_MAX_STALENESS_DAYS if RATE_LOOKUP_MODE == 'asof' else 0
+        with self._lock:
+            self._generation += 1
+            for offset in range(days + 1):
+                self._days.pop(date + timedelta(days=offset), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._days.clear()
+
+
+rate_matrix = RateMatrix()
@@ -0,0 +1,285 @@
+import os
+import threading
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, literal_column, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import ExchangeRate
+from database import AsyncSession
+from logging_setup import CURRENCY_LOGGER
+
+logger = logging.getLogger(CURRENCY_LOGGER)
+
+# Максимальное количество курсов в кэше
+RATE_CACHE_SIZE = int(os.getenv('RATE_CACHE_SIZE', '10000'))
+
+# Поиск курса: exact - только на указанную дату,
+# asof - последний курс не позже даты, но не старше RATE_MAX_STALENESS_DAYS дней
+RATE_LOOKUP_MODE = os.getenv('RATE_LOOKUP_MODE', 'exact')
+RATE_MAX_STALENESS_DAYS = int(os.getenv('RATE_MAX_STALENESS_DAYS', '7'))
+
+# Маркер отсутствующего курса (отрицательный результат тоже кэшируется)
+MISSING = object()
+
+
+class RateCache:
+    """
+    Процессный LRU-кэш курсов валют по ключу (from_currency, to_currency, date).
+    Хранит и найденные курсы, и факт отсутствия курса, поэтому после прогрева
+    расчет отчетов не делает ни одного запроса к exchange_rates.
+    Каждый сброс увеличивает generation: курс, прочитанный из базы до сброса,
+    в кэш уже не попадает.
+    """
+
+    def __init__(self, maxsize=RATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._preloaded = set()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, from_currency, to_currency, date):
+        """Возвращает курс, MISSING или None, если ключа нет в кэше"""
+        key = (from_currency, to_currency, date)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, from_currency, to_currency, date, rate, generation=None):
+        """
+        Сохраняет курс. generation - значение self.generation до чтения курса из базы:
+        если с тех пор кэш сбрасывался, курс мог устареть и не сохраняется.
+        """
+        key = (from_currency, to_currency, date)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = rate
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, from_currency, to_currency, date):
+        """Удаляет из кэша курс и обратный к нему на указанную дату"""
+        with self._lock:
+            self.generation += 1
+            self._data.pop((from_currency, to_currency, date), None)
+            self._data.pop((to_currency, from_currency, date), None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+            self._preloaded.clear()
+
+    async def preload(self, to_currency):
+        """
+        Загружает одним запросом все курсы в указанную валюту.
+        Повторный вызов для той же валюты ничего не делает.
+        """
+        with self._lock:
+            if to_currency in self._preloaded:
+                return
+            generation = self.generation
+        async with AsyncSession() as session:
+            result = await session.execute(
+                select(ExchangeRate.from_currency, ExchangeRate.date, ExchangeRate.rate)
+                .where(ExchangeRate.to_currency == to_currency)
+            )
+            rows = result.all()
+        with self._lock:
+            if generation != self.generation:
+                # Пока шел запрос, курсы менялись: загрузка повторится при следующем вызове
+                return
+            for from_currency, date, rate in rows:
+                self._data[(from_currency, to_currency, date)] = rate
+                self._data.move_to_end((from_currency, to_currency, date))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._preloaded.add(to_currency)
+        logger.debug("Загружено %d курсов в %s в кэш", len(rows), to_currency)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+rate_cache = RateCache()
+
+
+class RateHistory:
+    """
+    Курсы каждой пары валют, отсортированные по дате, для поиска
+    последнего курса не позже заданной даты бинарным поиском за O(log n).
+    """
+
+    def __init__(self):
+        # (from_currency, to_currency) -> ([даты по возрастанию], [курсы])
+        self._pairs = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        # Увеличивается при каждом изменении: load() не затирает курсы, обновленные во время запроса
+        self._generation = 0
+
+    async def load(self):
+        """Загружает все курсы одним запросом; повторный вызов ничего не делает"""
+        with self._lock:
+            if self._loaded:
+                return
+            generation = self._generation
+        async with AsyncSession() as session:
+            result = await session.execute(
+                select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date, ExchangeRate.rate)
+                .order_by(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date)
+            )
+            rows = result.all()
+        pairs = {}
+        for from_currency, to_currency, date, rate in rows:
+            dates, rates = pairs.setdefault((from_currency, to_currency), ([], []))
+            dates.append(date)
+            rates.append(rate)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pairs = pairs
+            self._loaded = True
+        logger.info("Загружена история курсов: %s курсов, %s пар валют", len(rows), len(pairs))
+
+    def clear(self):
+        """Забывает загруженные курсы: следующий load() прочитает их из базы заново"""
+        with self._lock:
+            self._generation += 1
+            self._pairs = {}
+            self._loaded = False
+
+    def update(self, from_currency, to_currency, date, rate):
+        """Добавляет или заменяет курс пары на дату"""
+        with self._lock:
+            self._generation += 1
+            dates, rates = self._pairs.setdefault((from_currency, to_currency), ([], []))
+            i = bisect_left(dates, date)
+            if i < len(dates) and dates[i] == date:
+                rates[i] = rate
+            else:
+                dates.insert(i, date)
+                rates.insert(i, rate)
+
+    def update_pair(self, from_currency, to_currency, date, rate):
+        """Обновляет курс и обратный к нему"""
+        self.update(from_currency, to_currency, date, rate)
+        self.update(to_currency, from_currency, date, 1 / rate)
+
+    def lookup(self, from_currency, to_currency, date, max_staleness_days=RATE_MAX_STALENESS_DAYS):
+        """Последний курс не позже date и не старше max_staleness_days дней, либо None"""
+        with self._lock:
+            pair = self._pairs.get((from_currency, to_currency))
+            if not pair:
+                return None
+            dates, rates = pair
+            i = bisect_right(dates, date) - 1
+            if i < 0 or (date - dates[i]).days > max_staleness_days:
+                return None
+            return rates[i]
+
+
+rate_history = RateHistory()
+
+
+def lookup_rate(session, from_currency, to_currency, date):
+    """Курс из базы данных в рамках текущей (синхронной) сессии с учетом RATE_LOOKUP_MODE"""
+    query = select(ExchangeRate.rate).where(
+        ExchangeRate.from_currency == from_currency,
+        ExchangeRate.to_currency == to_currency
+    )
+    if RATE_LOOKUP_MODE == 'asof':
+        query = query.where(
+            ExchangeRate.date <= date,
+            ExchangeRate.date >= date - timedelta(days=RATE_MAX_STALENESS_DAYS)
+        ).order_by(ExchangeRate.date.desc()).limit(1)
+    else:
+        query = query.where(ExchangeRate.date == date)
+    return session.scalar(query)
+
+
+def missing_rate_message(from_currency, to_currency, date):
+    """Текст ошибки об отсутствующем курсе"""
+    return (
+        f"Не найден курс для конвертации {from_currency} в {to_currency} на дату {date.strftime('%d.%m.%Y')}. "
+        f"Пожалуйста, добавьте курс вручную через меню 'Добавить курс'"
+    )
+
+
+def insert_for(session, model):
+    """Возвращает insert с поддержкой ON CONFLICT для диалекта сессии"""
+    dialect = session.bind.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise ValueError(f"Upsert не поддерживается для {dialect}")
+
+
+async def upsert_rates(session, rates):
+    """
+    Одним запросом INSERT ... ON CONFLICT DO UPDATE сохраняет курсы
+    {(из, в, дата): курс} и обратные к ним; явно переданный курс важнее
+    вычисленного обратного. Возвращает множество добавленных (а не обновленных)
+    ключей из rates.
+    """
+    rows = {}
+    for (from_currency, to_currency, date), rate in rates.items():
+        rows.setdefault((to_currency, from_currency, date), 1 / rate)
+    rows.update(rates)
+    key = tuple_(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date)
+
+    postgresql_dialect = session.bind.dialect.name == 'postgresql'
+    if not postgresql_dialect:
+        # Без xmax наличие курсов проверяется в той же транзакции до записи
+        existing = await session.execute(
+            select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date)
+            .where(key.in_(list(rates)))
+        )
+        existed = {tuple(row) for row in existing.all()}
+    created_at = datetime.now()
+    stmt = insert_for(session, ExchangeRate).values([
+        dict(from_currency=from_currency, to_currency=to_currency,
+             rate=rate, date=date, created_at=created_at)
+        for (from_currency, to_currency, date), rate in rows.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date],
+        set_={'rate': stmt.excluded.rate}
+    )
+    if not postgresql_dialect:
+        await session.execute(stmt)
+        return set(rates) - existed
+
+    # xmax = 0 только у строки, добавленной этим запросом; у обновленной там номер транзакции
+    result = await session.execute(stmt.returning(
+        ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date,
+        literal_column('(xmax = 0)').label('inserted')
+    ))
+    return {
+        (from_currency, to_currency, date)
+        for from_currency, to_currency, date, inserted in result.all()
+        if inserted and (from_currency, to_currency, date) in rates
+    }
+
+
+async def upsert_rate_pair(session, from_currency, to_currency, date, rate):
+    """
+    Одним запросом сохраняет курс и обратный к нему.
+    Возвращает True, если прямой курс был добавлен, и False, если обновлен.
+    """
+    key = (from_currency, to_currency, date)
+    return key in await upsert_rates(session, {key: rate})
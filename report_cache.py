@@ -0,0 +1,148 @@
+import os
+import time
+import inspect
+import logging
+import functools
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import DataVersion
+from database import AsyncSession
+from rates import insert_for
+
+logger = logging.getLogger(__name__)
+
+# Как часто (с) бот проверяет версию данных в базе, которую меняют служебные скрипты
+REPORT_CACHE_CHECK_SECONDS = float(os.getenv('REPORT_CACHE_CHECK_SECONDS', '5'))
+
+
+class ReportCache:
+    """
+    Кэш готовых результатов отчетов по ключу (отчет, валюта, инвестор, режим конвертации).
+    Результаты действительны, пока не изменится версия данных:
+    каждая запись переводов, покупок, инвесторов или курсов вызывает bump().
+    Изменения, сделанные скриптами в обход бота, обнаруживаются по версии
+    данных в базе (check_data_version).
+    """
+
+    def __init__(self, check_seconds=REPORT_CACHE_CHECK_SECONDS):
+        self.version = 0
+        self.check_seconds = check_seconds
+        # Последняя прочитанная версия данных в базе и когда она читалась
+        self._data_version = None
+        self._checked_at = None
+        # Когда (time.monotonic) данные менялись в последний раз
+        self.bumped_at = None
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+        # Функции, которые вызываются при изменении данных в этом процессе
+        # (например, рассылка сброса кэша другим процессам бота)
+        self.on_bump = []
+        # Функции, которые вызываются, когда данные изменил служебный скрипт
+        # (например, сброс кэшей курсов)
+        self.on_external_change = []
+
+    def bump(self, local=False):
+        """
+        Новая версия данных: все сохраненные результаты устаревают.
+        local=True - изменение пришло из другого процесса, оповещать никого не нужно.
+        """
+        self.version += 1
+        self.bumped_at = time.monotonic()
+        self._results.clear()
+        if not local:
+            for callback in self.on_bump:
+                callback()
+
+    async def check_data_version(self):
+        """
+        Не чаще раза в check_seconds читает версию данных из базы;
+        если ее изменил служебный скрипт, сбрасывает кэш.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = now
+        try:
+            async with AsyncSession() as session:
+                version = await session.scalar(select(DataVersion.version).where(DataVersion.id == 1)) or 0
+        except SQLAlchemyError as e:
+            logger.warning(f"Не удалось проверить версию данных: {e}")
+            return
+        if self._data_version is not None and version != self._data_version:
+            logger.info(f"Данные изменены в обход бота (версия {version}), кэши сброшены")
+            self.bump(local=True)
+            for callback in self.on_external_change:
+                callback()
+        self._data_version = version
+
+    def changed_within(self, seconds):
+        """Менялись ли данные за последние seconds секунд"""
+        return self.bumped_at is not None and time.monotonic() - self.bumped_at < seconds
+
+    def get(self, key):
+        """Возвращает (True, результат) или (False, None), если результата нет"""
+        if key in self._results:
+            self.hits += 1
+            return True, self._results[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, version, result):
+        """Сохраняет результат, если данные не менялись, пока он считался"""
+        if version == self.version:
+            self._results[key] = result
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'size': len(self._results),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+report_cache = ReportCache()
+
+
+def bump_data_version(session):
+    """
+    Увеличивает версию данных в базе в транзакции синхронной сессии session.
+    Вызывается служебными скриптами, которые меняют данные в обход бота.
+    """
+    stmt = insert_for(session, DataVersion).values(id=1, version=1, updated_at=datetime.now())
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[DataVersion.id],
+        set_={'version': DataVersion.version + 1, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+def cached_report(report):
+    """
+    Декоратор асинхронной функции отчета: результат берется из report_cache,
+    ключ - (report, target_currency, investor_id, mode). Ошибки не кэшируются.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            target_currency = arguments.get('target_currency')
+            key = (
+                report, getattr(target_currency, 'value', target_currency),
+                arguments.get('investor_id'), arguments.get('mode')
+            )
+            await report_cache.check_data_version()
+            found, result = report_cache.get(key)
+            if found:
+                return result
+            version = report_cache.version
+            result = await func(*args, **kwargs)
+            report_cache.put(key, version, result)
+            return result
+        return wrapper
+    return decorator
@@ -1,9 +1,9 @@
 import os
-import requests
+import asyncio
 import datetime
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from database import Session
+from fx_client import fetch_rates
 from models import ExchangeRate
 
 # Настройка логирования
@@ -13,10 +13,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Создание сессии базы данных
-engine = create_engine(os.getenv('DATABASE_URL'))
-Session = sessionmaker(bind=engine)
-
 def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date = None) -> float:
     """
     Получает курс обмена валют на указанную дату.
@@ -43,27 +39,8 @@ def get_exchange_rate(from_currency: str, to_currency: str, date: datetime.date
             return saved_rate.rate
         
         # Если курса нет - получаем текущий и сохраняем его
-        api_key = os.getenv('EXCHANGE_RATE_API_KEY')
-        url = f"https://v6.exchangerate-api.com/v6/{api_key}/pair/{from_currency}/{to_currency}"
         logger.info(f"Запрос текущего курса для сохранения на дату {date}")
-        
-        response = requests.get(url)
-        if response.status_code != 200:
-            error_msg = f"Ошибка API: статус код {response.status_code}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-        
-        data = response.json()
-        if 'result' not in data or data.get('result') == 'error':
-            error_msg = f"Ошибка получения курса валют: {data.get('error', 'Неизвестная ошибка')}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-        
-        rate = data.get('conversion_rate')
-        if not rate:
-            error_msg = "Не удалось получить курс валют из ответа API"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
+        rate = asyncio.run(fetch_rates([(from_currency, to_currency)]))[(from_currency, to_currency)]
         
         # Сохраняем полученный курс
         new_rate = ExchangeRate(
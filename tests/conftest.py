@@ -0,0 +1,51 @@
+import os
+import asyncio
+import tempfile
+
+import pytest
+
+# database.py создает подключения при импорте, поэтому адрес тестовой базы
+# задается до импорта модулей бота
+TEST_DB = os.path.join(tempfile.mkdtemp(prefix='finance-bot-tests-'), 'test.sqlite')
+os.environ['DATABASE_URL'] = f"sqlite:///{TEST_DB}"
+os.environ.pop('DATABASE_READ_URL', None)
+os.environ['LEDGER_TARGET_CURRENCIES'] = 'RUB'
+os.environ['RATE_LOOKUP_MODE'] = 'exact'
+
+
+@pytest.fixture
+def db():
+    """Пустая база с текущей схемой; кэши курсов сброшены"""
+    from database import engine, async_engine
+    from models import Base
+    from migrate_db import run_migrations
+    from rates import rate_cache, rate_history
+    from rate_matrix import rate_matrix
+
+    Base.metadata.drop_all(engine)
+    run_migrations(engine)
+    rate_cache.clear()
+    rate_history.clear()
+    rate_matrix.clear()
+    yield engine
+    # Соединения aiosqlite привязаны к циклу событий теста
+    asyncio.run(async_engine.dispose())
+
+
+@pytest.fixture
+def main(db, tmp_path, monkeypatch):
+    """Модуль main.py с пустым кэшем отчетов"""
+    import logging
+    from logging_setup import stop_logging
+    from report_cache import report_cache
+
+    # main.py настраивает логирование при импорте: файлы логов создаются во временном
+    # каталоге, а обработчики корневого логгера после теста восстанавливаются
+    monkeypatch.chdir(tmp_path)
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    import main
+    report_cache.bump(local=True)
+    yield main
+    stop_logging()
+    root.handlers[:], root.level = saved
@@ -0,0 +1,79 @@
+import json
+import asyncio
+
+import cluster
+from cluster import Front
+
+UPDATES = [{'update_id': update_id} for update_id in range(1, 6)]
+
+
+class FakeApplication:
+    """Приложение, которое только запоминает обработанные обновления"""
+
+    def __init__(self):
+        self.bot = None
+        self.update_processor = self
+        self.processed = []
+
+    async def process_update(self, update, coroutine=None):
+        if coroutine is not None:
+            return await coroutine
+        self.processed.append(update.update_id)
+
+
+def test_front_replays_unacked_updates(tmp_path, monkeypatch):
+    monkeypatch.setattr(cluster, 'CLUSTER_SOCKET_DIR', str(tmp_path))
+    monkeypatch.setattr(cluster, 'RECONNECT_DELAY', 0.01)
+
+    async def scenario():
+        received = []
+        connections = []
+
+        async def worker(reader, writer):
+            connections.append(writer)
+            if len(connections) == 1:
+                # Обработчик получил обновления и упал, ничего не подтвердив
+                for _ in range(2):
+                    await reader.readline()
+                writer.close()
+                return
+            while line := await reader.readline():
+                data = json.loads(line)
+                received.append(data['update_id'])
+                writer.write(json.dumps({'ack': data['update_id']}).encode() + b'\n')
+
+        server = await cluster._unix_server(cluster.worker_socket(0), worker)
+        front = Front(bot=None, workers=1)
+        for data in UPDATES:
+            front.queues[0].put_nowait(data)
+        forward = asyncio.create_task(front.forward(0))
+
+        async def all_received():
+            while len(received) < len(UPDATES):
+                await asyncio.sleep(0.01)
+        try:
+            await asyncio.wait_for(all_received(), 5)
+        finally:
+            forward.cancel()
+            server.close()
+        return received
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 4, 5]
+
+
+def test_worker_acks_processed_updates(tmp_path, monkeypatch):
+    monkeypatch.setattr(cluster, 'CLUSTER_SOCKET_DIR', str(tmp_path))
+    application = FakeApplication()
+
+    async def scenario():
+        server = await cluster._unix_server(cluster.worker_socket(0), cluster.update_handler(application))
+        reader, writer = await asyncio.open_unix_connection(cluster.worker_socket(0))
+        for data in UPDATES:
+            await cluster._send_line(writer, data)
+        acks = [json.loads(await reader.readline())['ack'] for _ in UPDATES]
+        writer.close()
+        server.close()
+        return acks
+
+    assert sorted(asyncio.run(scenario())) == [1, 2, 3, 4, 5]
+    assert application.processed == [1, 2, 3, 4, 5]
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from database import Session, AsyncSession
+from models import Investor, Transfer, Purchase, ServicePurchase, ExchangeRate, Currency, PeriodUnit
+
+DAY = date(2024, 3, 1)
+NEXT_DAY = date(2024, 3, 2)
+
+
+@pytest.fixture
+def ledger(db):
+    """Записи в разных валютах; курса EUR → RUB нет, он считается через USD"""
+    with Session() as session:
+        investor = Investor(full_name='Иванов Иван')
+        other = Investor(full_name='Петров Петр')
+        session.add_all([investor, other])
+        session.flush()
+        session.add_all([
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=90.0, date=DAY),
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=92.0, date=NEXT_DAY),
+            ExchangeRate(from_currency='EUR', to_currency='USD', rate=1.1, date=DAY),
+            Transfer(investor_id=investor.id, amount=1000.0, currency=Currency.RUB, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=10.0, currency=Currency.USD, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=10.0, currency=Currency.USD, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=5.0, currency=Currency.USD, transfer_date=NEXT_DAY),
+            Transfer(investor_id=other.id, amount=20.0, currency=Currency.EUR, transfer_date=DAY),
+            Purchase(investor_id=investor.id, service_name='Курс', amount=300.0, currency=Currency.RUB,
+                     purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH),
+            ServicePurchase(service_name='Нейросеть', amount=2.0, currency=Currency.USD,
+                            purchase_date=NEXT_DAY, period=1, period_unit=PeriodUnit.MONTH),
+            ServicePurchase(service_name='Хостинг', amount=3.0, currency=Currency.EUR,
+                            purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH),
+        ])
+        session.commit()
+        return investor.id
+
+
+# 1000 + 20 * 90 + 5 * 92 + 20 * 1.1 * 90
+INVESTMENTS = 1000.0 + 1800.0 + 460.0 + 1980.0
+# 300 + 2 * 92 + 3 * 1.1 * 90
+PURCHASES = 300.0 + 184.0 + 297.0
+
+
+def totals(main, mode, investor_id):
+    async def compute():
+        results = []
+        for report, args in (
+            (main.calculate_total_investments, ()),
+            (main.calculate_total_purchases, ()),
+            (main.calculate_investor_investments, (investor_id,)),
+        ):
+            async with AsyncSession() as session:
+                results.append(await report(session, *args, 'RUB', mode=mode))
+        return results
+    return asyncio.run(compute())
+
+
+def test_sql_mode_matches_rows_mode(main, ledger):
+    expected = [pytest.approx(INVESTMENTS), pytest.approx(PURCHASES), pytest.approx(1000.0 + 1800.0 + 460.0)]
+    assert totals(main, 'rows', ledger) == expected
+    assert totals(main, 'sql', ledger) == expected
+
+
+def test_missing_rate_reported_in_sql_and_rows_modes(main, ledger):
+    with Session() as session:
+        session.add(Transfer(investor_id=ledger, amount=7.0, currency=Currency.UAH, transfer_date=DAY))
+        session.commit()
+
+    async def compute(mode):
+        async with AsyncSession() as session:
+            return await main.calculate_total_investments(session, 'RUB', mode=mode)
+    for mode in ('rows', 'sql'):
+        with pytest.raises(ValueError, match="перевода 7.0 UAH"):
+            asyncio.run(compute(mode))
+
+
+def test_grouped_mode_matches_rows_mode(main, ledger):
+    assert totals(main, 'grouped', ledger) == totals(main, 'rows', ledger)
+
+
+def test_grouped_mode_converts_each_group_once(main, ledger, monkeypatch):
+    requested = []
+    get_exchange_rate = main.get_exchange_rate
+
+    async def counting(from_currency, to_currency, date=None):
+        requested.append((from_currency, date))
+        return await get_exchange_rate(from_currency, to_currency, date)
+    monkeypatch.setattr(main, 'get_exchange_rate', counting)
+
+    async def compute():
+        async with AsyncSession() as session:
+            return await main.calculate_total_investments(session, 'RUB', mode='grouped')
+    assert asyncio.run(compute()) == pytest.approx(INVESTMENTS)
+    # Два перевода USD за один день - одна группа и один курс
+    assert sorted(requested) == [('EUR', DAY), ('RUB', DAY), ('USD', DAY), ('USD', NEXT_DAY)]
+
+
+def test_grouped_mode_reports_missing_rate_per_group(main, ledger):
+    with Session() as session:
+        for _ in range(2):
+            session.add(Transfer(investor_id=ledger, amount=7.0, currency=Currency.UAH, transfer_date=DAY))
+        session.commit()
+
+    async def compute():
+        async with AsyncSession() as session:
+            return await main.calculate_total_investments(session, 'RUB', mode='grouped')
+    with pytest.raises(ValueError, match=r"перевода 14.0 UAH \(2 записей\)"):
+        asyncio.run(compute())
@@ -0,0 +1,106 @@
+import asyncio
+
+import httpx
+import pytest
+
+import fx_client
+from fx_client import FxClient, FxError
+
+RATES = {'result': 'success', 'conversion_rates': {'RUB': 90.0, 'EUR': 0.9}}
+
+
+def client_with(responses):
+    """Клиент, который отвечает из списка responses (код статуса или исключение) и считает запросы"""
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        response = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return httpx.Response(response, json=RATES if response == 200 else {})
+
+    client = FxClient('http://fx.test', 'key')
+    client._client = httpx.AsyncClient(base_url='http://fx.test/key', transport=httpx.MockTransport(handler))
+    return client, requests
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Паузы между повторами вместо настоящего ожидания"""
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record(delay):
+        delays.append(delay)
+        await sleep(0)
+    monkeypatch.setattr(fx_client.asyncio, 'sleep', record)
+    return delays
+
+
+def test_retries_with_backoff(delays, monkeypatch):
+    monkeypatch.setattr(fx_client, 'FX_RETRIES', 3)
+    monkeypatch.setattr(fx_client, 'FX_BACKOFF', 0.5)
+    client, requests = client_with([503, httpx.ConnectError('нет соединения'), 429, 200])
+    assert asyncio.run(client.rate('USD', 'RUB')) == 90.0
+    assert len(requests) == 4
+    assert delays == [0.5, 1.0, 2.0]
+
+
+def test_gives_up_after_retries(delays, monkeypatch):
+    monkeypatch.setattr(fx_client, 'FX_RETRIES', 2)
+    client, requests = client_with([503])
+    with pytest.raises(FxError):
+        asyncio.run(client.rate('USD', 'RUB'))
+    assert len(requests) == 3
+
+
+def test_client_error_is_not_retried(delays):
+    client, requests = client_with([404])
+    with pytest.raises(FxError):
+        asyncio.run(client.rate('USD', 'RUB'))
+    assert len(requests) == 1
+    assert delays == []
+
+
+def test_pairs_of_one_base_share_a_request():
+    client, requests = client_with([200])
+    rates = asyncio.run(client.rates([('USD', 'RUB'), ('USD', 'EUR'), ('USD', 'USD')]))
+    assert rates == {('USD', 'RUB'): 90.0, ('USD', 'EUR'): 0.9, ('USD', 'USD'): 1.0}
+    assert requests == ['/key/latest/USD']
+
+
+def test_shared_client_keeps_cache_between_calls(monkeypatch):
+    client, requests = client_with([200])
+    monkeypatch.setattr(fx_client, '_client', None)
+
+    async def fetch():
+        # Общий клиент создается при первом вызове; подменяем его тестовым
+        fx_client.get_fx_client()
+        monkeypatch.setattr(fx_client, '_client', client)
+        first = await fx_client.fetch_rates([('USD', 'RUB')])
+        second = await fx_client.fetch_rates([('USD', 'EUR')])
+        assert fx_client.get_fx_client() is client
+        await fx_client.close_fx_client()
+        return first, second
+
+    assert asyncio.run(fetch()) == ({('USD', 'RUB'): 90.0}, {('USD', 'EUR'): 0.9})
+    assert requests == ['/key/latest/USD']
+    assert fx_client._client is None
+
+
+def test_cache_survives_new_event_loop(monkeypatch):
+    client, requests = client_with([200])
+    monkeypatch.setattr(fx_client, '_client', None)
+
+    async def first():
+        fx_client.get_fx_client()
+        monkeypatch.setattr(fx_client, '_client', client)
+        return await fx_client.fetch_rates([('USD', 'RUB')])
+
+    assert asyncio.run(first()) == {('USD', 'RUB'): 90.0}
+    # В новом цикле событий клиент другой, но ответ берется из кэша без запроса
+    assert asyncio.run(fx_client.fetch_rates([('USD', 'EUR')])) == {('USD', 'EUR'): 0.9}
+    assert fx_client._client is not client
+    assert requests == ['/key/latest/USD']
+    monkeypatch.setattr(fx_client, '_client', None)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from database import Session, AsyncSession
+from models import Investor
+from investor_keyboard import fetch_investor_page, investor_keyboard, PAGE_CALLBACK
+
+PAGE_SIZE = 3
+# Одинаковые имена: порядок между ними задает id
+NAMES = ['Алексеев', 'Борисов', 'Борисов', 'Васильев', 'Григорьев', 'Григорьев', 'Дмитриев']
+
+
+@pytest.fixture
+def investors(db):
+    """id инвесторов в порядке (full_name, id)"""
+    with Session() as session:
+        rows = [Investor(full_name=name) for name in NAMES]
+        session.add_all(rows)
+        session.commit()
+        return [investor.id for investor in sorted(rows, key=lambda investor: (investor.full_name, investor.id))]
+
+
+def page(direction=None, investor_id=None, page_size=PAGE_SIZE):
+    async def fetch():
+        async with AsyncSession() as session:
+            rows, has_prev, has_next = await fetch_investor_page(session, direction, investor_id, page_size)
+            return [investor.id for investor in rows], has_prev, has_next
+    return asyncio.run(fetch())
+
+
+def test_first_page(investors):
+    assert page() == (investors[:3], False, True)
+
+
+def test_next_pages_to_the_end(investors):
+    assert page('next', investors[2]) == (investors[3:6], True, True)
+    assert page('next', investors[5]) == (investors[6:], True, False)
+
+
+def test_next_splits_equal_names_by_id(investors):
+    # Граница страницы между двумя "Борисов" и между двумя "Григорьев"
+    assert page('next', investors[1], page_size=2) == (investors[2:4], True, True)
+    assert page('next', investors[4], page_size=2) == (investors[5:7], True, False)
+
+
+def test_exact_last_page_has_no_next(investors):
+    assert page('next', investors[3]) == (investors[4:7], True, False)
+
+
+def test_prev_returns_previous_page(investors):
+    assert page('prev', investors[6]) == (investors[3:6], True, True)
+
+
+def test_prev_near_start_returns_full_first_page(investors):
+    assert page('prev', investors[3]) == (investors[:3], False, True)
+    assert page('prev', investors[1]) == (investors[:3], False, True)
+
+
+def test_deleted_cursor_starts_over(investors):
+    with Session() as session:
+        session.delete(session.get(Investor, investors[2]))
+        session.commit()
+    assert page('next', investors[2]) == ([investors[0], investors[1], investors[3]], False, True)
+
+
+def test_empty_list(db):
+    assert page() == ([], False, False)
+
+
+def test_keyboard_navigation_buttons(investors):
+    async def keyboard():
+        async with AsyncSession() as session:
+            return await investor_keyboard(session, 'inv_calc_', 'next', investors[2])
+    markup, rows = asyncio.run(keyboard())
+    buttons = [button.callback_data for row in markup.inline_keyboard for button in row]
+    page_ids = [investor.id for investor in rows]
+    assert [f'inv_calc_{investor_id}' for investor_id in page_ids] == buttons[:len(page_ids)]
+    assert f'{PAGE_CALLBACK}:inv_calc_:prev:{page_ids[0]}' in buttons
+    assert buttons[-1] == 'cancel'
+
+
+def test_next_after_deleted_tail_starts_over(investors):
+    with Session() as session:
+        for investor_id in investors[3:]:
+            session.delete(session.get(Investor, investor_id))
+        session.commit()
+    assert page('next', investors[2]) == (investors[:3], False, False)
+
+
+def test_keyboard_after_deleted_tail(investors):
+    with Session() as session:
+        for investor_id in investors[3:]:
+            session.delete(session.get(Investor, investor_id))
+        session.commit()
+
+    async def keyboard():
+        async with AsyncSession() as session:
+            return await investor_keyboard(session, 'inv_calc_', 'next', investors[2])
+    markup, rows = asyncio.run(keyboard())
+    assert [investor.id for investor in rows] == investors[:3]
+    assert markup.inline_keyboard[-1][0].callback_data == 'cancel'
@@ -0,0 +1,88 @@
+import re
+import asyncio
+from datetime import date
+
+import pytest
+
+from database import Session, AsyncSession
+from models import Investor, Transfer, ExchangeRate, Currency
+
+DAY = date(2024, 3, 1)
+NEXT_DAY = date(2024, 3, 2)
+# (сумма, дата); переводы одного дня идут в порядке id
+TRANSFERS = [(1.0, NEXT_DAY), (2.0, DAY), (3.0, DAY), (4.0, NEXT_DAY), (5.0, DAY), (6.0, NEXT_DAY), (7.0, DAY)]
+
+
+@pytest.fixture
+def investor(db):
+    with Session() as session:
+        investor = Investor(full_name='Иванов Иван')
+        session.add(investor)
+        session.flush()
+        session.add_all([
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=90.0, date=DAY),
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=92.0, date=NEXT_DAY),
+        ])
+        session.add_all([
+            Transfer(investor_id=investor.id, amount=amount, currency=Currency.USD, transfer_date=day)
+            for amount, day in TRANSFERS
+        ])
+        session.commit()
+        return investor.id
+
+
+def fetch_page(main, investor_id, max_chars, after=None, start=1):
+    async def fetch():
+        async with AsyncSession() as session:
+            return await main.get_investor_transfers_page(session, investor_id, 'RUB', max_chars, after, start)
+    return asyncio.run(fetch())
+
+
+def all_pages(main, investor_id, max_chars):
+    pages = []
+    after, start = None, 1
+    while True:
+        name, text, next_page = fetch_page(main, investor_id, max_chars, after, start)
+        pages.append(text)
+        if next_page is None:
+            return name, pages
+        after, start = next_page
+
+
+def amounts(text):
+    return [float(amount) for amount in re.findall(r"Сумма: ([\d.]+) USD", text)]
+
+
+def test_pages_follow_date_and_id_order(main, investor):
+    line = len(main.format_transfer(1, {
+        'date': '01.03.2024', 'amount': 1.0, 'currency': 'USD', 'amount_in_target': 90.0, 'rate': 90.0
+    }, 'RUB'))
+    name, pages = all_pages(main, investor, max_chars=2 * line + 10)
+    assert name == 'Иванов Иван'
+    assert [len(amounts(text)) for text in pages] == [2, 2, 2, 1]
+    assert all(len(text) <= 2 * line + 10 for text in pages)
+    assert [amount for text in pages for amount in amounts(text)] == [2.0, 3.0, 5.0, 7.0, 1.0, 4.0, 6.0]
+    # Нумерация строк продолжается со страницы на страницу
+    numbers = [int(number) for text in pages for number in re.findall(r"^(\d+)\. Дата", text, re.M)]
+    assert numbers == list(range(1, len(TRANSFERS) + 1))
+
+
+def test_line_longer_than_limit_still_fills_page(main, investor):
+    _, pages = all_pages(main, investor, max_chars=10)
+    assert [len(amounts(text)) for text in pages] == [1] * len(TRANSFERS)
+
+
+def test_single_page(main, investor):
+    name, text, next_page = fetch_page(main, investor, max_chars=4096)
+    assert len(amounts(text)) == len(TRANSFERS)
+    assert next_page is None
+
+
+def test_missing_rate_and_unknown_investor(main, investor):
+    with Session() as session:
+        session.add(Transfer(investor_id=investor, amount=8.0, currency=Currency.EUR, transfer_date=DAY))
+        session.commit()
+    name, text, next_page = fetch_page(main, investor, max_chars=4096)
+    assert name is None and text.startswith("Ошибка") and next_page is None
+
+    assert fetch_page(main, investor + 100, max_chars=4096) == (None, "Инвестор не найден", None)
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import select, delete
+
+from database import Session, AsyncSession
+from models import (
+    Investor, Transfer, Purchase, ServicePurchase, ExchangeRate, LedgerTotal, LedgerBuild, Currency, PeriodUnit
+)
+import ledger_totals
+from ledger_totals import INVESTMENTS, PURCHASES
+
+DAY = date(2024, 3, 1)
+
+
+def balance():
+    async def read():
+        async with AsyncSession() as session:
+            return await ledger_totals.get_balance(session, 'RUB')
+    return asyncio.run(read())
+
+
+def differences():
+    with Session() as session:
+        return ledger_totals.verify(session, 'RUB')
+
+
+@pytest.fixture
+def ledger(db):
+    """Записи, добавленные до того, как итоги построены (как в базе до появления ledger_totals)"""
+    with Session() as session:
+        # Миграция построила итоги по пустой базе
+        session.execute(delete(LedgerTotal))
+        session.execute(delete(LedgerBuild))
+        investor = Investor(full_name='Иванов Иван')
+        session.add(investor)
+        session.flush()
+        session.add_all([
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=90.0, date=DAY),
+            ExchangeRate(from_currency='RUB', to_currency='USD', rate=1 / 90.0, date=DAY),
+            Transfer(investor_id=investor.id, amount=1000.0, currency=Currency.RUB, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=1000.0, currency=Currency.RUB, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=10.0, currency=Currency.USD, transfer_date=DAY),
+            Purchase(investor_id=investor.id, service_name='Курс', amount=300.0, currency=Currency.RUB,
+                     purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH),
+            ServicePurchase(service_name='Нейросеть', amount=2.0, currency=Currency.USD,
+                            purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH),
+        ])
+        session.commit()
+        return investor.id
+
+
+# Вложения 1000 + 1000 + 10 * 90, закупки 300 + 2 * 90
+EXPECTED_BALANCE = 2900.0 - 480.0
+
+
+def test_balance_is_computed_fully_until_built(ledger):
+    assert balance() is None
+
+
+def test_build_matches_full_computation(ledger):
+    ledger_totals.build()
+    assert differences() == []
+    assert balance() == pytest.approx(EXPECTED_BALANCE)
+
+
+def test_record_entry_before_build_creates_no_totals(ledger):
+    async def add_transfer():
+        async with AsyncSession() as session:
+            session.add(Transfer(investor_id=ledger, amount=5.0, currency=Currency.RUB, transfer_date=DAY))
+            await ledger_totals.record_entry(session, INVESTMENTS, Currency.RUB, 5.0, DAY)
+            await session.commit()
+    asyncio.run(add_transfer())
+    assert balance() is None
+
+    # Построение после этого учитывает все записи, включая новую
+    ledger_totals.build()
+    assert differences() == []
+    assert balance() == pytest.approx(EXPECTED_BALANCE + 5.0)
+
+
+def test_record_entry_after_build(ledger):
+    ledger_totals.build()
+
+    async def add_entries():
+        async with AsyncSession() as session:
+            session.add(Transfer(investor_id=ledger, amount=3.0, currency=Currency.USD, transfer_date=DAY))
+            await ledger_totals.record_entry(session, INVESTMENTS, Currency.USD, 3.0, DAY)
+            session.add(ServicePurchase(service_name='Хостинг', amount=100.0, currency=Currency.RUB,
+                                        purchase_date=DAY, period=1, period_unit=PeriodUnit.YEAR))
+            await ledger_totals.record_entry(session, PURCHASES, Currency.RUB, 100.0, DAY)
+            await session.commit()
+    asyncio.run(add_entries())
+
+    assert differences() == []
+    assert balance() == pytest.approx(EXPECTED_BALANCE + 270.0 - 100.0)
+
+
+def test_missing_rate_until_rate_is_added(ledger):
+    ledger_totals.build()
+
+    async def add_eur_transfer():
+        async with AsyncSession() as session:
+            session.add(Transfer(investor_id=ledger, amount=10.0, currency=Currency.EUR, transfer_date=DAY))
+            await ledger_totals.record_entry(session, INVESTMENTS, Currency.EUR, 10.0, DAY)
+            await session.commit()
+    asyncio.run(add_eur_transfer())
+    # Запись без курса: остаток считается полностью, чтобы показать ошибку
+    assert balance() is None
+
+    async def add_rate():
+        async with AsyncSession() as session:
+            session.add(ExchangeRate(from_currency='EUR', to_currency='RUB', rate=100.0, date=DAY))
+            await ledger_totals.refresh_for_rate(session, 'EUR', 'RUB')
+            await session.commit()
+    asyncio.run(add_rate())
+
+    assert differences() == []
+    assert balance() == pytest.approx(EXPECTED_BALANCE + 1000.0)
+
+
+def test_clean_duplicates_keeps_totals_consistent(ledger):
+    from clean_duplicates import clean_duplicates
+
+    ledger_totals.build()
+    assert clean_duplicates(Transfer, chunk_size=1) == 1
+    assert differences() == []
+    assert balance() == pytest.approx(EXPECTED_BALANCE - 1000.0)
+
+
+def test_clean_duplicates_in_chunks_with_missing_rates(ledger):
+    from clean_duplicates import clean_duplicates
+
+    with Session() as session:
+        for _ in range(3):
+            session.add(ServicePurchase(service_name='Нейросеть', amount=2.0, currency=Currency.USD,
+                                        purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH))
+            session.add(ServicePurchase(service_name='Хостинг', amount=5.0, currency=Currency.EUR,
+                                        purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH))
+        session.commit()
+    ledger_totals.build()
+    assert balance() is None
+
+    # Остается по одной записи из группы; курса EUR нет, он по-прежнему учитывается как пропущенный
+    assert clean_duplicates(ServicePurchase, chunk_size=2) == 5
+    assert differences() == []
+    with Session() as session:
+        eur = session.execute(
+            select(LedgerTotal.amount, LedgerTotal.missing)
+            .where(LedgerTotal.kind == PURCHASES, LedgerTotal.currency == 'EUR')
+        ).one()
+    assert tuple(eur) == (5.0, 1)
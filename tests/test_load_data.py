@@ -0,0 +1,78 @@
+import functools
+
+import pytest
+from openpyxl import Workbook
+from sqlalchemy import select, func
+
+import excel_stream
+import load_data
+import ledger_totals
+from database import Session
+from models import Investor, Transfer, ServicePurchase
+from excel_stream import TRANSFER_COLUMNS, SERVICE_PAYMENT_COLUMNS
+
+TRANSFERS = [
+    ['Иванов Иван', '1 000', 'RUB', '2024-03-01'],
+    ['Петров Петр', '500,5', 'RUB', '2024-03-01'],
+    ['Иванов Иван', '1 000', 'RUB', '2024-03-01'],
+    ['Иванов Иван', '1000', 'RUB', '2024-03-02'],
+    ['Петров Петр', '500.5', 'RUB', '2024-03-01'],
+]
+SERVICE_PAYMENTS = [
+    ['Хостинг', '100', 'RUB', '2024-03-01', '1', 'MONTH'],
+    ['Нейросеть', '20', 'RUB', '2024-03-01', 'бессрочно', None],
+    ['Хостинг', '100', 'RUB', '2024-03-01', '1', 'MONTH'],
+    ['Хостинг', '100', 'RUB', '2024-04-01', '1', 'MONTH'],
+    ['Нейросеть', '20', 'RUB', '2024-03-01', 'бессрочно', None],
+]
+
+
+def write_workbook(path, columns, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def count(model):
+    with Session() as session:
+        return session.scalar(select(func.count(model.id)))
+
+
+@pytest.fixture(params=[1, 2, 1000], ids=lambda size: f"chunk{size}")
+def chunk_size(request, monkeypatch):
+    monkeypatch.setattr(load_data, 'iter_excel_chunks',
+                        functools.partial(excel_stream.iter_excel_chunks, chunk_size=request.param))
+    return request.param
+
+
+def test_transfers_deduplicated_across_chunks(db, tmp_path, chunk_size):
+    path = write_workbook(tmp_path / 'transfers.xlsx', TRANSFER_COLUMNS, TRANSFERS)
+    load_data.load_investor_transfers(path)
+    assert count(Transfer) == 3
+    assert count(Investor) == 2
+
+    # Повторная загрузка того же файла ничего не добавляет
+    load_data.load_investor_transfers(path)
+    assert count(Transfer) == 3
+
+
+def test_service_purchases_deduplicated_across_chunks(db, tmp_path, chunk_size):
+    path = write_workbook(tmp_path / 'service_payments.xlsx', SERVICE_PAYMENT_COLUMNS, SERVICE_PAYMENTS)
+    load_data.load_service_purchases(path)
+    assert count(ServicePurchase) == 3
+
+    load_data.load_service_purchases(path)
+    assert count(ServicePurchase) == 3
+
+
+def test_load_keeps_ledger_totals_consistent(db, tmp_path):
+    load_data.load_investor_transfers(write_workbook(tmp_path / 'transfers.xlsx', TRANSFER_COLUMNS, TRANSFERS))
+    load_data.load_service_purchases(
+        write_workbook(tmp_path / 'service_payments.xlsx', SERVICE_PAYMENT_COLUMNS, SERVICE_PAYMENTS)
+    )
+    with Session() as session:
+        assert ledger_totals.verify(session, 'RUB') == []
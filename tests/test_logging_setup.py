@@ -0,0 +1,32 @@
+import logging
+
+import pytest
+
+import logging_setup
+
+
+@pytest.fixture
+def root_logger(tmp_path, monkeypatch):
+    # Файлы логов создаются в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    yield root
+    logging_setup.stop_logging()
+    root.handlers[:], root.level = saved
+
+
+def test_queue_handler_replaces_existing_configuration(root_logger, tmp_path):
+    # Корневой логгер уже настроен, например, импортированным скриптом
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    logging_setup.setup_logging()
+
+    assert root_logger.handlers == [logging_setup._queue_handler]
+    logging.getLogger('finance_bot.test').info("запись через очередь")
+    logging.getLogger(logging_setup.CURRENCY_LOGGER).info("курс валюты")
+    logging_setup.stop_logging()
+
+    bot_log = (tmp_path / 'bot_logs.log').read_text(encoding='utf-8')
+    currency_log = (tmp_path / 'currency_api_logs.log').read_text(encoding='utf-8')
+    assert "запись через очередь" in bot_log and "курс валюты" in bot_log
+    assert "курс валюты" in currency_log and "запись через очередь" not in currency_log
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from database import Session, AsyncSession
+from models import Investor, Transfer, Purchase, ExchangeRate, Currency, PeriodUnit
+from rates import rate_cache, MISSING
+from report_cache import report_cache
+
+DAY = date(2024, 3, 1)
+
+
+@pytest.fixture
+def main_fixed(db, monkeypatch):
+    import main_fixed
+
+    requested = []
+
+    async def fetch_rates(pairs):
+        requested.append(set(pairs))
+        return {pair: {'USD': 90.0, 'EUR': 100.0}[pair[0]] for pair in pairs}
+    monkeypatch.setattr(main_fixed, 'fetch_rates', fetch_rates)
+    return main_fixed, requested
+
+
+def test_treasury_fetches_and_saves_missing_rates(main_fixed):
+    main_fixed, requested = main_fixed
+    with Session() as session:
+        investor = Investor(full_name='Иванов Иван')
+        session.add(investor)
+        session.flush()
+        session.add_all([
+            ExchangeRate(from_currency='USD', to_currency='RUB', rate=80.0, date=DAY),
+            Transfer(investor_id=investor.id, amount=10.0, currency=Currency.USD, transfer_date=DAY),
+            Transfer(investor_id=investor.id, amount=1.0, currency=Currency.EUR, transfer_date=DAY),
+            Purchase(investor_id=investor.id, service_name='Курс', amount=100.0, currency=Currency.RUB,
+                     purchase_date=DAY, period=1, period_unit=PeriodUnit.MONTH),
+        ])
+        session.commit()
+    rate_cache.put('EUR', 'RUB', DAY, MISSING)
+    version = report_cache.version
+
+    async def treasury():
+        async with AsyncSession() as session:
+            return await main_fixed.calculate_treasury(session, Currency.RUB)
+
+    # Сохраненный курс USD берется из базы, курс EUR запрашивается у API
+    assert asyncio.run(treasury()) == pytest.approx(800.0 + 100.0 - 100.0)
+    assert requested == [{('EUR', 'RUB')}]
+    with Session() as session:
+        saved = dict(session.execute(
+            select(ExchangeRate.from_currency, ExchangeRate.rate).where(ExchangeRate.to_currency == 'RUB')
+        ).all())
+        inverse = session.scalar(select(ExchangeRate.rate).where(ExchangeRate.from_currency == 'RUB',
+                                                                 ExchangeRate.to_currency == 'EUR'))
+    assert saved == {'USD': 80.0, 'EUR': 100.0}
+    assert inverse == pytest.approx(0.01)
+    # Кэши сброшены так же, как при вводе курса в боте
+    assert report_cache.version > version
+    assert rate_cache.get('EUR', 'RUB', DAY) is None
+
+    # Второй расчет берет все курсы из базы
+    asyncio.run(treasury())
+    assert len(requested) == 1
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import persistence
+from persistence import SqlitePersistence
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'bot_state.sqlite')
+
+
+def recording(store):
+    """Запоминает, что передается на запись в каждой транзакции"""
+    writes = []
+    write = store._write
+
+    def record(dropped, pending):
+        writes.append((dropped, pending))
+        write(dropped, pending)
+    store._write = record
+    return writes
+
+
+def reload(path):
+    async def read():
+        store = SqlitePersistence(path)
+        try:
+            return (await store.get_user_data(), await store.get_chat_data(),
+                    await store.get_conversations('transfer'))
+        finally:
+            await store.flush()
+    return asyncio.run(read())
+
+
+def test_state_survives_restart(path):
+    async def write():
+        store = SqlitePersistence(path)
+        await store.update_user_data(1, {'from_currency': 'USD', 'rate_date': (2024, 3, 1)})
+        await store.update_chat_data(-5, {'page': 2})
+        await store.update_conversation('transfer', (-5, 1), 'TRANSFER_AMOUNT')
+        await store.flush()
+    asyncio.run(write())
+
+    assert reload(path) == (
+        {1: {'from_currency': 'USD', 'rate_date': (2024, 3, 1)}},
+        {-5: {'page': 2}},
+        {(-5, 1): 'TRANSFER_AMOUNT'},
+    )
+
+
+def test_only_changed_keys_are_written(path):
+    async def write():
+        store = SqlitePersistence(path)
+        await store.update_user_data(1, {'a': 1, 'b': 2})
+        await store.flush()
+
+        store = SqlitePersistence(path)
+        writes = recording(store)
+        # То же значение не записывается, измененный ключ - только он
+        await store.update_user_data(1, {'a': 1, 'b': 2})
+        await store.update_user_data(1, {'a': 1, 'b': 3})
+        await store.flush()
+        return writes
+    writes = asyncio.run(write())
+    assert len(writes) == 1
+    dropped, pending = writes[0]
+    assert dropped == []
+    assert [(kind, owner) for kind, owner, _ in pending] == [('user', '1')]
+    assert reload(path)[0] == {1: {'a': 1, 'b': 3}}
+
+
+def test_changes_within_delay_share_a_transaction(path, monkeypatch):
+    monkeypatch.setattr(persistence, 'PERSISTENCE_FLUSH_DELAY', 0.05)
+
+    async def write():
+        store = SqlitePersistence(path)
+        writes = recording(store)
+        for user_id in range(3):
+            await store.update_user_data(user_id, {'n': user_id})
+        await asyncio.sleep(0.2)
+        await store.flush()
+        return writes
+    writes = asyncio.run(write())
+    assert len(writes) == 1
+    assert len(writes[0][1]) == 3
+
+
+def test_removed_keys_and_dropped_owners_are_deleted(path):
+    async def write():
+        store = SqlitePersistence(path)
+        await store.update_user_data(1, {'a': 1, 'b': 2})
+        await store.update_chat_data(-5, {'page': 2})
+        await store.update_conversation('transfer', (-5, 1), 'TRANSFER_AMOUNT')
+        await store.flush()
+
+        store = SqlitePersistence(path)
+        await store.update_user_data(1, {'a': 1})
+        await store.drop_chat_data(-5)
+        await store.update_conversation('transfer', (-5, 1), None)
+        await store.flush()
+    asyncio.run(write())
+
+    assert reload(path) == ({1: {'a': 1}}, {}, {})
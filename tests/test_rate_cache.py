@@ -0,0 +1,190 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select, func
+
+import rates
+import rate_matrix
+import conversion
+from database import Session
+from models import ExchangeRate, Investor, Transfer, Currency
+from rates import RateCache, RateHistory, MISSING
+from rate_matrix import RateMatrix
+
+DAY = date(2024, 3, 1)
+
+
+class InvalidatingSession:
+    """Обертка сессии: выполняет action после запроса, как если бы курс изменился во время чтения"""
+
+    def __init__(self, session_factory, action):
+        self.session_factory = session_factory
+        self.action = action
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        self.session = self.session_factory()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def execute(self, *args, **kwargs):
+        result = await self.session.execute(*args, **kwargs)
+        self.action()
+        return result
+
+
+def add_rate(from_currency, to_currency, rate, day=DAY):
+    with Session() as session:
+        session.add(ExchangeRate(from_currency=from_currency, to_currency=to_currency, rate=rate, date=day))
+        session.commit()
+
+
+def test_invalidate_removes_rate_and_inverse():
+    cache = RateCache()
+    cache.put('USD', 'RUB', DAY, 90.0)
+    cache.put('RUB', 'USD', DAY, 1 / 90.0)
+    cache.put('EUR', 'RUB', DAY, 100.0)
+    cache.invalidate('USD', 'RUB', DAY)
+    assert cache.get('USD', 'RUB', DAY) is None
+    assert cache.get('RUB', 'USD', DAY) is None
+    assert cache.get('EUR', 'RUB', DAY) == 100.0
+
+
+def test_missing_rate_is_cached():
+    cache = RateCache()
+    cache.put('USD', 'RUB', DAY, MISSING)
+    assert cache.get('USD', 'RUB', DAY) is MISSING
+
+
+def test_put_after_invalidate_is_dropped():
+    cache = RateCache()
+    # Курс прочитан из базы, а до сохранения в кэш его перезаписали
+    generation = cache.generation
+    cache.invalidate('USD', 'RUB', DAY)
+    cache.put('USD', 'RUB', DAY, MISSING, generation)
+    assert cache.get('USD', 'RUB', DAY) is None
+
+    cache.put('USD', 'RUB', DAY, 90.0, cache.generation)
+    assert cache.get('USD', 'RUB', DAY) == 90.0
+
+
+def test_lru_eviction():
+    cache = RateCache(maxsize=2)
+    cache.put('USD', 'RUB', DAY, 90.0)
+    cache.put('EUR', 'RUB', DAY, 100.0)
+    cache.get('USD', 'RUB', DAY)
+    cache.put('UAH', 'RUB', DAY, 2.0)
+    assert cache.get('EUR', 'RUB', DAY) is None
+    assert cache.get('USD', 'RUB', DAY) == 90.0
+
+
+def test_preload_and_clear(db):
+    add_rate('USD', 'RUB', 90.0)
+    cache = RateCache()
+    asyncio.run(cache.preload('RUB'))
+    assert cache.get('USD', 'RUB', DAY) == 90.0
+
+    cache.clear()
+    assert cache.get('USD', 'RUB', DAY) is None
+    # После clear() валюта загружается заново
+    asyncio.run(cache.preload('RUB'))
+    assert cache.get('USD', 'RUB', DAY) == 90.0
+
+
+def test_preload_discarded_after_concurrent_invalidate(db, monkeypatch):
+    add_rate('USD', 'RUB', 90.0)
+    cache = RateCache()
+    monkeypatch.setattr(rates, 'AsyncSession', InvalidatingSession(
+        rates.AsyncSession, lambda: cache.invalidate('USD', 'RUB', DAY)
+    ))
+    asyncio.run(cache.preload('RUB'))
+    assert cache.get('USD', 'RUB', DAY) is None
+
+    monkeypatch.undo()
+    asyncio.run(cache.preload('RUB'))
+    assert cache.get('USD', 'RUB', DAY) == 90.0
+
+
+def test_history_load_keeps_concurrent_update(db, monkeypatch):
+    add_rate('USD', 'RUB', 90.0)
+    history = RateHistory()
+    monkeypatch.setattr(rates, 'AsyncSession', InvalidatingSession(
+        rates.AsyncSession, lambda: history.update_pair('USD', 'RUB', DAY, 95.0)
+    ))
+    asyncio.run(history.load())
+    assert history.lookup('USD', 'RUB', DAY) == 95.0
+
+    # Загрузка не состоялась и повторяется при следующем вызове
+    monkeypatch.undo()
+    add_rate('EUR', 'RUB', 100.0)
+    asyncio.run(history.load())
+    assert history.lookup('EUR', 'RUB', DAY) == 100.0
+
+
+def test_history_clear_reloads(db):
+    add_rate('USD', 'RUB', 90.0)
+    history = RateHistory()
+    asyncio.run(history.load())
+    add_rate('EUR', 'RUB', 100.0)
+    asyncio.run(history.load())
+    assert history.lookup('EUR', 'RUB', DAY) is None
+
+    history.clear()
+    asyncio.run(history.load())
+    assert history.lookup('EUR', 'RUB', DAY) == 100.0
+
+
+def test_matrix_not_stored_after_concurrent_invalidate(db, monkeypatch):
+    add_rate('USD', 'RUB', 90.0)
+    matrix = RateMatrix()
+    monkeypatch.setattr(rate_matrix, 'AsyncSession', InvalidatingSession(
+        rate_matrix.AsyncSession, lambda: matrix.invalidate(DAY)
+    ))
+    assert asyncio.run(matrix.lookup('USD', 'RUB', DAY)) == 90.0
+
+    monkeypatch.undo()
+    add_rate('EUR', 'USD', 1.1)
+    # Матрица, построенная до сброса, не сохранилась: кросс-курс учитывает новый курс
+    assert asyncio.run(matrix.lookup('EUR', 'RUB', DAY)) == 1.1 * 90.0
+
+
+def test_history_lookup_staleness_boundary():
+    history = RateHistory()
+    history.update('USD', 'RUB', DAY, 90.0)
+    history.update('USD', 'RUB', DAY + timedelta(days=10), 95.0)
+    assert history.lookup('USD', 'RUB', DAY - timedelta(days=1), 7) is None
+    assert history.lookup('USD', 'RUB', DAY, 7) == 90.0
+    # Курс ровно max_staleness_days дней назад еще подходит, днем раньше - уже нет
+    assert history.lookup('USD', 'RUB', DAY + timedelta(days=7), 7) == 90.0
+    assert history.lookup('USD', 'RUB', DAY + timedelta(days=8), 7) is None
+    assert history.lookup('USD', 'RUB', DAY + timedelta(days=10), 7) == 95.0
+    assert history.lookup('RUB', 'USD', DAY, 7) is None
+
+
+@pytest.mark.parametrize('days, expected', [(0, 90.0), (7, 90.0), (8, None)])
+def test_sql_asof_lookup_matches_history(db, monkeypatch, days, expected):
+    monkeypatch.setattr(rates, 'RATE_LOOKUP_MODE', 'asof')
+    monkeypatch.setattr(conversion, 'RATE_LOOKUP_MODE', 'asof')
+    monkeypatch.setattr(conversion, 'RATE_MAX_STALENESS_DAYS', 7)
+    monkeypatch.setattr(rates, 'RATE_MAX_STALENESS_DAYS', 7)
+    add_rate('USD', 'RUB', 90.0)
+    day = DAY + timedelta(days=days)
+    with Session() as session:
+        investor = Investor(full_name='Иванов Иван')
+        session.add(investor)
+        session.flush()
+        session.add(Transfer(investor_id=investor.id, amount=1.0, currency=Currency.USD, transfer_date=day))
+        session.commit()
+
+        # Курс в SQL-конвертации отчетов, в синхронном поиске и в истории курсов совпадает
+        source, rate = conversion.rate_join(session, Transfer, Transfer.transfer_date, 'RUB')
+        assert session.scalar(select(func.max(rate)).select_from(source)) == expected
+        assert rates.lookup_rate(session, 'USD', 'RUB', day) == expected
+    history = RateHistory()
+    asyncio.run(history.load())
+    assert history.lookup('USD', 'RUB', day, 7) == expected
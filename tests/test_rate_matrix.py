@@ -0,0 +1,58 @@
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+from database import Session
+from models import ExchangeRate
+from rate_matrix import build_matrix, RateMatrix, CURRENCY_INDEX
+
+DAY = date(2024, 3, 1)
+
+
+def rate(matrix, from_currency, to_currency):
+    return matrix[CURRENCY_INDEX[from_currency]][CURRENCY_INDEX[to_currency]]
+
+
+def test_direct_and_same_currency_rates():
+    matrix = build_matrix({('USD', 'RUB'): 90.0, ('XXX', 'RUB'): 1.0})
+    assert rate(matrix, 'USD', 'RUB') == 90.0
+    assert rate(matrix, 'EUR', 'EUR') == 1.0
+    # Обратный курс не выводится: его хранит база вместе с прямым
+    assert rate(matrix, 'RUB', 'USD') is None
+
+
+def test_cross_rate_through_pivot_is_preferred():
+    matrix = build_matrix({
+        ('EUR', 'USD'): 1.1, ('USD', 'RUB'): 90.0,
+        ('EUR', 'UAH'): 45.0, ('UAH', 'RUB'): 2.5,
+    })
+    assert rate(matrix, 'EUR', 'RUB') == pytest.approx(1.1 * 90.0)
+
+
+def test_shortest_path_without_pivot():
+    matrix = build_matrix({
+        ('UAH', 'TRY'): 0.8, ('TRY', 'INR'): 2.6, ('INR', 'RUB'): 1.1,
+        ('UAH', 'EUR'): 0.02, ('EUR', 'RUB'): 100.0,
+    })
+    # Через EUR два шага, через TRY и INR - три
+    assert rate(matrix, 'UAH', 'RUB') == pytest.approx(0.02 * 100.0)
+    assert rate(matrix, 'UAH', 'INR') == pytest.approx(0.8 * 2.6)
+    assert rate(matrix, 'RUB', 'UAH') is None
+
+
+def test_matrix_cache_keeps_recent_days(db):
+    with Session() as session:
+        for offset in range(3):
+            session.add(ExchangeRate(from_currency='USD', to_currency='RUB', rate=90.0 + offset,
+                                     date=DAY + timedelta(days=offset)))
+        session.commit()
+    matrix = RateMatrix(max_days=2)
+
+    async def lookups():
+        return [await matrix.lookup('USD', 'RUB', DAY + timedelta(days=offset)) for offset in range(3)]
+    assert asyncio.run(lookups()) == [90.0, 91.0, 92.0]
+    assert list(matrix._days) == [DAY + timedelta(days=1), DAY + timedelta(days=2)]
+
+    matrix.invalidate(DAY + timedelta(days=2))
+    assert list(matrix._days) == [DAY + timedelta(days=1)]
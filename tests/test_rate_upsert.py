@@ -0,0 +1,70 @@
+import asyncio
+from datetime import date
+
+from sqlalchemy import select
+
+from database import AsyncSession
+from models import ExchangeRate
+from rates import upsert_rate_pair, upsert_rates
+
+DAY = date(2024, 3, 1)
+
+
+def upsert(from_currency, to_currency, rate, day=DAY):
+    async def write():
+        async with AsyncSession() as session:
+            inserted = await upsert_rate_pair(session, from_currency, to_currency, day, rate)
+            await session.commit()
+            return inserted
+    return asyncio.run(write())
+
+
+def saved_rates():
+    async def read():
+        async with AsyncSession() as session:
+            result = await session.execute(
+                select(ExchangeRate.from_currency, ExchangeRate.to_currency, ExchangeRate.date, ExchangeRate.rate)
+            )
+            return {(row_from, row_to, row_date): rate for row_from, row_to, row_date, rate in result.all()}
+    return asyncio.run(read())
+
+
+def test_insert_then_update(db):
+    assert upsert('USD', 'RUB', 90.0) is True
+    assert saved_rates() == {('USD', 'RUB', DAY): 90.0, ('RUB', 'USD', DAY): 1 / 90.0}
+
+    assert upsert('USD', 'RUB', 95.0) is False
+    assert saved_rates() == {('USD', 'RUB', DAY): 95.0, ('RUB', 'USD', DAY): 1 / 95.0}
+
+
+def test_inverse_pair_counts_as_update(db):
+    upsert('USD', 'RUB', 90.0)
+    # Обратный курс уже сохранен вместе с прямым
+    assert upsert('RUB', 'USD', 0.01) is False
+    assert saved_rates()[('USD', 'RUB', DAY)] == 100.0
+
+
+def test_other_date_is_inserted(db):
+    upsert('USD', 'RUB', 90.0)
+    assert upsert('USD', 'RUB', 91.0, date(2024, 3, 2)) is True
+    assert len(saved_rates()) == 4
+
+
+def test_upsert_many_returns_inserted_keys(db):
+    upsert('USD', 'RUB', 90.0)
+
+    async def write():
+        async with AsyncSession() as session:
+            inserted = await upsert_rates(session, {
+                ('USD', 'RUB', DAY): 91.0,
+                ('EUR', 'RUB', DAY): 100.0,
+                # Явно переданный курс важнее обратного к EUR/RUB
+                ('RUB', 'EUR', DAY): 0.02,
+            })
+            await session.commit()
+            return inserted
+    assert asyncio.run(write()) == {('EUR', 'RUB', DAY), ('RUB', 'EUR', DAY)}
+    assert saved_rates() == {
+        ('USD', 'RUB', DAY): 91.0, ('RUB', 'USD', DAY): 1 / 91.0,
+        ('EUR', 'RUB', DAY): 100.0, ('RUB', 'EUR', DAY): 0.02,
+    }
@@ -0,0 +1,88 @@
+import asyncio
+
+from database import Session
+from report_cache import ReportCache, bump_data_version
+
+
+def test_hit_and_miss():
+    cache = ReportCache()
+    assert cache.get('key') == (False, None)
+    cache.put('key', cache.version, 42)
+    assert cache.get('key') == (True, 42)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_bump_clears_results_and_notifies():
+    cache = ReportCache()
+    calls = []
+    cache.on_bump.append(lambda: calls.append('bump'))
+    cache.put('key', cache.version, 42)
+    cache.bump()
+    assert cache.get('key') == (False, None)
+    assert calls == ['bump']
+    assert cache.changed_within(60)
+
+    # Сброс по сообщению другого процесса не рассылается дальше
+    cache.bump(local=True)
+    assert calls == ['bump']
+
+
+def test_put_after_bump_is_dropped():
+    cache = ReportCache()
+    # Отчет начал считаться до изменения данных
+    version = cache.version
+    cache.bump()
+    cache.put('key', version, 42)
+    assert cache.get('key') == (False, None)
+
+
+def bump_by_script():
+    with Session() as session:
+        bump_data_version(session)
+        session.commit()
+
+
+def test_script_change_clears_cache(db):
+    cache = ReportCache(check_seconds=0)
+    reset = []
+    cache.on_external_change.append(lambda: reset.append(True))
+    asyncio.run(cache.check_data_version())
+    cache.put('key', cache.version, 42)
+
+    # Проверка без изменений данных кэш не трогает
+    asyncio.run(cache.check_data_version())
+    assert cache.get('key') == (True, 42)
+
+    bump_by_script()
+    asyncio.run(cache.check_data_version())
+    assert cache.get('key') == (False, None)
+    assert reset == [True]
+
+
+def test_data_version_checked_with_interval(db):
+    cache = ReportCache(check_seconds=60)
+    asyncio.run(cache.check_data_version())
+    cache.put('key', cache.version, 42)
+    bump_by_script()
+    asyncio.run(cache.check_data_version())
+    assert cache.get('key') == (True, 42)
+
+
+def test_scripts_bump_data_version(db, tmp_path):
+    from openpyxl import Workbook
+    import load_data
+    from excel_stream import TRANSFER_COLUMNS
+
+    cache = ReportCache(check_seconds=0)
+    asyncio.run(cache.check_data_version())
+    cache.put('key', cache.version, 42)
+
+    workbook = Workbook()
+    workbook.active.append(TRANSFER_COLUMNS)
+    workbook.active.append(['Иванов Иван', '1000', 'RUB', '2024-03-01'])
+    workbook.save(tmp_path / 'transfers.xlsx')
+    load_data.load_investor_transfers(str(tmp_path / 'transfers.xlsx'))
+
+    asyncio.run(cache.check_data_version())
+    assert cache.get('key') == (False, None)
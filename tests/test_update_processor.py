@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Update, Message, Chat
+
+from update_processor import ChatSerializingUpdateProcessor
+
+
+def chat_update(update_id, chat_id):
+    return Update(update_id, message=Message(update_id, datetime.now(), Chat(chat_id, Chat.PRIVATE)))
+
+
+def test_updates_of_one_chat_run_in_order():
+    order = []
+
+    async def handle(name, delay):
+        order.append(('start', name))
+        await asyncio.sleep(delay)
+        order.append(('end', name))
+
+    async def run():
+        processor = ChatSerializingUpdateProcessor(4)
+        await asyncio.gather(
+            processor.process_update(chat_update(1, 1), handle('a1', 0.05)),
+            processor.process_update(chat_update(2, 1), handle('a2', 0)),
+            processor.process_update(chat_update(3, 2), handle('b1', 0)),
+        )
+        return processor
+
+    processor = asyncio.run(run())
+    assert order.index(('end', 'a1')) < order.index(('start', 'a2'))
+    # Другой чат не ждет первый
+    assert order.index(('end', 'b1')) < order.index(('end', 'a1'))
+    assert processor._chat_locks == {}
+
+
+def test_chat_backlog_does_not_block_other_chats():
+    async def run():
+        processor = ChatSerializingUpdateProcessor(2)
+        release = asyncio.Event()
+        other_done = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+
+        async def noop():
+            pass
+
+        async def other():
+            other_done.set()
+
+        # Первое обновление занятого чата занимает место, остальные ждут его замок
+        busy = [asyncio.ensure_future(processor.process_update(chat_update(1, 1), slow()))]
+        busy += [
+            asyncio.ensure_future(processor.process_update(chat_update(i, 1), noop()))
+            for i in range(2, 6)
+        ]
+        await asyncio.sleep(0)
+        asyncio.ensure_future(processor.process_update(chat_update(10, 2), other()))
+        try:
+            await asyncio.wait_for(other_done.wait(), 1)
+        finally:
+            release.set()
+            await asyncio.gather(*busy)
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit():
+    running = 0
+    peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def run():
+        processor = ChatSerializingUpdateProcessor(3)
+        await asyncio.gather(*(processor.process_update(chat_update(i, i), handle()) for i in range(10)))
+
+    asyncio.run(run())
+    assert peak == 3
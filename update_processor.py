@@ -0,0 +1,66 @@
+import os
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений из разных чатов может обрабатываться одновременно
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '16'))
+# Лимит семафора базового класса: он не ограничивает обработку,
+# иначе обновления, ожидающие свой чат, занимали бы места других чатов
+PENDING_UPDATES_LIMIT = 2 ** 31 - 1
+
+
+class ChatSerializingUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления из разных чатов параллельно,
+    а обновления одного чата - строго по очереди, чтобы состояния
+    ConversationHandler (перевод, покупка сервиса, курс) не гонялись между собой.
+    """
+
+    def __init__(self, max_concurrent_updates=BOT_CONCURRENT_UPDATES):
+        super().__init__(PENDING_UPDATES_LIMIT)
+        self.concurrent_updates_limit = max_concurrent_updates
+        # Места для обработки; создается в цикле событий, в котором работает бот
+        self._slots = None
+        # chat_id -> [замок, число ожидающих обновлений]
+        self._chat_locks = {}
+
+    @staticmethod
+    def _chat_id(update):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def _run(self, coroutine):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrent_updates_limit)
+        async with self._slots:
+            await coroutine
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await self._run(coroutine)
+            return
+
+        # Место для обработки берется под замком чата: очередь одного чата
+        # ждет на его замке и не занимает места, доступные другим чатам
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,67 @@
+import os
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Способ получения обновлений: polling (long polling), webhook (встроенный HTTP-сервер)
+# или worker (процесс-обработчик за front, см. cluster.py)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Адрес и порт, на которых встроенный сервер принимает обновления от Telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_URL_PATH = os.getenv('WEBHOOK_URL_PATH', '')
+# Публичный адрес вебхука, который сообщается Telegram (обычно https за прокси)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Telegram присылает этот токен в заголовке X-Telegram-Bot-Api-Secret-Token;
+# запросы без него сервер отклоняет
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+# Сколько одновременных соединений с вебхуком может открыть Telegram (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Другой адрес Bot API, например локальный сервер для замеров
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+
+
+def configure_builder(builder):
+    """Настраивает адрес Bot API в ApplicationBuilder, если он переопределен"""
+    if TELEGRAM_API_BASE_URL:
+        base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    return builder
+
+
+def require_webhook_url():
+    """Публичный адрес вебхука; без него Telegram некуда отправлять обновления"""
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не задан: укажите публичный адрес вебхука, который сообщается Telegram")
+    return WEBHOOK_URL
+
+
+def run_application(application):
+    """Запускает бота в режиме BOT_MODE"""
+    if BOT_MODE == 'webhook':
+        webhook_url = require_webhook_url()
+        if not WEBHOOK_SECRET_TOKEN:
+            logger.warning("WEBHOOK_SECRET_TOKEN не задан: вебхук примет запросы от кого угодно")
+        logger.info(f"Бот запущен в режиме webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_URL_PATH}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_URL_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    elif BOT_MODE == 'worker':
+        # Обновления приходят от front (cluster.py) через Unix-сокет
+        from cluster import run_worker
+        run_worker(application)
+    elif BOT_MODE == 'polling':
+        logger.info("Бот запущен в режиме polling")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling, webhook или worker)")